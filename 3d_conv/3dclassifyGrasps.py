@@ -129,7 +129,8 @@ def evaluate(learning_rate=0.001, n_epochs=2000,
         input=x,
         image_shape=(batch_size, newZ, nkerns[0], newX, newY),
         filter_shape=(nkerns[1], convsize, nkerns[0], convsize, convsize),
-        poolsize=None, drop=drop
+        poolsize=None, drop=drop,
+        conv_impl='auto'
     )
 
     newZ = numpy.round(newZ - convsize + 1)
@@ -149,7 +150,8 @@ def evaluate(learning_rate=0.001, n_epochs=2000,
         input=layer1.output,
         image_shape=(batch_size, newZ, nkerns[1], newX, newY),
         filter_shape=(nkerns[2], convsize, nkerns[1], convsize, convsize),
-        poolsize=2, drop=drop
+        poolsize=2, drop=drop,
+        conv_impl='auto'
     )
 
     newZ = numpy.round(newZ - convsize + 1) / 2
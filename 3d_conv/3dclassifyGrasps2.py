@@ -85,7 +85,8 @@ def evaluate(learning_rate=0.001, n_epochs=2000,
         input=x,
         image_shape=(batch_size, zdim, 1, xdim, ydim),
         filter_shape=(nkerns[0], kern_size[0], 1, kern_size[0], kern_size[0]),
-        poolsize=2, drop=drop
+        poolsize=2, drop=drop,
+        conv_impl='auto'
     )
 
 
@@ -103,7 +104,8 @@ def evaluate(learning_rate=0.001, n_epochs=2000,
         #input=x,
         image_shape=(batch_size, newZ, nkerns[0], newX, newY),
         filter_shape=(nkerns[1], kern_size[1], nkerns[0], kern_size[1], kern_size[1]),
-        poolsize=2, drop=drop
+        poolsize=2, drop=drop,
+        conv_impl='auto'
     )
 
     newZ = numpy.round(newZ - kern_size[1] + 1) / 2
@@ -115,7 +117,8 @@ def evaluate(learning_rate=0.001, n_epochs=2000,
         input=layer1.output,
         image_shape=(batch_size, newZ, nkerns[1], newX, newY),
         filter_shape=(nkerns[2], kern_size[2], nkerns[1], kern_size[2], kern_size[2]),
-        poolsize=2, drop=drop
+        poolsize=2, drop=drop,
+        conv_impl='auto'
     )
 
     newZ = numpy.round(newZ - kern_size[2] + 1) / 2
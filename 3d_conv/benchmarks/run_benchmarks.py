@@ -0,0 +1,303 @@
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import numpy
+import theano
+import theano.tensor as T
+
+from benchmarks import synthetic
+from layers.layer_utils import downscale_3d, max_pool_3d_numpy, numpy_jaccard_similarity
+
+#Times the voxel, data and layer hot paths on synthetic inputs (see
+#synthetic.py) at several patch sizes, and compares the timings with those of
+#a baseline run:
+#
+#   cd 3d_conv
+#   THEANO_FLAGS=floatX=float32 python -m benchmarks.run_benchmarks --output before.json
+#   ... change things ...
+#   THEANO_FLAGS=floatX=float32 python -m benchmarks.run_benchmarks --baseline before.json
+#
+#Every benchmark times repeats calls after a warm up call and keeps the
+#median. A benchmark is a regression when its median is more than threshold
+#(a fraction, per benchmark in THRESHOLDS) above the baseline median; the
+#script then exits with status 1. Benchmarks whose module cannot be imported
+#here (binvox_rw, pylearn2, ...) or that need floatX=float32 are recorded as
+#skipped.
+
+SIZES = (24, 32, 72, 256)
+# theano layers at 256^3 take minutes per call on a cpu
+LAYER_SIZES = (24, 32, 72)
+
+# examples per call, about the same number of voxels at every size
+BATCH_SIZES = {24: 16, 32: 16, 72: 4, 256: 1}
+NUM_POINTS = 100000
+NUM_FILTERS = 16
+
+DEFAULT_THRESHOLD = .10
+# reads through the page cache and process wide allocations vary more
+THRESHOLDS = {'binvox_decode': .25,
+              'hdf5_iterator_next': .25,
+              'model_net_iterator_next': .25,
+              'view_synthesis_iterator_next': .25}
+
+
+class SkipBenchmark(Exception):
+    pass
+
+
+def _floatx_tensor5(name):
+    if theano.config.floatX != 'float32':
+        raise SkipBenchmark("ModelBuilder conv models need floatX=float32")
+    return T.TensorType('float32', (False,) * 5)(name)
+
+
+def _batch(size, channels, rng):
+    shape = (BATCH_SIZES[size], size, channels, size, size)
+    return (rng.rand(*shape) > .5).astype(numpy.float32)
+
+
+def voxelize(size, rng, tmp_dir):
+    from utils.reconstruction_utils import create_voxel_grid_around_point
+    points = synthetic.sphere_point_cloud(NUM_POINTS, size, rng)
+    center = numpy.zeros(3)
+    return lambda: create_voxel_grid_around_point(points, center, synthetic.VOXEL_RESOLUTION, size)
+
+
+def binvox_decode(size, rng, tmp_dir):
+    import binvox_rw
+    filepath = os.path.join(tmp_dir, "model_%d.binvox" % size)
+    synthetic.write_binvox(filepath, synthetic.occupancy_grid(size, rng))
+
+    def decode():
+        with open(filepath, 'rb') as f:
+            return binvox_rw.read_as_3d_array(f)
+    return decode
+
+
+def downscale(size, rng, tmp_dir):
+    x = _batch(size, 1, rng)
+    return lambda: downscale_3d(x, 2)
+
+
+def max_pool_numpy(size, rng, tmp_dir):
+    x = _batch(size, 1, rng)
+    return lambda: max_pool_3d_numpy(x, 2)
+
+
+def jaccard(size, rng, tmp_dir):
+    a = _batch(size, 1, rng)
+    b = _batch(size, 1, rng)
+    return lambda: numpy_jaccard_similarity(a, b)
+
+
+def _next(iterator):
+    return lambda: iterator.next()
+
+
+def hdf5_iterator_next(size, rng, tmp_dir):
+    from datasets.hdf5_reconstruction_dataset import ReconstructionDataset
+    filepath = os.path.join(tmp_dir, "reconstruction_%d.h5" % size)
+    synthetic.write_reconstruction_hdf5(filepath, 2 * BATCH_SIZES[size], size, rng)
+    dataset = ReconstructionDataset(filepath)
+    return _next(dataset.iterator(batch_size=BATCH_SIZES[size], num_batches=sys.maxint))
+
+
+def view_synthesis_iterator_next(size, rng, tmp_dir):
+    from datasets.view_synthesis_dataset import ViewSynthesisDataset
+    filepath = os.path.join(tmp_dir, "view_synthesis_%d.h5" % size)
+    synthetic.write_reconstruction_hdf5(filepath, 2 * BATCH_SIZES[size], size, rng)
+    dataset = ViewSynthesisDataset(filepath)
+    return _next(dataset.iterator(batch_size=BATCH_SIZES[size], num_batches=sys.maxint))
+
+
+def model_net_iterator_next(size, rng, tmp_dir):
+    from datasets.model_net_dataset import ModelNetDataset
+    models_dir = synthetic.write_model_net_dir(os.path.join(tmp_dir, "model_net_%d" % size),
+                                               2 * BATCH_SIZES[size], size, rng)
+    dataset = ModelNetDataset(models_dir, size, dataset_type='train')
+    return _next(dataset.iterator(batch_size=BATCH_SIZES[size], num_batches=sys.maxint,
+                                  mode='even_shuffled_sequential'))
+
+
+def _conv_layer(size, rng):
+    from layers.conv_layer_3d import ConvLayer3D
+    x = _floatx_tensor5('x')
+    image_shape = (BATCH_SIZES[size], size, 1, size, size)
+    layer = ConvLayer3D(rng, x, (NUM_FILTERS, 3, 1, 3, 3), image_shape)
+    return x, layer, _batch(size, 1, rng)
+
+
+def _max_pool_layer(size, rng):
+    from layers.max_pool_layer_3d import MaxPoolLayer3D
+    x = _floatx_tensor5('x')
+    input_shape = (BATCH_SIZES[size], size, NUM_FILTERS, size, size)
+    layer = MaxPoolLayer3D(x, input_shape, ds=2)
+    return x, layer, _batch(size, NUM_FILTERS, rng)
+
+
+def _forward(make_layer):
+    def setup(size, rng, tmp_dir):
+        x, layer, batch = make_layer(size, rng)
+        forward = theano.function([x], layer.output)
+        return lambda: forward(batch)
+    return setup
+
+
+def _backward(make_layer):
+    """forward and backward passes, the gradients of the input and the parameters"""
+    def setup(size, rng, tmp_dir):
+        x, layer, batch = make_layer(size, rng)
+        backward = theano.function([x], T.grad(layer.output.sum(), [x] + list(layer.params)))
+        return lambda: backward(batch)
+    return setup
+
+
+#(name, sizes, setup): setup(size, rng, tmp_dir) prepares the inputs and
+#returns the call to time
+BENCHMARKS = [
+    ('voxelize', SIZES, voxelize),
+    ('binvox_decode', SIZES, binvox_decode),
+    ('downscale_3d', SIZES, downscale),
+    ('max_pool_3d_numpy', SIZES, max_pool_numpy),
+    ('numpy_jaccard_similarity', SIZES, jaccard),
+    ('hdf5_iterator_next', SIZES, hdf5_iterator_next),
+    ('view_synthesis_iterator_next', SIZES, view_synthesis_iterator_next),
+    ('model_net_iterator_next', SIZES, model_net_iterator_next),
+    ('conv_layer_3d_forward', LAYER_SIZES, _forward(_conv_layer)),
+    ('conv_layer_3d_backward', LAYER_SIZES, _backward(_conv_layer)),
+    ('max_pool_layer_3d_forward', LAYER_SIZES, _forward(_max_pool_layer)),
+    ('max_pool_layer_3d_backward', LAYER_SIZES, _backward(_max_pool_layer)),
+]
+
+
+def time_calls(f, repeats):
+    """Seconds of each of repeats calls of f, after a warm up call."""
+    f()
+    times = []
+    for i in xrange(repeats):
+        start_time = time.time()
+        f()
+        times.append(time.time() - start_time)
+    return times
+
+
+def run_benchmark(name, size, setup, repeats, tmp_dir, seed=1234):
+    """The result record of one benchmark at one size."""
+    record = {'name': name, 'size': size}
+    try:
+        f = setup(size, numpy.random.RandomState(seed), tmp_dir)
+    except ImportError as e:
+        record['skipped'] = "ImportError: %s" % e
+        return record
+    except SkipBenchmark as e:
+        record['skipped'] = str(e)
+        return record
+
+    times = time_calls(f, repeats)
+    record.update(median=float(numpy.median(times)), min=min(times), mean=float(numpy.mean(times)),
+                  repeats=repeats)
+    return record
+
+
+def run(names=None, sizes=SIZES, repeats=5, verbose=True):
+    results = []
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        for name, benchmark_sizes, setup in BENCHMARKS:
+            if names and name not in names:
+                continue
+            for size in benchmark_sizes:
+                if size not in sizes:
+                    continue
+                record = run_benchmark(name, size, setup, repeats, tmp_dir)
+                results.append(record)
+                if verbose:
+                    print format_record(record)
+                    sys.stdout.flush()
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    return {'timestamp': time.time(),
+            'host': platform.node(),
+            'floatX': theano.config.floatX,
+            'numpy': numpy.__version__,
+            'theano': theano.__version__,
+            'results': results}
+
+
+def format_record(record):
+    label = "%s %d^3" % (record['name'], record['size'])
+    if 'skipped' in record:
+        return "%-40s skipped (%s)" % (label, record['skipped'])
+    return "%-40s median %9.2fms  min %9.2fms" % (label, record['median'] * 1000, record['min'] * 1000)
+
+
+def _key(record):
+    return "%s@%d" % (record['name'], record['size'])
+
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD, thresholds=THRESHOLDS):
+    """
+    Compares the medians of two runs. Returns (regressions, improvements),
+    lists of (name@size, baseline median, median) of the benchmarks more than
+    their threshold slower or faster than the baseline. Skipped benchmarks and
+    benchmarks missing from one of the runs are not compared.
+    """
+    baseline_medians = dict((_key(r), r['median']) for r in baseline['results'] if 'median' in r)
+    regressions = []
+    improvements = []
+    for record in results['results']:
+        key = _key(record)
+        if 'median' not in record or key not in baseline_medians:
+            continue
+        limit = thresholds.get(record['name'], threshold)
+        before, after = baseline_medians[key], record['median']
+        if after > before * (1 + limit):
+            regressions.append((key, before, after))
+        elif after < before * (1 - limit):
+            improvements.append((key, before, after))
+    return regressions, improvements
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Times the voxel, data and layer hot paths.")
+    parser.add_argument('--output', help="json file of the results")
+    parser.add_argument('--baseline', help="json results to compare with")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help="slowdown (a fraction) counted as a regression")
+    parser.add_argument('--sizes', default=",".join(str(size) for size in SIZES))
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--only', help="comma separated benchmark names")
+    args = parser.parse_args(argv)
+
+    names = args.only.split(",") if args.only else None
+    sizes = [int(size) for size in args.sizes.split(",")]
+    results = run(names, sizes, args.repeats)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+
+    if not args.baseline:
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions, improvements = compare(results, baseline, args.threshold)
+    for title, entries in (("improvements", improvements), ("regressions", regressions)):
+        print
+        print "%d %s" % (len(entries), title)
+        for key, before, after in entries:
+            print "  %-40s %9.2fms -> %9.2fms (%+.0f%%)" % (key, before * 1000, after * 1000,
+                                                         (after / before - 1) * 100)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
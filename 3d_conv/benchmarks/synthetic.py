@@ -0,0 +1,96 @@
+
+import os
+import h5py
+import numpy
+
+#Synthetic inputs for the benchmarks, so they run without /srv/3d_conv_data:
+#point clouds, occupancy grids, binvox files and hdf5 datasets laid out like
+#the ones of utils/precompute_recon_dset.py. Everything is drawn from the rng
+#passed in, so two runs time the same data.
+
+VOXEL_RESOLUTION = 0.001
+
+
+def sphere_point_cloud(num_points, patch_size, rng, voxel_resolution=VOXEL_RESOLUTION):
+    """
+    (num_points, 3) points on a noisy sphere filling most of a patch of
+    patch_size voxels of voxel_resolution meters, centered on the origin.
+    """
+    directions = rng.randn(num_points, 3)
+    directions /= numpy.sqrt((directions ** 2).sum(axis=1))[:, None]
+    radius = .4 * patch_size * voxel_resolution
+    noise = rng.randn(num_points, 1) * voxel_resolution
+    return directions * (radius + noise)
+
+
+def occupancy_grid(patch_size, rng, partial=False):
+    """
+    A (patch_size, patch_size, patch_size) boolean grid holding a solid
+    ellipsoid of random radii, only its half facing the camera (x < center)
+    when partial.
+    """
+    radii = rng.uniform(.2, .45, 3) * patch_size
+    center = (patch_size - 1) / 2.
+    x, y, z = numpy.ogrid[:patch_size, :patch_size, :patch_size]
+    grid = (((x - center) / radii[0]) ** 2 +
+            ((y - center) / radii[1]) ** 2 +
+            ((z - center) / radii[2]) ** 2) <= 1
+    if partial:
+        grid &= (x < center)
+    return grid
+
+
+def write_binvox(filepath, grid):
+    """Writes a cubic boolean xyz grid as a run length encoded binvox file."""
+    size = grid.shape[0]
+    # binvox stores the voxels in x, z, y order
+    values = grid.transpose(0, 2, 1).ravel().astype(numpy.uint8)
+
+    boundaries = numpy.flatnonzero(values[1:] != values[:-1]) + 1
+    starts = numpy.concatenate(([0], boundaries))
+    lengths = numpy.diff(numpy.concatenate((starts, [len(values)])))
+
+    pairs = []
+    for value, length in zip(values[starts], lengths):
+        # runs hold 255 voxels at most
+        while length > 0:
+            pairs.append((value, min(length, 255)))
+            length -= 255
+
+    with open(filepath, 'wb') as f:
+        f.write("#binvox 1\n")
+        f.write("dim %d %d %d\n" % (size, size, size))
+        f.write("translate 0 0 0\n")
+        f.write("scale 1\n")
+        f.write("data\n")
+        f.write(numpy.array(pairs, dtype=numpy.uint8).tostring())
+
+
+def write_model_net_dir(models_dir, num_models, patch_size, rng):
+    """A ModelNetDataset directory of num_models binvox files, in its monitor/train/ category."""
+    category_dir = os.path.join(models_dir, 'monitor', 'train')
+    if not os.path.isdir(category_dir):
+        os.makedirs(category_dir)
+    for i in xrange(num_models):
+        write_binvox(os.path.join(category_dir, "model_%04d.binvox" % i), occupancy_grid(patch_size, rng))
+    return models_dir
+
+
+def write_reconstruction_hdf5(filepath, num_examples, patch_size, rng):
+    """
+    An hdf5 file of num_examples (partial view x, complete model y) pairs of
+    shape (patch_size, patch_size, patch_size, 1), chunked like
+    utils/precompute_recon_dset.py.
+    """
+    shape = (num_examples, patch_size, patch_size, patch_size, 1)
+    chunks = (min(100, num_examples), patch_size, patch_size, patch_size, 1)
+    with h5py.File(filepath, 'w') as h5_dset:
+        x = h5_dset.create_dataset('x', shape, chunks=chunks)
+        y = h5_dset.create_dataset('y', shape, chunks=chunks)
+        for i in xrange(num_examples):
+            radii_state = rng.get_state()
+            y[i, ..., 0] = occupancy_grid(patch_size, rng)
+            # the same ellipsoid, seen from one side
+            rng.set_state(radii_state)
+            x[i, ..., 0] = occupancy_grid(patch_size, rng, partial=True)
+    return filepath
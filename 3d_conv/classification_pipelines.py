@@ -1,5 +1,7 @@
 
 import time
+
+from utils.tracing import span
 from classification_pipeline_stages import *
 
 
@@ -38,7 +40,8 @@ class ClassificationPipeline():
                     stage.init_dataset(self.dataset)
 
                 #actually process the data
-                stage.run(self.dataset, index)
+                with span(stage.__class__.__name__ + ".run", "stage", index=index):
+                    stage.run(self.dataset, index)
 
                 print str(stage) + ' took ' + str(time.time() - start_time) + ' seconds to complete.'
 
@@ -0,0 +1,298 @@
+
+import time
+import numpy as np
+
+
+#Augmentation ops for 5d BZCXY batches (the layout every reconstruction
+#iterator returns).  An AugmentationPipeline takes a list of ops, plans them
+#into stages and can be handed to an iterator as a single post processor:
+#
+#   pipeline = AugmentationPipeline([Flip(), DiscreteRotation(), Translation(2),
+#                                    VoxelDropout(.05), GaussianNoisePostProcessor(.01, 0, .5)])
+#   iterator = dataset.iterator(batch_size, num_batches, iterator_post_processors=[pipeline])
+#
+#Consecutive geometric ops (flip, rotation, translation) are composed into one
+#integer affine map per example, so the index vectors are computed once and the
+#same gather is applied to both X and Y.  Consecutive elementwise ops are fused
+#into one stage that works in place on a single float32 copy of X.
+
+SPATIAL_AXES = (1, 3, 4)
+
+
+class ElementwiseOp():
+    """Base class for ops that only touch X, voxel by voxel."""
+
+    def apply_inplace(self, batch_x, rng):
+        raise NotImplementedError
+
+    def apply(self, batch_x, batch_y):
+        # float32 like ElementwiseStage, whichever op runs
+        batch_x = np.array(batch_x, dtype=np.float32)
+        self.apply_inplace(batch_x, np.random)
+        return batch_x, batch_y
+
+
+class GeometricOp():
+    """Base class for ops that move voxels around.
+
+    sample_transform returns (A, t), an integer affine map taking a voxel
+    coordinate p of the input grid to A.dot(p) + t in the output grid.  A must
+    be a signed permutation matrix so that every output axis is read from
+    exactly one input axis.
+    """
+
+    def sample_transform(self, spatial_shape, rng):
+        raise NotImplementedError
+
+
+class GaussianNoisePostProcessor(ElementwiseOp):
+
+    def __init__(self, sigma=.2, mu=0, prob_noise_added=.2):
+        self.sigma = sigma
+        self.mu = mu
+        self.prob_noise_added = prob_noise_added
+
+    def apply_inplace(self, batch_x, rng):
+        #we only add noise to the locations where the mask is True
+        mask = rng.rand(*batch_x.shape) < self.prob_noise_added
+
+        #this noise is centered around mu with standard dev sigma,
+        #only drawn for the masked voxels
+        batch_x[mask] += self.sigma * rng.randn(np.count_nonzero(mask)) + self.mu
+
+
+class VoxelDropout(ElementwiseOp):
+
+    def __init__(self, p=.05):
+        self.p = p
+
+    def apply_inplace(self, batch_x, rng):
+        batch_x *= rng.rand(*batch_x.shape) >= self.p
+
+
+class OcclusionMask(ElementwiseOp):
+    """Zeros a random axis aligned box in each example of X."""
+
+    def __init__(self, max_fraction=.5, prob_occluded=.5):
+        self.max_fraction = max_fraction
+        self.prob_occluded = prob_occluded
+
+    def apply_inplace(self, batch_x, rng):
+        spatial_shape = [batch_x.shape[axis] for axis in SPATIAL_AXES]
+
+        for i in xrange(batch_x.shape[0]):
+            if rng.rand() >= self.prob_occluded:
+                continue
+
+            box = []
+            for n in spatial_shape:
+                length = rng.randint(1, max(int(n * self.max_fraction), 1) + 1)
+                start = rng.randint(0, n - length + 1)
+                box.append(slice(start, start + length))
+
+            batch_x[i, box[0], :, box[1], box[2]] = 0
+
+
+class Flip(GeometricOp):
+
+    def __init__(self, axes=(0, 1, 2), prob_flipped=.5):
+        self.axes = axes
+        self.prob_flipped = prob_flipped
+
+    def sample_transform(self, spatial_shape, rng):
+        A = np.eye(3, dtype=int)
+        t = np.zeros(3, dtype=int)
+        for axis in self.axes:
+            if rng.rand() < self.prob_flipped:
+                A[axis, axis] = -1
+                t[axis] = spatial_shape[axis] - 1
+        return A, t
+
+
+class DiscreteRotation(GeometricOp):
+    """Rotates by a random multiple of 90 degrees in the plane of the given spatial axes."""
+
+    def __init__(self, plane=(1, 2)):
+        self.plane = plane
+
+    def sample_transform(self, spatial_shape, rng):
+        i, j = self.plane
+        if spatial_shape[i] != spatial_shape[j]:
+            raise ValueError("cannot rotate in a non square plane: %s" % str(spatial_shape))
+
+        #a single quarter turn: q_i = n - 1 - p_j, q_j = p_i
+        quarter_A = np.eye(3, dtype=int)
+        quarter_A[i, i] = quarter_A[j, j] = 0
+        quarter_A[i, j] = -1
+        quarter_A[j, i] = 1
+        quarter_t = np.zeros(3, dtype=int)
+        quarter_t[i] = spatial_shape[i] - 1
+
+        A = np.eye(3, dtype=int)
+        t = np.zeros(3, dtype=int)
+        for k in xrange(rng.randint(4)):
+            A, t = compose_transforms((A, t), (quarter_A, quarter_t))
+        return A, t
+
+
+class Translation(GeometricOp):
+    """Shifts by a random integer offset in [-max_shift, max_shift] per axis, filling with zeros."""
+
+    def __init__(self, max_shift=2):
+        self.max_shift = max_shift
+
+    def sample_transform(self, spatial_shape, rng):
+        return np.eye(3, dtype=int), rng.randint(-self.max_shift, self.max_shift + 1, 3)
+
+
+def compose_transforms(first, second):
+    """Returns the affine map equivalent to applying first and then second."""
+    A1, t1 = first
+    A2, t2 = second
+    return np.dot(A2, A1), np.dot(A2, t1) + t2
+
+
+def gather_indices(A, t, spatial_shape):
+    """
+    Inverts q = A.dot(p) + t one output axis at a time.  Returns, for each output
+    axis, the input axis it is read from and the (possibly out of range) input
+    index of every output position.
+    """
+    source_axes = []
+    index_vectors = []
+    for k in xrange(3):
+        a = int(np.nonzero(A[k])[0][0])
+        n = spatial_shape[a]
+        source_axes.append(a)
+        index_vectors.append(A[k, a] * (np.arange(n) - t[k]))
+    return source_axes, index_vectors
+
+
+def gather(volume, source_axes, index_vectors, out):
+    """volume and out are (C, Z, X, Y) views of a single example."""
+    moved = volume.transpose((0,) + tuple(a + 1 for a in source_axes))
+
+    valid = [(index >= 0) & (index < n) for index, n in zip(index_vectors, moved.shape[1:])]
+    dst = np.ix_(*[np.nonzero(v)[0] for v in valid])
+    src = np.ix_(*[index[v] for index, v in zip(index_vectors, valid)])
+
+    out[...] = 0
+    out[(slice(None),) + dst] = moved[(slice(None),) + src]
+
+
+class ElementwiseStage():
+
+    def __init__(self, ops):
+        self.ops = ops
+        self.name = '+'.join(op.__class__.__name__ for op in ops)
+
+    def run(self, batch_x, batch_y, owned, rng, timings):
+        if not owned:
+            batch_x = np.array(batch_x, dtype=np.float32)
+
+        for op in self.ops:
+            start_time = time.time()
+            op.apply_inplace(batch_x, rng)
+            _add_timing(timings, op.__class__.__name__, time.time() - start_time)
+
+        return batch_x, batch_y
+
+
+class GeometricStage():
+
+    def __init__(self, ops):
+        self.ops = ops
+        self.name = '+'.join(op.__class__.__name__ for op in ops)
+
+    def run(self, batch_x, batch_y, rng, timings, apply_to_y):
+        start_time = time.time()
+
+        pair_y = apply_to_y and batch_y.ndim == 5 and batch_y.shape == batch_x.shape
+        spatial_shape = [batch_x.shape[axis] for axis in SPATIAL_AXES]
+
+        #BZCXY -> BCZXY views so that every example is a (C, Z, X, Y) volume
+        x_in = batch_x.transpose(0, 2, 1, 3, 4)
+        out_x = np.empty(batch_x.shape, dtype=np.float32)
+        x_out = out_x.transpose(0, 2, 1, 3, 4)
+        if pair_y:
+            y_in = batch_y.transpose(0, 2, 1, 3, 4)
+            out_y = np.empty(batch_y.shape, dtype=np.float32)
+            y_out = out_y.transpose(0, 2, 1, 3, 4)
+
+        for i in xrange(batch_x.shape[0]):
+            A = np.eye(3, dtype=int)
+            t = np.zeros(3, dtype=int)
+            for op in self.ops:
+                A, t = compose_transforms((A, t), op.sample_transform(spatial_shape, rng))
+
+            #the index computation is shared between X and Y
+            source_axes, index_vectors = gather_indices(A, t, spatial_shape)
+            gather(x_in[i], source_axes, index_vectors, x_out[i])
+            if pair_y:
+                gather(y_in[i], source_axes, index_vectors, y_out[i])
+
+        _add_timing(timings, self.name, time.time() - start_time)
+
+        if pair_y:
+            return out_x, out_y
+        return out_x, batch_y
+
+
+def plan(ops):
+    """Groups consecutive ops of the same kind into stages, keeping their order."""
+    stages = []
+    group = []
+    for op in ops:
+        if group and isinstance(op, GeometricOp) != isinstance(group[0], GeometricOp):
+            stages.append(_make_stage(group))
+            group = []
+        group.append(op)
+    if group:
+        stages.append(_make_stage(group))
+    return stages
+
+
+def _make_stage(ops):
+    if isinstance(ops[0], GeometricOp):
+        return GeometricStage(ops)
+    return ElementwiseStage(ops)
+
+
+def _add_timing(timings, name, seconds):
+    total, count = timings.get(name, (0.0, 0))
+    timings[name] = (total + seconds, count + 1)
+
+
+class AugmentationPipeline():
+
+    def __init__(self, ops, apply_to_y=True, rng=None):
+        """
+        :param ops: list of ElementwiseOp and GeometricOp instances, applied in order
+        :param apply_to_y: apply geometric ops to Y as well, with the same per-example
+            transform as X.  Only done when Y has the same 5d shape as X.
+        :param rng: numpy.random.RandomState, pass one per worker for reproducible streams
+        """
+        self.ops = list(ops)
+        self.apply_to_y = apply_to_y
+        self.rng = rng if rng is not None else np.random.RandomState()
+        self.stages = plan(self.ops)
+
+        #name -> (total seconds, number of calls)
+        self.timings = {}
+
+    def apply(self, batch_x, batch_y):
+        owned = False
+        for stage in self.stages:
+            if isinstance(stage, GeometricStage):
+                batch_x, batch_y = stage.run(batch_x, batch_y, self.rng, self.timings, self.apply_to_y)
+            else:
+                batch_x, batch_y = stage.run(batch_x, batch_y, owned, self.rng, self.timings)
+            owned = True
+
+        return batch_x, batch_y
+
+    def timing_report(self):
+        lines = []
+        for name, (total, count) in sorted(self.timings.items()):
+            lines.append("%s: %.4fs total, %.6fs per batch" % (name, total, total / count))
+        return "\n".join(lines)
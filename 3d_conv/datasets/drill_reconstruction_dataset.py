@@ -7,6 +7,7 @@ import tf_conversions
 import PyKDL
 import math
 from reconstruction_dataset import map_pointclouds_to_camera_frame
+from utils.tracing import span, traced
 
 
 class DrillReconstructionDataset():
@@ -56,7 +57,7 @@ def build_training_example(model_filepath, pose_filepath, single_view_pointcloud
     #remove 32 bit color channel
     pc = pc[:, 0:3]
     model_pose = np.load(pose_filepath)  # 4x4 homogeneous transform matrix
-    with open(model_filepath, 'rb') as f:
+    with span("binvox_read", "io", filepath=model_filepath), open(model_filepath, 'rb') as f:
         model = binvox_rw.read_as_3d_array(f)
 
     # import IPython
@@ -105,6 +106,7 @@ def build_training_example(model_filepath, pose_filepath, single_view_pointcloud
     return x, y
 
 
+@traced("create_voxel_grid_around_point", "voxelize")
 def create_voxel_grid_around_point(points, patch_center, voxel_resolution=0.001, num_voxels_per_dim=72):
 
     voxel_grid = np.zeros((num_voxels_per_dim,
@@ -151,6 +153,7 @@ class DrillReconstructionIterator(collections.Iterator):
         return self
 
 
+    @traced("DrillReconstructionIterator.next", "iterator")
     def next(self):
 
         batch_indices = np.random.random_integers(0, self.dataset.get_num_examples() - 1, self.batch_size)
@@ -0,0 +1,76 @@
+
+import collections
+import h5py
+import numpy as np
+
+from utils.tracing import span
+
+
+class HDF5HandlePool():
+    """
+    Keeps up to max_open_files hdf5 files open, closing the least recently used
+    one when a new file has to be opened.  Datasets made of many small per
+    example files (MelonomaDataset) otherwise pay an open and close per example.
+    """
+
+    def __init__(self, max_open_files=64, mode='r'):
+        if max_open_files < 1:
+            raise ValueError("max_open_files: %i must be at least 1" % max_open_files)
+
+        self.max_open_files = max_open_files
+        self.mode = mode
+        self.handles = collections.OrderedDict()
+
+    def get(self, filepath):
+        if filepath in self.handles:
+            #move to the most recently used end
+            handle = self.handles.pop(filepath)
+            self.handles[filepath] = handle
+            return handle
+
+        if len(self.handles) >= self.max_open_files:
+            oldest_filepath, oldest_handle = self.handles.popitem(last=False)
+            oldest_handle.close()
+
+        handle = h5py.File(filepath, self.mode)
+        self.handles[filepath] = handle
+        return handle
+
+    def read_rows(self, locations, key):
+        """
+        locations is a list of (filepath, row) pairs.  Returns an array whose i-th
+        entry is file[key][row] of the i-th location.  Locations are grouped by
+        file so that each file is read once, with increasing unique rows as hdf5
+        fancy indexing requires.  With a tuple of keys, returns a tuple of such
+        arrays, all the keys of a file being read while it is open.
+        """
+        keys = key if isinstance(key, tuple) else (key,)
+
+        groups = collections.OrderedDict()
+        for position, (filepath, row) in enumerate(locations):
+            groups.setdefault(filepath, []).append((row, position))
+
+        outs = [None] * len(keys)
+        for filepath, items in groups.items():
+            rows = sorted(set(row for row, position in items))
+            lookup = dict((row, i) for i, row in enumerate(rows))
+            handle = self.get(filepath)
+
+            for k, name in enumerate(keys):
+                with span("hdf5_read", "io", filepath=filepath, key=name, rows=len(rows)):
+                    values = handle[name][rows]
+
+                if outs[k] is None:
+                    outs[k] = np.empty((len(locations),) + values.shape[1:], dtype=values.dtype)
+
+                for row, position in items:
+                    outs[k][position] = values[lookup[row]]
+
+        if isinstance(key, tuple):
+            return tuple(outs)
+        return outs[0]
+
+    def close(self):
+        for handle in self.handles.values():
+            handle.close()
+        self.handles.clear()
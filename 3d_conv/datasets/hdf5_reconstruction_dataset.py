@@ -8,6 +8,8 @@ import visualization.visualize as viz
 import tf_conversions
 import PyKDL
 import h5py
+from utils.telemetry import timed
+from utils.tracing import span, traced
 
 import math
 
@@ -26,11 +28,13 @@ class ReconstructionDataset():
 
     def iterator(self,
                  batch_size=None,
-                 num_batches=None):
+                 num_batches=None,
+                 iterator_post_processors=[]):
 
             return ReconstructionIterator(self,
                                           batch_size=batch_size,
-                                          num_batches=num_batches)
+                                          num_batches=num_batches,
+                                          iterator_post_processors=iterator_post_processors)
 
 
 class ReconstructionIterator(collections.Iterator):
@@ -51,6 +55,7 @@ class ReconstructionIterator(collections.Iterator):
     def __iter__(self):
         return self
 
+    @traced("ReconstructionIterator.next", "iterator")
     def next(self):
 
         batch_indices = np.random.random_integers(0, self.dataset.get_num_examples()-1, self.batch_size)
@@ -63,8 +68,9 @@ class ReconstructionIterator(collections.Iterator):
         for i in range(len(batch_indices)):
             index = batch_indices[i]
 
-            x = self.dataset.dset['x'][index]
-            y = self.dataset.dset['y'][index]
+            with span("hdf5_read", "io"):
+                x = self.dataset.dset['x'][index]
+                y = self.dataset.dset['y'][index]
 
             # viz.visualize_3d(x)
             # viz.visualize_3d(y)
@@ -73,13 +79,14 @@ class ReconstructionIterator(collections.Iterator):
             batch_y[i, :, :, :, :] = y
             batch_x[i, :, :, :, :] = x
 
-        #make batch B2C01 rather than B012C
-        batch_x = batch_x.transpose(0, 3, 4, 1, 2)
-        batch_y = batch_y.transpose(0, 3, 4, 1, 2)
+        with timed('assembly'):
+            #make batch B2C01 rather than B012C
+            batch_x = batch_x.transpose(0, 3, 4, 1, 2)
+            batch_y = batch_y.transpose(0, 3, 4, 1, 2)
 
-        #apply post processors to the patches
-        for post_processor in self.iterator_post_processors:
-            batch_x, batch_y = post_processor.apply(batch_x, batch_y)
+            #apply post processors to the patches
+            for post_processor in self.iterator_post_processors:
+                batch_x, batch_y = post_processor.apply(batch_x, batch_y)
 
         return batch_x, batch_y
 
@@ -13,15 +13,26 @@ import os
 #from off_utils.off_handler import OffHandler
 #from datasets.point_cloud_hdf5_dataset import create_voxel_grid_around_point
 import binvox_rw
+from hdf5_handle_pool import HDF5HandlePool
 
 
 class MelonomaDataset(pylearn2.datasets.dataset.Dataset):
 
-    def __init__(self, data_dir, examples=None):
+    def __init__(self, data_dir, examples=None, max_open_files=64):
         if examples:
             self.examples = examples
+            self.example_locations = [(example, 0) for example in examples]
+        elif os.path.isfile(data_dir):
+            #a single file written by utils/consolidate_hdf5_examples.py
+            with h5py.File(data_dir, 'r') as dset:
+                num_examples = dset['data'].shape[0]
+            self.examples = [data_dir] * num_examples
+            self.example_locations = [(data_dir, i) for i in range(num_examples)]
         else:
             self.examples = [data_dir + filename for filename in os.listdir(data_dir) if ".h5" in filename]
+            self.example_locations = [(example, 0) for example in self.examples]
+
+        self.handle_pool = HDF5HandlePool(max_open_files)
 
     def adjust_for_viewer(self, X):
         raise NotImplementedError
@@ -111,23 +122,13 @@ class MelonomaIterator():
             batch_indices.sort()
             batch_size = len(batch_indices)
 
-        batch_x = np.zeros((batch_size, 6, 256, 256, 1))
-        batch_y = np.zeros((batch_size))
-
-        for i in range(len(batch_indices)):
-            index = batch_indices[i]
-            example_filepath = self.dataset.examples[index]
-
-            dset = h5py.File(example_filepath, 'r')
-
-            batch_x[i, :, :, :, 0] = dset['data'][0]
-            if dset['label'][0, 0] == -1:
-                batch_y[i] = 0
-            else:
-                batch_y[i] = 1
-
+        #reads are grouped by file, through the dataset's pool of open files
+        locations = [self.dataset.example_locations[index] for index in batch_indices]
+        data, labels = self.dataset.handle_pool.read_rows(locations, ('data', 'label'))
 
-            dset.close()
+        batch_x = np.empty((batch_size, 6, 256, 256, 1), dtype=np.float32)
+        batch_x[:, :, :, :, 0] = data
+        batch_y = np.where(labels.reshape(batch_size, -1)[:, 0] == -1, 0, 1)
 
         #make batch C01B rather than B012C
         batch_x = batch_x.transpose(0, 3, 4, 1, 2)
@@ -13,6 +13,8 @@ import os
 #from off_utils.off_handler import OffHandler
 #from datasets.point_cloud_hdf5_dataset import create_voxel_grid_around_point
 import binvox_rw
+from utils.telemetry import timed
+from utils.tracing import span, traced
 
 
 class ModelNetDataset(pylearn2.datasets.dataset.Dataset):
@@ -109,6 +111,7 @@ class ModelNetIterator():
     def __iter__(self):
         return self
 
+    @traced("ModelNetIterator.next", "iterator")
     def next(self):
 
         batch_indices = np.random.random_integers(0, self.dataset.get_num_examples()-1, self.batch_size)
@@ -125,7 +128,7 @@ class ModelNetIterator():
             index = batch_indices[i]
             model_filepath = self.dataset.examples[index][0]
 
-            with open(model_filepath, 'rb') as f:
+            with span("binvox_read", "io", filepath=model_filepath), open(model_filepath, 'rb') as f:
                 model = binvox_rw.read_as_3d_array(f)
 
             #batch_x[i, :, :, :, 0] = np.copy(np.zeros(model.data.shape))
@@ -134,16 +137,17 @@ class ModelNetIterator():
             batch_x[i, :, :, :, 0][model.data[:, :, :]] = 1
             batch_y[i, :, :, :, 0][model.data[:, :, :]] = 1
 
-        #make batch C01B rather than B01C
-        batch_x = batch_x.transpose(0, 3, 4, 1, 2)
-        batch_y = batch_y.transpose(0, 3, 4, 1, 2)
+        with timed('assembly'):
+            #make batch C01B rather than B01C
+            batch_x = batch_x.transpose(0, 3, 4, 1, 2)
+            batch_y = batch_y.transpose(0, 3, 4, 1, 2)
 
-        #apply post processors to the patches
-        for post_processor in self.iterator_post_processors:
-            batch_x, batch_y = post_processor.apply(batch_x, batch_y)
+            #apply post processors to the patches
+            for post_processor in self.iterator_post_processors:
+                batch_x, batch_y = post_processor.apply(batch_x, batch_y)
 
-        batch_x = np.array(batch_x, dtype=np.float32)
-        batch_y = np.array(batch_y, dtype=np.float32)
+            batch_x = np.array(batch_x, dtype=np.float32)
+            batch_y = np.array(batch_y, dtype=np.float32)
 
         return batch_x, batch_y
 
@@ -174,6 +178,7 @@ class ModelNetIterator():
 
 class ModelNetIteratorClassifier(ModelNetIterator):
 
+    @traced("ModelNetIteratorClassifier.next", "iterator")
     def next(self, categories):
 
         batch_indices = np.random.random_integers(0, self.dataset.get_num_examples()-1, self.batch_size)
@@ -188,7 +193,7 @@ class ModelNetIteratorClassifier(ModelNetIterator):
             index = batch_indices[i]
             model_filepath, category = self.dataset.examples[index]
 
-            with open(model_filepath, 'rb') as f:
+            with span("binvox_read", "io", filepath=model_filepath), open(model_filepath, 'rb') as f:
                 model = binvox_rw.read_as_3d_array(f)
 
             #batch_x[i, :, :, :, 0] = np.copy(np.zeros(model.data.shape))
@@ -197,14 +202,15 @@ class ModelNetIteratorClassifier(ModelNetIterator):
             batch_x[i, :, :, :, 0][model.data[:, : ,:]] = 1
             batch_y[i]=categories.index(category)
 
-        #make batch C01B rather than B01C
-        batch_x = batch_x.transpose(0, 3, 4, 1, 2)
+        with timed('assembly'):
+            #make batch C01B rather than B01C
+            batch_x = batch_x.transpose(0, 3, 4, 1, 2)
 
-        #apply post processors to the patches
-        for post_processor in self.iterator_post_processors:
-            batch_x = post_processor.apply(batch_x)
+            #apply post processors to the patches
+            for post_processor in self.iterator_post_processors:
+                batch_x = post_processor.apply(batch_x)
 
-        batch_x = np.array(batch_x, dtype=np.float32)
-        batch_y = np.array(batch_y, dtype=np.int32)
+            batch_x = np.array(batch_x, dtype=np.float32)
+            batch_y = np.array(batch_y, dtype=np.int32)
 
         return batch_x, batch_y
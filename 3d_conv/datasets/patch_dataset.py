@@ -0,0 +1,208 @@
+
+import collections
+import h5py
+import numpy as np
+
+from utils.rechunk_recon_dset import chunk_occupancy
+from utils.telemetry import timed
+from utils.tracing import span, traced
+
+#Random crops of full resolution (x, y) grids, to train at the native
+#resolution on patch_size^3 patches rather than on whole grids squashed by
+#downscale_3d.
+#
+#The grids come from an hdf5 file with x and y datasets of shape (num_examples,
+#size, size, size, 1), chunked one example and chunk_size^3 voxels per chunk
+#(utils/rechunk_recon_dset.py). Crops start on the chunk grid and patch_size is
+#a multiple of chunk_size, so a crop reads exactly the chunks it covers.
+#
+#Crops are biased toward occupied regions: with probability occupied_fraction
+#a crop is drawn with weights proportional to the number of occupied y voxels
+#it covers (from the occupancy dataset of the file), otherwise uniformly among
+#the aligned positions. The randomness comes from np.random, so the iterator
+#works with ProceduralStream's IteratorBatchGenerator.
+#
+#sliding_window_predict puts full grids back together from the predictions of
+#a model trained on patches, for instance the predict function of
+#ModelBuilder.build_inference_model:
+#
+#   dataset = PatchDataset('recon_256_chunked.h5', patch_size=32)
+#   iterator = dataset.iterator(batch_size=8, num_batches=n_train_batches)
+#   batch_x, batch_y = iterator.next()     # (8, 32, 1, 32, 32), BZCXY
+#   ...
+#   inference = mb.build_inference_model(y, batch_size=128)
+#   grids = sliding_window_predict(inference.predict, full_x, 32, stride=16)
+
+
+def window_sums(grids, span):
+    """Sums of the span^3 windows of the last 3 axes of grids, at every position where they fit."""
+    summed = np.cumsum(np.cumsum(np.cumsum(grids, axis=-3), axis=-2), axis=-1)
+    summed = np.pad(summed, [(0, 0)] * (summed.ndim - 3) + [(1, 0)] * 3, mode='constant')
+    n = summed.shape[-1] - span
+    a, b = slice(span, None), slice(None, n)
+    return (summed[..., a, a, a] - summed[..., a, a, b] - summed[..., a, b, a] - summed[..., b, a, a]
+            + summed[..., a, b, b] + summed[..., b, a, b] + summed[..., b, b, a] - summed[..., b, b, b])
+
+
+class PatchDataset():
+
+    def __init__(self, hdf5_filepath, patch_size=32, occupied_fraction=.8):
+
+        self.dset = h5py.File(hdf5_filepath, 'r')
+        self.num_examples, self.grid_size = self.dset['x'].shape[:2]
+        self.patch_size = patch_size
+        self.occupied_fraction = occupied_fraction
+
+        chunks = self.dset['x'].chunks
+        if chunks is None or chunks[0] != 1 or len(set(chunks[1:4])) != 1 or patch_size % chunks[1] != 0:
+            raise ValueError("%s: x is chunked %s, a %i^3 crop would read whole chunks of examples; "
+                             "rechunk it with utils/rechunk_recon_dset.py" % (hdf5_filepath, chunks, patch_size))
+        self.chunk_size = chunks[1]
+        if patch_size > self.grid_size:
+            raise ValueError("patch_size: %i is larger than the %i^3 grids" % (patch_size, self.grid_size))
+
+        if 'occupancy' in self.dset:
+            occupancy = self.dset['occupancy'][:]
+        else:
+            print "counting the occupied voxels of %s" % hdf5_filepath
+            occupancy = np.array([chunk_occupancy(self.dset['y'][index], self.chunk_size)
+                                  for index in xrange(self.num_examples)])
+
+        # occupied voxels of each crop, by its start in chunks
+        self.crop_occupancy = window_sums(occupancy.astype(np.int64), patch_size / self.chunk_size)
+
+    def get_num_examples(self):
+        return self.num_examples
+
+    def iterator(self,
+                 batch_size=None,
+                 num_batches=None,
+                 iterator_post_processors=[]):
+
+            return PatchIterator(self,
+                                 batch_size=batch_size,
+                                 num_batches=num_batches,
+                                 iterator_post_processors=iterator_post_processors)
+
+    def crop_start(self, index):
+        """Start in voxels, along the 3 grid axes of the file, of a random aligned crop of example index."""
+        weights = self.crop_occupancy[index].ravel()
+        total = weights.sum()
+        if total > 0 and np.random.rand() < self.occupied_fraction:
+            position = np.searchsorted(np.cumsum(weights), np.random.rand() * total, side='right')
+        else:
+            position = np.random.randint(len(weights))
+        start = np.unravel_index(position, self.crop_occupancy.shape[1:])
+        return tuple(int(s) * self.chunk_size for s in start)
+
+
+class PatchIterator(collections.Iterator):
+
+    def __init__(self,
+                 dataset,
+                 batch_size,
+                 num_batches,
+                 iterator_post_processors=[]):
+
+        self.dataset = dataset
+
+        self.batch_size = batch_size
+        self.num_batches = num_batches
+
+        self.iterator_post_processors = iterator_post_processors
+
+        # (example index, start along the grid axes of the file) of the crops of the last batch
+        self.crops = []
+
+    def __iter__(self):
+        return self
+
+    @traced("PatchIterator.next", "iterator")
+    def next(self):
+
+        batch_indices = np.random.random_integers(0, self.dataset.get_num_examples()-1, self.batch_size)
+
+        patch_size = self.dataset.patch_size
+
+        batch_x = np.zeros((self.batch_size, patch_size, patch_size, patch_size, 1), dtype=np.float32)
+        batch_y = np.zeros((self.batch_size, patch_size, patch_size, patch_size, 1), dtype=np.float32)
+
+        self.crops = []
+        for i in range(len(batch_indices)):
+            index = batch_indices[i]
+            start = self.dataset.crop_start(index)
+            crop = (index,) + tuple(slice(s, s + patch_size) for s in start)
+
+            with span("hdf5_read", "io", example=int(index)):
+                batch_x[i] = self.dataset.dset['x'][crop]
+                batch_y[i] = self.dataset.dset['y'][crop]
+            self.crops.append((index, start))
+
+        with timed('assembly'):
+            #make batch B2C01 rather than B012C
+            batch_x = batch_x.transpose(0, 3, 4, 1, 2)
+            batch_y = batch_y.transpose(0, 3, 4, 1, 2)
+
+            #apply post processors to the patches
+            for post_processor in self.iterator_post_processors:
+                batch_x, batch_y = post_processor.apply(batch_x, batch_y)
+
+        return batch_x, batch_y
+
+    def batch_size(self):
+        return self.batch_size
+
+    def num_batches(self):
+        return self.num_batches
+
+    def num_examples(self):
+        return self.dataset.get_num_examples()
+
+
+def window_starts(size, patch_size, stride):
+    """Starts of the windows along an axis of length size, the last one ending at the border."""
+    starts = range(0, size - patch_size + 1, stride)
+    if starts[-1] != size - patch_size:
+        starts.append(size - patch_size)
+    return starts
+
+
+def sliding_window_predict(predict, grids, patch_size, stride=None, batch_size=128):
+    """
+    Full grid predictions of a patch model. grids is a BZCXY batch of full
+    grids, predict maps a BZCXY batch of patch_size^3 windows to a prediction
+    of each window, of patch_size^3 voxels per channel in BZCXY order (or
+    flattened, as the recon layer outputs them). The windows overlap when
+    stride < patch_size, overlapping predictions are averaged. Windows go to
+    predict batch_size at a time. Returns the (B, Z, channels, X, Y) predictions.
+    """
+    if stride is None:
+        stride = patch_size
+    num_grids, zdim, nchannels, xdim, ydim = grids.shape
+    if min(zdim, xdim, ydim) < patch_size:
+        raise ValueError("%i^3 windows do not fit in %s grids" % (patch_size, grids.shape[1:]))
+
+    starts = [(z, x, y) for z in window_starts(zdim, patch_size, stride)
+              for x in window_starts(xdim, patch_size, stride)
+              for y in window_starts(ydim, patch_size, stride)]
+    windows = [(i,) + start for i in xrange(num_grids) for start in starts]
+
+    # the number of windows covering each voxel, the same in every grid
+    counts = np.zeros((1, zdim, 1, xdim, ydim), dtype=np.float32)
+    for z, x, y in starts:
+        counts[0, z:z + patch_size, :, x:x + patch_size, y:y + patch_size] += 1
+
+    sums = None
+    for first in xrange(0, len(windows), batch_size):
+        batch = windows[first:first + batch_size]
+        batch_x = np.array([grids[i, z:z + patch_size, :, x:x + patch_size, y:y + patch_size]
+                            for i, z, x, y in batch])
+        predictions = np.asarray(predict(batch_x))
+        predictions = predictions.reshape(len(batch), patch_size, -1, patch_size, patch_size)
+        if sums is None:
+            sums = np.zeros((num_grids, zdim, predictions.shape[2], xdim, ydim), dtype=np.float32)
+
+        for (i, z, x, y), prediction in zip(batch, predictions):
+            sums[i, z:z + patch_size, :, x:x + patch_size, y:y + patch_size] += prediction
+
+    return sums / counts
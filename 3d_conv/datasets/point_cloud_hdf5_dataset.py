@@ -2,6 +2,7 @@
 from rgbd_hdf5_dataset import RGBD_HDF5_Dataset, HDF5_Iterator,  GaussianNoisePostProcessor
 
 import numpy as np
+from utils.tracing import traced
 
 
 class PointCloud_HDF5_Dataset(RGBD_HDF5_Dataset):
@@ -93,6 +94,7 @@ def create_point_cloud_vectorized(rgbd_image, structured=False):
     return np.array((x, y, z)).reshape(3, -1).swapaxes(0, 1)
 
 
+@traced("create_voxel_grid_around_point", "voxelize")
 def create_voxel_grid_around_point(points, patch_center, voxel_resolution=0.001, num_voxels_per_dim=72):
 
     voxel_grid = np.zeros((num_voxels_per_dim,
@@ -124,6 +126,7 @@ def create_voxel_grid_around_point(points, patch_center, voxel_resolution=0.001,
 
 class HDF5_PointCloud_Iterator(HDF5_Iterator):
 
+    @traced("HDF5_PointCloud_Iterator.next", "iterator")
     def next(self, rgb=False):
 
         batch_indices = np.random.random_integers(0, self.dataset.get_num_examples()-1, self.batch_size)
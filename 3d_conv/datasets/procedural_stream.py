@@ -0,0 +1,172 @@
+
+import multiprocessing
+import traceback
+import ctypes
+import numpy as np
+
+from utils import tracing
+
+
+#An infinite stream of synthetic batches generated by a pool of worker
+#processes into a ring of shared memory slots.
+#
+#Batch i is always generated from seed batch_seed(seed, i), by worker
+#i % num_workers, into that worker's slot (i / num_workers) % slots_per_worker.
+#Every worker fills its own slots in order, and the consumer reads batches in
+#order, so the stream is identical for a given seed no matter how many workers
+#are used:
+#
+#   stream = ProceduralStream(IteratorBatchGenerator(Geometric3DDataset(patch_size=32), batch_size=20), seed=0)
+#   for i in xrange(n_train_batches):
+#       batch_x, batch_y = stream.next()
+#   stream.close()
+
+
+def batch_seed(seed, batch_index):
+    """Seed used to generate batch batch_index of a stream started with seed."""
+    # a linear mix of the two would map different pairs to the same seed,
+    # RandomState seeds from the pair as a whole
+    return int(np.random.RandomState([seed, batch_index]).randint(2 ** 31 - 1))
+
+
+class IteratorBatchGenerator():
+    """
+    Generates one batch from any dataset whose iterator draws its randomness
+    from np.random (Geometric3DDataset, ...), by reseeding np.random first.
+    """
+
+    def __init__(self, dataset, batch_size):
+        self.dataset = dataset
+        self.batch_size = batch_size
+
+    def __call__(self, seed):
+        np.random.seed(seed)
+        iterator = self.dataset.iterator(batch_size=self.batch_size, num_batches=1)
+        return iterator.next()
+
+
+class _SharedBatch():
+    """A pair of numpy arrays backed by one block of shared memory."""
+
+    def __init__(self, x_template, y_template):
+        self.shapes = (x_template.shape, y_template.shape)
+        self.dtypes = (x_template.dtype, y_template.dtype)
+        self.x_nbytes = x_template.nbytes
+
+        self.buffer = multiprocessing.RawArray(ctypes.c_char, x_template.nbytes + y_template.nbytes)
+
+    def views(self):
+        x = np.frombuffer(self.buffer, dtype=self.dtypes[0], count=int(np.prod(self.shapes[0])))
+        y = np.frombuffer(self.buffer, dtype=self.dtypes[1], count=int(np.prod(self.shapes[1])),
+                          offset=self.x_nbytes)
+        return x.reshape(self.shapes[0]), y.reshape(self.shapes[1])
+
+
+def _worker(generator, seed, worker_index, num_workers, slots, free, filled, stop, errors):
+    try:
+        batch_index = worker_index
+        slot_index = 0
+        while not stop.is_set():
+            #wait for the consumer to hand this slot back
+            while not free[slot_index].acquire(True, .1):
+                if stop.is_set():
+                    return
+
+            with tracing.span("generate", "data", batch_index=batch_index):
+                batch_x, batch_y = generator(batch_seed(seed, batch_index))
+            x, y = slots[slot_index].views()
+            x[...] = batch_x
+            y[...] = batch_y
+
+            filled[slot_index].release()
+
+            batch_index += num_workers
+            slot_index = (slot_index + 1) % len(slots)
+    except Exception:
+        errors.put(traceback.format_exc())
+        stop.set()
+    finally:
+        # the process leaves with os._exit, without the atexit handlers
+        tracing.flush()
+
+
+class ProceduralStream():
+
+    def __init__(self, generator, num_workers=None, slots_per_worker=2, seed=0):
+        """
+        :param generator: callable taking a seed and returning (batch_x, batch_y).
+            Every call must return arrays of the same shape and dtype.
+        :param num_workers: number of worker processes, defaults to the number of cores
+        :param slots_per_worker: how many batches each worker may generate ahead
+        :param seed: seed of the whole stream
+        """
+        if num_workers is None:
+            num_workers = multiprocessing.cpu_count()
+
+        self.generator = generator
+        self.num_workers = num_workers
+        self.slots_per_worker = slots_per_worker
+        self.seed = seed
+
+        #learn the shapes of the batches, with a seed the stream never uses. The
+        #generator may seed the global random state (IteratorBatchGenerator),
+        #leave it as the caller had it
+        random_state = np.random.get_state()
+        x_template, y_template = generator(2 ** 32 - 1)
+        np.random.set_state(random_state)
+        x_template = np.asarray(x_template)
+        y_template = np.asarray(y_template)
+
+        self.stop = multiprocessing.Event()
+        self.errors = multiprocessing.Queue()
+
+        self.slots = []
+        self.free = []
+        self.filled = []
+        self.workers = []
+        for worker_index in xrange(num_workers):
+            slots = [_SharedBatch(x_template, y_template) for i in xrange(slots_per_worker)]
+            free = [multiprocessing.Semaphore(1) for i in xrange(slots_per_worker)]
+            filled = [multiprocessing.Semaphore(0) for i in xrange(slots_per_worker)]
+
+            worker = multiprocessing.Process(target=_worker,
+                                             args=(generator, seed, worker_index, num_workers,
+                                                   slots, free, filled, self.stop, self.errors))
+            worker.daemon = True
+            worker.start()
+
+            self.slots.append(slots)
+            self.free.append(free)
+            self.filled.append(filled)
+            self.workers.append(worker)
+
+        self.batch_index = 0
+
+    def __iter__(self):
+        return self
+
+    @tracing.traced("ProceduralStream.next", "iterator")
+    def next(self):
+        worker_index = self.batch_index % self.num_workers
+        slot_index = (self.batch_index / self.num_workers) % self.slots_per_worker
+
+        while not self.filled[worker_index][slot_index].acquire(True, 1.0):
+            if not self.errors.empty():
+                self.close()
+                raise RuntimeError("procedural stream worker failed:\n" + self.errors.get())
+            if self.stop.is_set():
+                raise RuntimeError("procedural stream has been closed")
+
+        x, y = self.slots[worker_index][slot_index].views()
+        batch_x = np.copy(x)
+        batch_y = np.copy(y)
+
+        self.free[worker_index][slot_index].release()
+        self.batch_index += 1
+
+        return batch_x, batch_y
+
+    def close(self):
+        self.stop.set()
+        for worker in self.workers:
+            worker.join()
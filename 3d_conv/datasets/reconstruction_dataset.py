@@ -10,6 +10,8 @@ import PyKDL
 
 import math
 
+from utils.tracing import span, traced
+
 class ReconstructionDataset():
 
     def __init__(self,
@@ -51,6 +53,7 @@ class ReconstructionDataset():
                                           batch_size=batch_size,
                                           num_batches=num_batches)
 
+@traced("create_voxel_grid_around_point", "voxelize")
 def create_voxel_grid_around_point(points, patch_center, voxel_resolution=0.001, num_voxels_per_dim=72):
 
     voxel_grid = np.zeros((num_voxels_per_dim,
@@ -140,7 +143,7 @@ def build_training_example(binvox_file_path, model_pose_filepath, single_view_po
     pc = np.load(single_view_pointcloud_filepath)
     pc = pc[:, 0:3]
     model_pose = np.load(model_pose_filepath)
-    with open(binvox_file_path, 'rb') as f:
+    with span("binvox_read", "io", filepath=binvox_file_path), open(binvox_file_path, 'rb') as f:
         model = binvox_rw.read_as_3d_array(f)
 
     points = model.data
@@ -217,6 +220,7 @@ class ReconstructionIterator(collections.Iterator):
     def __iter__(self):
         return self
 
+    @traced("ReconstructionIterator.next", "iterator")
     def next(self):
 
         batch_indices = np.random.random_integers(0, self.dataset.get_num_examples()-1, self.batch_size)
@@ -0,0 +1,227 @@
+
+import numpy as np
+import collections
+import h5py
+
+from utils.tracing import traced
+
+
+#Synthesizes single view partial grids from complete voxel models at batch
+#time, instead of voxelizing 1000 gazebo pointclouds per model ahead of time.
+#The camera looks down the Z axis of a BZCXY batch, so the visible surface is
+#the lowest occupied z index along every (x, y) ray, the same convention used
+#by Geometric3dIterator's kinect scan.
+
+
+def random_rotations(num_rotations, rng=np.random):
+    """
+    Returns a (num_rotations, 3, 3) array of rotation matrices drawn uniformly
+    from SO(3) (Shoemake's method on random unit quaternions).
+    """
+    u1, u2, u3 = rng.rand(3, num_rotations)
+
+    x = np.sqrt(1 - u1) * np.sin(2 * np.pi * u2)
+    y = np.sqrt(1 - u1) * np.cos(2 * np.pi * u2)
+    z = np.sqrt(u1) * np.sin(2 * np.pi * u3)
+    w = np.sqrt(u1) * np.cos(2 * np.pi * u3)
+
+    rotations = np.empty((num_rotations, 3, 3))
+    rotations[:, 0, 0] = 1 - 2 * (y * y + z * z)
+    rotations[:, 0, 1] = 2 * (x * y - z * w)
+    rotations[:, 0, 2] = 2 * (x * z + y * w)
+    rotations[:, 1, 0] = 2 * (x * y + z * w)
+    rotations[:, 1, 1] = 1 - 2 * (x * x + z * z)
+    rotations[:, 1, 2] = 2 * (y * z - x * w)
+    rotations[:, 2, 0] = 2 * (x * z - y * w)
+    rotations[:, 2, 1] = 2 * (y * z + x * w)
+    rotations[:, 2, 2] = 1 - 2 * (x * x + y * y)
+
+    return rotations
+
+
+def rotate_grids(grids, rotations):
+    """
+    Rotates a batch of voxel grids (5d BZCXY) about the center of the grid.
+    rotations is a (batch_size, 3, 3) array acting on (z, x, y) voxel coordinates.
+    Every output voxel is looked up in the input grid (nearest neighbor), so
+    the rotated grids have no holes.  Voxels rotated in from outside the grid are 0.
+    """
+    batch_size, zdim, num_channels, xdim, ydim = grids.shape
+    dims = np.array([zdim, xdim, ydim])
+    center = (dims - 1) / 2.0
+
+    #output voxel coordinates relative to the center, shape (num_voxels, 3)
+    coords = np.indices((zdim, xdim, ydim)).reshape(3, -1).T - center
+
+    #source coordinate of every output voxel: R^T (q - c) + c
+    src = np.rint(np.einsum('bji,nj->bni', rotations, coords) + center).astype(int)
+    valid = np.all((src >= 0) & (src < dims), axis=2)
+
+    flat_src = (src[:, :, 0] * xdim + src[:, :, 1]) * ydim + src[:, :, 2]
+    flat_src[~valid] = 0
+
+    volumes = grids.transpose(0, 2, 1, 3, 4).reshape(batch_size, num_channels, -1)
+    rotated = volumes[np.arange(batch_size)[:, None, None],
+                      np.arange(num_channels)[None, :, None],
+                      flat_src[:, None, :]]
+    rotated *= valid[:, None, :]
+
+    rotated = rotated.reshape(batch_size, num_channels, zdim, xdim, ydim)
+    return np.ascontiguousarray(rotated.transpose(0, 2, 1, 3, 4))
+
+
+def render_visible_surface(grids,
+                           depth_noise_sigma=0,
+                           missing_prob=0,
+                           fill_shadow=False,
+                           rng=np.random):
+    """
+    Z-buffers a batch of complete grids (5d BZCXY, occupancy in channel 0) from a
+    camera looking down +Z.  Returns float32 grids of the same shape containing
+    only the first occupied voxel of every (x, y) ray.
+
+    :param depth_noise_sigma: std dev, in voxels, of gaussian noise added to each depth
+    :param missing_prob: probability that a ray returns nothing, like missing kinect pixels
+    :param fill_shadow: also mark every voxel behind the surface (shadow carving input)
+    """
+    zdim = grids.shape[1]
+    occupied = grids[:, :, 0, :, :] > .5
+
+    hit = occupied.any(axis=1)
+    depth = occupied.argmax(axis=1)
+
+    if depth_noise_sigma:
+        depth = np.rint(depth + depth_noise_sigma * rng.randn(*depth.shape)).astype(int)
+        depth = np.clip(depth, 0, zdim - 1)
+
+    if missing_prob:
+        hit &= rng.rand(*hit.shape) >= missing_prob
+
+    views = np.zeros(grids.shape, dtype=np.float32)
+    b, x, y = np.nonzero(hit)
+    views[b, depth[b, x, y], 0, x, y] = 1
+
+    if fill_shadow:
+        views[:, :, 0, :, :] = np.maximum.accumulate(views[:, :, 0, :, :], axis=1)
+
+    return views
+
+
+class ViewSynthesisPostProcessor():
+    """
+    Replaces batch_x with a synthesized view of batch_y.  With random_pose each
+    example is first rotated by a uniformly random rotation, and batch_y is
+    returned in that same camera frame.
+    """
+
+    def __init__(self,
+                 random_pose=True,
+                 depth_noise_sigma=0,
+                 missing_prob=0,
+                 fill_shadow=False,
+                 rng=None):
+        self.random_pose = random_pose
+        self.depth_noise_sigma = depth_noise_sigma
+        self.missing_prob = missing_prob
+        self.fill_shadow = fill_shadow
+        self.rng = rng if rng is not None else np.random.RandomState()
+
+    def apply(self, batch_x, batch_y):
+
+        if self.random_pose:
+            batch_y = rotate_grids(batch_y, random_rotations(batch_y.shape[0], self.rng))
+
+        batch_x = render_visible_surface(batch_y,
+                                         depth_noise_sigma=self.depth_noise_sigma,
+                                         missing_prob=self.missing_prob,
+                                         fill_shadow=self.fill_shadow,
+                                         rng=self.rng)
+
+        return batch_x, batch_y
+
+
+class ViewSynthesisDataset():
+    """
+    Wraps an hdf5 file holding one complete grid per model, shape
+    (num_models, patch_size, patch_size, patch_size, 1), and renders a new
+    partial view of each model every time it is drawn.
+    """
+
+    def __init__(self,
+                 hdf5_filepath,
+                 models_key='y',
+                 depth_noise_sigma=0,
+                 missing_prob=0):
+
+        self.dset = h5py.File(hdf5_filepath, 'r')
+        self.models_key = models_key
+
+        self.num_examples = self.dset[models_key].shape[0]
+        self.patch_size = self.dset[models_key].shape[1]
+
+        self.depth_noise_sigma = depth_noise_sigma
+        self.missing_prob = missing_prob
+
+    def get_num_examples(self):
+        return self.num_examples
+
+    def iterator(self,
+                 batch_size=None,
+                 num_batches=None,
+                 iterator_post_processors=[]):
+
+            return ViewSynthesisIterator(self,
+                                         batch_size=batch_size,
+                                         num_batches=num_batches,
+                                         iterator_post_processors=iterator_post_processors)
+
+
+class ViewSynthesisIterator(collections.Iterator):
+
+    def __init__(self,
+                 dataset,
+                 batch_size,
+                 num_batches,
+                 iterator_post_processors=[]):
+
+        self.dataset = dataset
+
+        self.batch_size = batch_size
+        self.num_batches = num_batches
+
+        self.view_synthesizer = ViewSynthesisPostProcessor(depth_noise_sigma=dataset.depth_noise_sigma,
+                                                           missing_prob=dataset.missing_prob)
+        self.iterator_post_processors = iterator_post_processors
+
+    def __iter__(self):
+        return self
+
+    @traced("ViewSynthesisIterator.next", "iterator")
+    def next(self):
+
+        batch_indices = np.random.random_integers(0, self.dataset.get_num_examples()-1, self.batch_size)
+
+        #hdf5 fancy indexing needs increasing, unique indices
+        unique_indices, inverse = np.unique(batch_indices, return_inverse=True)
+        batch_y = self.dataset.dset[self.dataset.models_key][list(unique_indices)][inverse]
+        batch_y = np.array(batch_y, dtype=np.float32)
+
+        #make batch B2C01 rather than B012C
+        batch_y = batch_y.transpose(0, 3, 4, 1, 2)
+
+        batch_x, batch_y = self.view_synthesizer.apply(None, batch_y)
+
+        #apply post processors to the patches
+        for post_processor in self.iterator_post_processors:
+            batch_x, batch_y = post_processor.apply(batch_x, batch_y)
+
+        return batch_x, batch_y
+
+    def batch_size(self):
+        return self.batch_size
+
+    def num_batches(self):
+        return self.num_batches
+
+    def num_examples(self):
+        return self.dataset.get_num_examples()
@@ -7,7 +7,6 @@ import gzip
 import os
 import sys
 import time
-import scipy.misc
 import os
 import sys
 import time
@@ -32,6 +31,7 @@ from mpl_toolkits.mplot3d import Axes3D
 from layers.hidden_layer import *
 from layers.conv_layer_3d import *
 from layers.layer_utils import *
+from utils.digit_volumes import cached_digit_volumes
 
 
 def relu(x):
@@ -169,119 +169,21 @@ def load_data(dataset):
 
 
 
-   #Scales mnist data and converts to 3D
-    #code to visualize resized digits commented out
-    def resize(input):
-        numRows = input.shape[0]/10
-        #newX = numpy.zeros((numRows, 4000))
-        #newY = numpy.zeros((numRows, 4000))
-        newData = numpy.zeros((numRows, 20, 20, 20))
-
-        for i in xrange(numRows):
-                a = numpy.reshape(input[i,:], (28,28))
-                newImage = scipy.misc.imresize(a,(20,20))
-                angle = 0.4*(2*numpy.random.rand() - 1) * numpy.pi
-                # deltaX = 0.9*(6.5*(1-abs(numpy.cos(angle)))) * (2*numpy.random.rand()-1)
-                #deltaZ = 0.9*(9*(1-abs(numpy.sin(angle)))) * (2*numpy.random.rand()-1)
-                deltaZ = 0
-
-
-                for r in xrange(20):
-                    # generate a random angle between -0.4*pi and 0.4*pi/2
-                    oldX = r - 9
-                    oldZ = 6.5 - 6.5
-                    newnewX = numpy.cos(angle) * oldX - numpy.sin(angle) * oldZ + 9
-                    newZ = numpy.sin(angle) * oldX + numpy.cos(angle) * oldZ + 9 + deltaZ
-
-                    newData[i, numpy.around(newZ), numpy.around(newnewX), 0:20] = newImage[r, :]
-        """
-        xdata = newData[:,:,0:10,:]
-        ydata = newData[:,:,10:,:]/255.0
-        ydata = numpy.ceil(ydata)
-        """
-        """
-        for i in xrange(numRows):
-            newX[i]=xdata[i].flatten()
-            newY[i]=ydata[i].flatten()
-        """
-
-        """
-        for i in xrange(10):
-            values = newData[i].reshape(14,14,14)
-            newX[i] = values[:,0:7,:]
-            newY[i] = values[:,7:,:]
-        """
-
-
-        """
-        for i in xrange(numRows):
-                a = numpy.reshape(input[i,:], (28,28))
-                newImage = scipy.misc.imresize(a,(14,14))
-                #scaledX = newImage[0:10,:]
-                #scaledY = newImage[10:,:]/255.0
-                for r in xrange(10):
-
-                    newX[i,r*14*14+r*14:r*14*14+r*14+14] = newImage[r,:]
-                for r in xrange(4):
-
-                    newYVals = newImage[r,:]
-                    binarizedY = numpy.around(newYVals)
-
-                    newY[i,r*14*14+r*14:r*14*14+r*14+14] = binarizedY
-        """
-        #result = numpy.around(result)
-        """
-        for i in xrange(5):
-
-            concat = numpy.concatenate((newX[i].reshape(14,7,14), newY[i].reshape(14,7,14)), axis = 1)
-            toPlot = concat
-            x,y,z = toPlot.nonzero()
-            fig = plt.figure()
-
-            ax = fig.add_subplot(111,projection='3d')
-            #ax.set_aspect('equal')
-            ax.plot([0],[0],[0],'w')
-            ax.plot([13],[13],[13],'w')
-
-            ax.scatter(x,-y,z, zdir='z', c= 'red')
-
-            plt.show()
-
-
-            xx = newX[i].flatten()
-
-            toPlot = xx.reshape(14,7,14)
-            x,y,z = toPlot.nonzero()
-            fig = plt.figure()
-            ax = fig.add_subplot(111,projection='3d')
-            ax.scatter(x,-y,z, zdir='z', c= 'red')
-            plt.show()
-
-            print newX[i]
-            yy = newY[i].flatten()
-            yy = numpy.around(yy)
-            toPlot = yy.reshape(14,7,14)
-            x,y,z = toPlot.nonzero()
-            fig = plt.figure()
-            ax = fig.add_subplot(111,projection='3d')
-
-
-            ax.scatter(x,-y,z, zdir='z', c= 'red')
-            plt.show()
-            """
-
-
+    #Scales mnist data and converts to 3D, one tenth of each split.
+    #The converted volumes are cached next to the dataset, keyed on its hash.
+    def resize(input, split_name):
+        volumes = cached_digit_volumes(dataset, split_name, input, num_examples=input.shape[0]/10)
 
         print "resized"
 
-        return newData[:,:, numpy.newaxis, 0:10,:], numpy.ceil(newData[:,:,numpy.newaxis, 10:,:]/255.0)
+        return volumes[:, :, numpy.newaxis, 0:10, :], (volumes[:, :, numpy.newaxis, 10:, :] > 0).astype(numpy.uint8)
 
 
     valid_set_x, ylabels = valid_set
     train_set_x, ylabelstrain = train_set
 
-    valid_set_x, valid_set_y = resize(valid_set_x)
-    train_set_x, train_set_y = resize(train_set_x)
+    valid_set_x, valid_set_y = resize(valid_set_x, 'valid')
+    train_set_x, train_set_y = resize(train_set_x, 'train')
 
     rval = [(train_set_x, train_set_y), (valid_set_x, valid_set_y),
             ]
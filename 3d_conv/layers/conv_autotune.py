@@ -0,0 +1,86 @@
+import time
+import numpy
+import theano
+import theano.tensor as T
+from theano.tensor.nnet.conv3d2d import conv3d
+from layers.fft_conv_3d import fft_conv3d
+from utils import cache
+
+#Picks the fastest 3d convolution for a layer shape. Each candidate is compiled
+#and timed (forward and both gradients, as in training) the first time a shape
+#is seen, and the winner is remembered in a json file in the on disk cache
+#(utils/cache.py) so later builds of the same model skip the timing.
+
+CONV_IMPLS = {
+    'conv3d2d': conv3d,
+    'fft': fft_conv3d,
+}
+
+CACHE_FILENAME = "conv_autotune.json"
+CACHE_VERSION = 1
+
+_chosen = {}
+
+
+def get_conv_impl(conv_impl):
+    if conv_impl not in CONV_IMPLS:
+        raise ValueError("unknown conv_impl " + str(conv_impl) + ", expected one of " +
+                         str(sorted(CONV_IMPLS.keys()) + ['auto']))
+    return CONV_IMPLS[conv_impl]
+
+
+def shape_key(image_shape, filter_shape):
+    return "v%d %s %s %s %s" % (CACHE_VERSION, theano.config.device, theano.config.floatX,
+                                "x".join(map(str, image_shape)), "x".join(map(str, filter_shape)))
+
+
+def time_conv_impl(conv_impl, image_shape, filter_shape, num_repeats=3):
+    """Mean seconds of one forward and backward pass of conv_impl on random data."""
+    dtensor5 = T.TensorType(theano.config.floatX, (0,)*5)
+    signals = dtensor5()
+    filters = dtensor5()
+    out = CONV_IMPLS[conv_impl](signals=signals, filters=filters, signals_shape=image_shape,
+                                filters_shape=filter_shape, border_mode='valid')
+    f = theano.function([signals, filters], T.grad(out.sum(), [signals, filters]))
+
+    rng = numpy.random.RandomState(0)
+    signals_value = rng.rand(*image_shape).astype(theano.config.floatX)
+    filters_value = rng.rand(*filter_shape).astype(theano.config.floatX)
+
+    f(signals_value, filters_value)
+    start_time = time.time()
+    for i in xrange(num_repeats):
+        f(signals_value, filters_value)
+    return (time.time() - start_time) / num_repeats
+
+
+def choose_conv_impl(image_shape, filter_shape, num_repeats=3):
+    """
+    Name of the fastest conv implementation for these shapes, timing the
+    candidates if needed. A batch size of None (any batch size) is timed as 1.
+    """
+    image_shape = tuple(int(dim) if dim is not None else 1 for dim in image_shape)
+    filter_shape = tuple(int(dim) for dim in filter_shape)
+    key = shape_key(image_shape, filter_shape)
+    if key in _chosen:
+        return _chosen[key]
+
+    tuned = cache.load_json(CACHE_FILENAME)
+    if key in tuned and tuned[key]['best'] in CONV_IMPLS:
+        _chosen[key] = tuned[key]['best']
+        return _chosen[key]
+
+    print "timing conv implementations for " + key
+    timings = {}
+    for conv_impl in sorted(CONV_IMPLS.keys()):
+        timings[conv_impl] = time_conv_impl(conv_impl, image_shape, filter_shape, num_repeats)
+        print "%s: %.2fms" % (conv_impl, timings[conv_impl] * 1000)
+    best = min(timings, key=timings.get)
+
+    #reload so that entries written by other processes meanwhile are kept
+    tuned = cache.load_json(CACHE_FILENAME)
+    tuned[key] = {'best': best, 'timings': timings}
+    cache.save_json(CACHE_FILENAME, tuned)
+
+    _chosen[key] = best
+    return best
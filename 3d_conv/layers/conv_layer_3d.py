@@ -4,11 +4,13 @@ from theano.tensor.nnet.conv3d2d import *
 from layers.layer_utils import *
 from layers.layer import Layer
 from layers.max_pool_layer_3d import *
+from layers.conv_autotune import get_conv_impl, choose_conv_impl
 
 class ConvLayer3D(Layer):
     """3D Layer of a convolutional network """
 
-    def __init__(self, rng, input, filter_shape, image_shape, drop, poolsize=None, p=0.5, W=None, b=None):
+    def __init__(self, rng, input, filter_shape, image_shape, drop=None, poolsize=None, p=0.5, W=None, b=None,
+                 conv_impl='conv3d2d', train_input=None):
         """
         Allocate a layer with shared variable internal parameters.
 
@@ -24,10 +26,22 @@ class ConvLayer3D(Layer):
 
         :type image_shape: tuple or list of length 4
         :param image_shape: (batch size, num input feature maps,
-                             image height, image width)
+                             image height, image width); a batch size of
+                             None takes inputs of any batch size
 
         :type poolsize: tuple or list of length 2
         :param poolsize: the downsampling (pooling) factor (#rows, #cols)
+
+        :type conv_impl: str
+        :param conv_impl: 'conv3d2d', 'fft', or 'auto' to use whichever of the
+                          two is fastest for these shapes (see conv_autotune)
+
+        :type drop: theano.tensor.iscalar or None
+        :param drop: when given, output switches between the training (non zero)
+                     and inference (zero) expressions, as the standalone scripts
+                     expect; otherwise output is the inference expression only
+
+        :param train_input: input of the training graph, if it differs from input
         """
 
 
@@ -56,11 +70,15 @@ class ConvLayer3D(Layer):
         self.b = b
         self.W = W
 
+        if conv_impl == 'auto':
+            conv_impl = choose_conv_impl(image_shape, filter_shape)
+        self.conv_impl = conv_impl
+
         # convolve input feature maps with filters
-        conv_out = conv3d(
+        conv_out = get_conv_impl(conv_impl)(
             signals=input,
             filters=self.W,
-            signals_shape=image_shape,
+            signals_shape=static_shape(image_shape),
             filters_shape=filter_shape,
             border_mode='valid'
 
@@ -81,21 +99,29 @@ class ConvLayer3D(Layer):
         out = relu(conv_out + self.b.dimshuffle('x', 'x', 0, 'x', 'x'))
 
 
-        droppedOutput = dropout(rng, out, p)
-
         self.input_shape = image_shape
         self.output_shape = (batch_size, newZ, nchannels_out, newX, newY)
-        self.output = T.switch(T.neq(drop, 0), droppedOutput, out)
+
+        # dropout only in the training graph
+        self.train_output = dropout(rng, training_expression(out, {input: train_input}), p)
+        if drop is None:
+            self.output = out
+        else:
+            self.output = T.switch(T.neq(drop, 0), self.train_output, out)
 
         # store parameters of this layer
         self.params = [self.W, self.b]
+        self.pool = None
 
         print
         # if poolsize is an integer greater than 1, then apply maxpooling
         if isinstance(poolsize, int) and poolsize >= 2:
-            pooled = MaxPoolLayer3D(self.output, self.output_shape, ds=poolsize, ignore_border=False)
+            pooled = MaxPoolLayer3D(self.output, self.output_shape, ds=poolsize, ignore_border=False,
+                                    train_input=self.train_output)
+            self.pool = pooled
             self.output_shape = pooled.get_output_shape()
             self.output = pooled.get_output()
+            self.train_output = pooled.train_output
             self.params += pooled.get_params()
         elif poolsize != None:
             print "The poolsize you entered has been ignored (it needs to be an int greater than 1, or None) it is currently: " + str(poolsize)
@@ -103,6 +129,7 @@ class ConvLayer3D(Layer):
         print "added conv layer"
         print "input shape: " + str(self.input_shape)
         print "filter shape: " + str(filter_shape)
+        print "conv implementation: " + self.conv_impl
         if isinstance(poolsize, int) and poolsize >= 2:
             print "poolsize (for maxpooling): " + str(poolsize)
         print "output shape: " + str(self.output_shape)
@@ -0,0 +1,139 @@
+import numpy
+import theano
+import theano.tensor as T
+from layers.layer_utils import *
+from layers.layer import Layer
+from layers.conv_autotune import get_conv_impl, choose_conv_impl
+
+
+class DeconvLayer3D(Layer):
+    """3D transposed convolution (fractionally strided convolution) layer """
+
+    def __init__(self, rng, input, filter_shape, image_shape, upsample=2, activation=relu,
+                 W=None, b=None, conv_impl='conv3d2d', train_input=None):
+        """
+        Upsamples a BZCXY input by upsample in each spatial dimension: the input
+        voxels are spread upsample apart with zeros in between, then convolved
+        with filter_shape filters over the full (zero padded) extent. The output
+        is cropped to exactly upsample times the input size, so a
+        (batch, 8, c, 8, 8) input with upsample=2 gives (batch, 16, n, 16, 16)
+        whatever the filter size. The parameters do not depend on the output
+        resolution.
+
+        :type filter_shape: tuple or list of length 5
+        :param filter_shape: (number of filters, filter z, num input feature maps,
+                              filter x, filter y), filter sizes >= upsample
+
+        :type image_shape: tuple or list of length 5
+        :param image_shape: (batch size, z, num input feature maps, x, y),
+                            a batch size of None for any batch size
+
+        :type upsample: int
+        :param upsample: upsampling factor (stride of the transposed convolution)
+
+        :type conv_impl: str
+        :param conv_impl: 'conv3d2d', 'fft' or 'auto', as for ConvLayer3D
+
+        :param train_input: input of the training graph, if it differs from input
+        """
+
+        batch_size, zdim, nchannels_in, xdim, ydim = image_shape
+        nchannels_out, fz, _, fx, fy = filter_shape
+        spatial_in = (zdim, xdim, ydim)
+        filter_size = (fz, fx, fy)
+
+        assert nchannels_in == filter_shape[2]
+        assert min(filter_size) >= upsample
+
+        self.input = input
+
+        if W is None:
+            W_values = numpy.asarray(numpy.random.normal(loc=0., scale=.01, size=filter_shape), dtype=theano.config.floatX)
+
+            if activation == theano.tensor.nnet.sigmoid:
+                W_values *= 4
+
+            W = theano.shared(value=W_values, name='W', borrow=True)
+
+        if b is None:
+            b_values = numpy.ones((nchannels_out,), dtype=theano.config.floatX)
+            b = theano.shared(value=b_values, name='b', borrow=True)
+
+        self.W = W
+        self.b = b
+        self.activation = activation
+        self.upsample = upsample
+
+        # spread the input voxels upsample apart inside a frame padded by
+        # filter size - 1 on each side, so that the valid convolution below
+        # is the full convolution of the strided input
+        frame_shape = [(n - 1) * upsample + 1 + 2 * (f - 1) for n, f in zip(spatial_in, filter_size)]
+        conv_shape = (batch_size, frame_shape[0], nchannels_in, frame_shape[1], frame_shape[2])
+        frame = T.zeros(symbolic_shape(input, conv_shape), dtype=input.dtype)
+        frame = T.set_subtensor(frame[:,
+                                      fz - 1:frame_shape[0] - fz + 1:upsample,
+                                      :,
+                                      fx - 1:frame_shape[1] - fx + 1:upsample,
+                                      fy - 1:frame_shape[2] - fy + 1:upsample], input)
+
+        if conv_impl == 'auto':
+            conv_impl = choose_conv_impl(conv_shape, filter_shape)
+        self.conv_impl = conv_impl
+
+        conv_out = get_conv_impl(conv_impl)(
+            signals=frame,
+            filters=self.W,
+            signals_shape=static_shape(conv_shape),
+            filters_shape=filter_shape,
+            border_mode='valid'
+        )
+
+        # the full convolution is (n - 1) * upsample + filter size long, keep
+        # the centered n * upsample voxels
+        spatial_out = [n * upsample for n in spatial_in]
+        crop = [(f - upsample) // 2 for f in filter_size]
+        conv_out = conv_out[:,
+                            crop[0]:crop[0] + spatial_out[0],
+                            :,
+                            crop[1]:crop[1] + spatial_out[1],
+                            crop[2]:crop[2] + spatial_out[2]]
+
+        lin_output = conv_out + self.b.dimshuffle('x', 'x', 0, 'x', 'x')
+        self.output = (
+            lin_output if activation is None
+            else activation(lin_output)
+        )
+        self.train_output = training_expression(self.output, {input: train_input})
+
+        self.params = [self.W, self.b]
+
+        self.input_shape = image_shape
+        self.output_shape = (batch_size, spatial_out[0], nchannels_out, spatial_out[1], spatial_out[2])
+
+        print
+        print "added deconv layer"
+        print "input shape: " + str(self.input_shape)
+        print "filter shape: " + str(filter_shape)
+        print "upsample factor: " + str(upsample)
+        print "conv implementation: " + self.conv_impl
+        print "output shape: " + str(self.output_shape)
+
+    def cross_entropy_error(self, y):
+        # y is the flattened target grid, as for ReconLayer
+        eps = 0.000001
+        out = T.clip(self.output.flatten(2), 0 + eps, 1 - eps)
+        L = - T.sum(y * T.log(out) + (1 - y) * T.log(1 - out), axis=1)
+        cost = T.mean(L)
+        return cost
+
+    def negative_log_likelihood(self, y):
+        return self.cross_entropy_error(y)
+
+    def errors(self, y):
+        binarizedoutput = T.round(self.output.flatten(2))
+        errRate = T.mean(T.neq(binarizedoutput, y))
+
+        return errRate
+
+    def return_output(self):
+        return self.output
@@ -0,0 +1,174 @@
+import numpy
+import theano
+import theano.tensor as T
+
+
+#Valid 3d convolution computed with FFTs, with the same layout and semantics
+#as theano.tensor.nnet.conv3d2d.conv3d (a true convolution, the filters are
+#flipped):
+#   signals - (batch size, z, input channels, x, y)
+#   filters - (output channels, z, input channels, x, y)
+#   output  - (batch size, z - fz + 1, output channels, x - fx + 1, y - fy + 1)
+#
+#The cost of conv3d2d grows with the filter volume while the FFT path is
+#dominated by transforms of the (padded) signal, so it wins for large filters
+#and volumes on the CPU. The ops run numpy.fft on the host.
+
+SPATIAL_AXES = (-3, -2, -1)
+
+
+def _to_channels_first(a):
+    #BZCXY -> BCZXY
+    return a.transpose(0, 2, 1, 3, 4)
+
+
+def _to_bzcxy(a):
+    return a.transpose(0, 2, 1, 3, 4)
+
+
+def _next_fast_len(n):
+    """Smallest 2^a 3^b 5^c >= n, fftpack is slow for sizes with large prime factors."""
+    best = 2 * n
+    p5 = 1
+    while p5 < best:
+        p35 = p5
+        while p35 < best:
+            p235 = p35
+            while p235 < n:
+                p235 *= 2
+            best = min(best, p235)
+            p35 *= 3
+        p5 *= 5
+    return best
+
+
+def _fft_convolve(a, b, contraction, size):
+    """
+    Circular convolution, over the 3 trailing axes, of channels first arrays a
+    and b zero padded to at least size, with the leading axes combined by the
+    einsum contraction. Output entries that do not wrap around are those of
+    the linear convolution, the valid part only needs size >= the signal size.
+    """
+    shape = tuple(_next_fast_len(n) for n in size)
+    fa = numpy.fft.rfftn(a, shape, axes=SPATIAL_AXES)
+    fb = numpy.fft.rfftn(b, shape, axes=SPATIAL_AXES)
+    return numpy.fft.irfftn(numpy.einsum(contraction, fa, fb), shape, axes=SPATIAL_AXES)
+
+
+def fft_conv3d_numpy(signals, filters):
+    """Valid convolution of BZCXY signals with FCZXY (conv3d2d layout) filters."""
+    s = _to_channels_first(signals)
+    w = _to_channels_first(filters)
+
+    full = _fft_convolve(s, w, 'bcijk,fcijk->bfijk', s.shape[2:])
+    kz, kx, ky = w.shape[2:]
+    valid = full[:, :, kz - 1:s.shape[2], kx - 1:s.shape[3], ky - 1:s.shape[4]]
+
+    return _to_bzcxy(valid).astype(signals.dtype)
+
+
+def fft_conv3d_grad_signals_numpy(output_grad, filters):
+    """Gradient of fft_conv3d_numpy with respect to the signals: a full correlation."""
+    g = _to_channels_first(output_grad)
+    w = _to_channels_first(filters)[:, :, ::-1, ::-1, ::-1]
+
+    size = tuple(numpy.add(g.shape[2:], w.shape[2:]) - 1)
+    full = _fft_convolve(g, w, 'bfijk,fcijk->bcijk', size)
+    full = full[:, :, :size[0], :size[1], :size[2]]
+
+    return _to_bzcxy(full).astype(output_grad.dtype)
+
+
+def fft_conv3d_grad_filters_numpy(signals, output_grad):
+    """Gradient of fft_conv3d_numpy with respect to the filters."""
+    s = _to_channels_first(signals)
+    g = _to_channels_first(output_grad)[:, :, ::-1, ::-1, ::-1]
+
+    full = _fft_convolve(s, g, 'bcijk,bfijk->fcijk', s.shape[2:])
+    gz, gx, gy = g.shape[2:]
+    #valid correlation of the signals with the output gradient, flipped back
+    valid = full[:, :, gz - 1:s.shape[2], gx - 1:s.shape[3], gy - 1:s.shape[4]]
+
+    return _to_bzcxy(valid[:, :, ::-1, ::-1, ::-1]).astype(signals.dtype)
+
+
+class FFTConv3D(theano.Op):
+
+    __props__ = ()
+
+    def make_node(self, signals, filters):
+        signals = T.as_tensor_variable(signals)
+        filters = T.as_tensor_variable(filters)
+        return theano.Apply(self, [signals, filters], [signals.type()])
+
+    def perform(self, node, inputs, output_storage):
+        signals, filters = inputs
+        output_storage[0][0] = fft_conv3d_numpy(signals, filters)
+
+    def infer_shape(self, node, input_shapes):
+        signals_shape, filters_shape = input_shapes
+        return [(signals_shape[0],
+                 signals_shape[1] - filters_shape[1] + 1,
+                 filters_shape[0],
+                 signals_shape[3] - filters_shape[3] + 1,
+                 signals_shape[4] - filters_shape[4] + 1)]
+
+    def grad(self, inputs, output_grads):
+        signals, filters = inputs
+        output_grad, = output_grads
+        return [FFTConv3DGradSignals()(output_grad, filters),
+                FFTConv3DGradFilters()(signals, output_grad)]
+
+
+class FFTConv3DGradSignals(theano.Op):
+
+    __props__ = ()
+
+    def make_node(self, output_grad, filters):
+        output_grad = T.as_tensor_variable(output_grad)
+        filters = T.as_tensor_variable(filters)
+        return theano.Apply(self, [output_grad, filters], [output_grad.type()])
+
+    def perform(self, node, inputs, output_storage):
+        output_grad, filters = inputs
+        output_storage[0][0] = fft_conv3d_grad_signals_numpy(output_grad, filters)
+
+    def infer_shape(self, node, input_shapes):
+        output_grad_shape, filters_shape = input_shapes
+        return [(output_grad_shape[0],
+                 output_grad_shape[1] + filters_shape[1] - 1,
+                 filters_shape[2],
+                 output_grad_shape[3] + filters_shape[3] - 1,
+                 output_grad_shape[4] + filters_shape[4] - 1)]
+
+
+class FFTConv3DGradFilters(theano.Op):
+
+    __props__ = ()
+
+    def make_node(self, signals, output_grad):
+        signals = T.as_tensor_variable(signals)
+        output_grad = T.as_tensor_variable(output_grad)
+        return theano.Apply(self, [signals, output_grad], [signals.type()])
+
+    def perform(self, node, inputs, output_storage):
+        signals, output_grad = inputs
+        output_storage[0][0] = fft_conv3d_grad_filters_numpy(signals, output_grad)
+
+    def infer_shape(self, node, input_shapes):
+        signals_shape, output_grad_shape = input_shapes
+        return [(output_grad_shape[2],
+                 signals_shape[1] - output_grad_shape[1] + 1,
+                 signals_shape[2],
+                 signals_shape[3] - output_grad_shape[3] + 1,
+                 signals_shape[4] - output_grad_shape[4] + 1)]
+
+
+def fft_conv3d(signals, filters, signals_shape=None, filters_shape=None, border_mode='valid'):
+    """
+    Drop in replacement for conv3d2d.conv3d, valid border mode only. The shape
+    arguments are accepted for compatibility and not needed.
+    """
+    if border_mode != 'valid':
+        raise ValueError("fft_conv3d only supports border_mode='valid', not %r" % (border_mode,))
+    return FFTConv3D()(signals, filters)
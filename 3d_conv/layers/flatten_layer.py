@@ -1,12 +1,14 @@
 
 from layers.layer import Layer
+from layers.layer_utils import symbolic_shape, training_expression
 from operator import mul
 
 class FlattenLayer(Layer):
 
-    def __init__(self, input, input_shape):
+    def __init__(self, input, input_shape, train_input=None):
         self.input = input
         self.output = input.flatten(2)
+        self.train_output = training_expression(self.output, {input: train_input})
 
         # parameters of the model
         self.params = []
@@ -17,4 +19,23 @@ class FlattenLayer(Layer):
         print
         print "adding flatten layer"
         print "input shape: " + str(self.input_shape)
-        print "output shape: " + str(self.output_shape)
\ No newline at end of file
+        print "output shape: " + str(self.output_shape)
+
+class UnflattenLayer(Layer):
+
+    def __init__(self, input, input_shape, output_shape, train_input=None):
+        self.input = input
+        self.output = input.reshape(symbolic_shape(input, output_shape))
+        self.train_output = training_expression(self.output, {input: train_input})
+
+        # parameters of the model
+        self.params = []
+
+        assert reduce(mul, output_shape[1:]) == input_shape[-1]
+        self.input_shape = input_shape
+        self.output_shape = tuple(output_shape)
+
+        print
+        print "adding unflatten layer"
+        print "input shape: " + str(self.input_shape)
+        print "output shape: " + str(self.output_shape)
@@ -9,13 +9,14 @@ class HiddenLayer(object):
                  rng,
                  input,
                  n_out,
-                 drop,
+                 drop=None,
                  input_shape=None,
                  n_in=None,
                  W=None,
                  b=None,
                  activation=T.tanh,
-                 p=0.5):
+                 p=0.5,
+                 train_input=None):
         """
         Typical hidden layer of a MLP: units are fully-connected and have
         sigmoidal activation function. Weight matrix W is of shape (n_in,n_out)
@@ -40,6 +41,14 @@ class HiddenLayer(object):
         :type activation: theano.Op or function
         :param activation: Non linearity to be applied in the hidden
                            layer
+
+        :type drop: theano.tensor.iscalar or None
+        :param drop: when given, output switches between the training (non zero)
+                     and inference (zero) expressions, as the standalone scripts
+                     expect; otherwise output is the inference expression only
+
+        :type train_input: theano.tensor.dmatrix
+        :param train_input: input of the training graph, if it differs from input
         """
         self.input = input
 
@@ -81,12 +90,17 @@ class HiddenLayer(object):
 
         self.W = W
         self.b = b
+        self.activation = activation
 
         self.lin_output = T.dot(input, self.W) + self.b
         output = activation(self.lin_output)
-        droppedOutput = dropout(rng, output, p)
 
-        self.output = T.switch(T.neq(drop, 0), droppedOutput, output)
+        # dropout only in the training graph
+        self.train_output = dropout(rng, training_expression(output, {input: train_input}), p)
+        if drop is None:
+            self.output = output
+        else:
+            self.output = T.switch(T.neq(drop, 0), self.train_output, output)
 
         # parameters of the model
         self.params = [self.W, self.b]
@@ -19,9 +19,9 @@ class Layer():
         return self.params
 
     def get_output_shape(self):
-        self.output_shape
+        return self.output_shape
 
     def get_input_shape(self):
-        self.input_shape
+        return self.input_shape
 
 
@@ -38,10 +38,44 @@ def prelu(x):
 def dropout(rng, values, p):
     srng = theano.tensor.shared_randomstreams.RandomStreams(rng.randint(999999))
     mask = srng.binomial(n=1, p=p, size=values.shape, dtype=theano.config.floatX)
-    output = values * mask
+    # the mask of a 1^3 feature map is as broadcastable as the map itself
+    output = values * T.patternbroadcast(mask, values.broadcastable)
     return numpy.cast[theano.config.floatX](1.0/p) * output
 
 
+def training_expression(expression, replace):
+    """
+    Rebuilds a layer's inference expression on its training inputs. Layers
+    keep a dropout free inference graph (output) and a training graph
+    (train_output); replace maps the inference inputs to the training ones
+    (pairs with a None or unchanged training input are skipped). The
+    training inputs take the broadcastable pattern of the inference ones,
+    which clone requires.
+    """
+    replace = dict((k, T.patternbroadcast(v, k.broadcastable)) for k, v in replace.items()
+                   if v is not None and v is not k)
+    if len(replace) == 0:
+        return expression
+    return theano.clone(expression, replace=replace)
+
+
+def symbolic_shape(input, shape):
+    """
+    shape with a batch size of None (any batch size) replaced by the symbolic
+    batch size of input, for reshapes and allocations.
+    """
+    if shape[0] is not None:
+        return tuple(shape)
+    return (input.shape[0],) + tuple(shape[1:])
+
+
+def static_shape(shape):
+    """shape for the shape arguments of the convolutions, None when the batch size is symbolic."""
+    if shape[0] is None:
+        return None
+    return tuple(shape)
+
+
 def downscale_3d(the_5d_input, downscale_factor):
     """
     Downscales a 3d layer (represented as a 5d BZCXY array) by the same downscale_factor in each dimension. Assumes that each of
@@ -154,16 +188,12 @@ def max_pool_3d_numpy(the_5d_input, downscale_factor):
                       axis=(2, 5, 7))
 
 
-def max_pool_3d(input, ds, ignore_border=False, st=None, padding=0):
+def max_pool_3d(input, input_shape, ds, ignore_border=False, st=None, padding=0):
     """
-    Note: This function will be replaced by "MaxPoolLayer3D" layer when we are comfortable with using our new layer system
+    Max-pools a 5d BZCXY tensor over Z, X and Y, by pool_3d in a single pass.
 
-    Takes as input a 5-D tensor. It downscales the input image by
-    the specified factor, by keeping only the maximum value of non-overlapping
-    patches of size (ds[0],ds[1])
-    :type input: 5-D theano tensor of input 3D images.
-    :param input: input images. Max pooling will be done over the 2 last
-        dimensions (x, y), and the second dimension (z).
+    :type input_shape: tuple of length 5
+    :param input_shape: shape of input, only the spatial sizes need to be known
     :type ds: int
     :param ds: factor by which to downscale (same on all 3 dimensions).
         2 will halve the image in each dimension.
@@ -179,18 +209,137 @@ def max_pool_3d(input, ds, ignore_border=False, st=None, padding=0):
     :param padding: pad zeros to extend beyond eight borders
             of the 3d images
     """
-    # max_pool_2d X and Z
-    temp_output = theano.tensor.signal.downsample.max_pool_2d(input=input.dimshuffle(0, 4, 2, 3, 1),
-                                                              ds=(ds, ds),
-                                                              ignore_border=ignore_border,
-                                                              st=(st, st),
-                                                              padding=(padding, padding))
-    # max_pool_2d X and Y (with X constant)
-    return theano.tensor.signal.downsample.max_pool_2d(input=temp_output.dimshuffle(0, 4, 2, 3, 1),
-                                                       ds=(1, ds),
-                                                       ignore_border=ignore_border,
-                                                       st=(1, st),
-                                                       padding=(0, padding))
+    return pool_3d(input, input_shape, ds, st=st, padding=padding, ignore_border=ignore_border, mode='max')
+
+
+def pool_3d_output_shape(input_shape, ds, st=None, padding=0, ignore_border=False):
+    """
+    Shape of the output of pool_3d for a 5d BZCXY input_shape. Follows the border
+    rules of theano's DownsampleFactorMax.out_shape: with ignore_border=False the
+    partial windows at the end of each axis are kept.
+    """
+    if st is None:
+        st = ds
+    if padding and not ignore_border:
+        raise ValueError("padding requires ignore_border=True")
+    if padding >= ds:
+        raise ValueError("padding must be smaller than ds")
+
+    def out_length(n):
+        n += 2 * padding
+        if ignore_border:
+            return (n - ds) // st + 1
+        if st >= ds:
+            return (n - 1) // st + 1
+        return max(0, (n - 1 - ds + st) // st) + 1
+
+    batch_size, zdim, nchannels, xdim, ydim = input_shape
+    return (batch_size, out_length(zdim), nchannels, out_length(xdim), out_length(ydim))
+
+
+def _pool_3d_frame(n, out_length, ds, st, padding):
+    """
+    Along one axis, returns the length of the padded/cropped frame that holds
+    every pooling window exactly, and how many input elements are copied into it.
+    """
+    frame_length = (out_length - 1) * st + ds
+    return frame_length, min(n, frame_length - padding)
+
+
+def pool_3d(input, input_shape, ds, st=None, padding=0, ignore_border=False, mode='max'):
+    """
+    Pools a 5d BZCXY tensor over Z, X and Y in a single pass.
+
+    The input is first placed in a frame holding every window exactly (padded
+    with -inf for max and 0 for average, or cropped), then the ds**3 strided
+    views of the frame, one per offset inside the window, are reduced
+    elementwise. Theano fuses that reduction into one loop, and there is no
+    intermediate 2d-pooled tensor to keep around for the gradient.
+
+    :type input_shape: tuple of length 5
+    :param input_shape: shape of input, only the spatial sizes need to be known
+    :type ds: int
+    :param ds: window size, same on all 3 dimensions
+    :type st: int
+    :param st: stride, equal to ds (non overlapping windows) if None
+    :type padding: int
+    :param padding: padding added before and after each spatial dimension,
+        padded voxels never win a max and are not counted in an average
+    :type mode: str
+    :param mode: 'max' or 'average'
+    """
+    if st is None:
+        st = ds
+    if mode not in ('max', 'average'):
+        raise ValueError("unknown pooling mode: " + str(mode))
+
+    output_shape = pool_3d_output_shape(input_shape, ds, st, padding, ignore_border)
+
+    frames = {}
+    for axis in (1, 3, 4):
+        frames[axis] = _pool_3d_frame(input_shape[axis], output_shape[axis], ds, st, padding)
+
+    framed = input
+    if padding or any(frames[axis] != (input_shape[axis], input_shape[axis]) for axis in frames):
+        fill = numpy.asarray(-numpy.inf if mode == 'max' else 0, dtype=input.dtype)
+        framed = T.alloc(fill, input.shape[0], frames[1][0], input.shape[2], frames[3][0], frames[4][0])
+
+        dst = [slice(None)] * 5
+        src = [slice(None)] * 5
+        for axis, (frame_length, num_copied) in frames.items():
+            dst[axis] = slice(padding, padding + num_copied)
+            src[axis] = slice(0, num_copied)
+        framed = T.set_subtensor(framed[tuple(dst)], input[tuple(src)])
+
+    windows = []
+    for dz in xrange(ds):
+        for dx in xrange(ds):
+            for dy in xrange(ds):
+                window = [slice(None)] * 5
+                for axis, offset in ((1, dz), (3, dx), (4, dy)):
+                    window[axis] = slice(offset, offset + (output_shape[axis] - 1) * st + 1, st)
+                windows.append(framed[tuple(window)])
+
+    if mode == 'max':
+        return reduce(T.maximum, windows)
+
+    #average over the voxels of each window that are not padding
+    counts = numpy.ones((1,), dtype=theano.config.floatX)
+    for axis in (1, 3, 4):
+        frame_length, num_copied = frames[axis]
+        valid = numpy.zeros(frame_length)
+        valid[padding:padding + num_copied] = 1
+        axis_counts = [valid[o * st:o * st + ds].sum() for o in xrange(output_shape[axis])]
+        counts = numpy.multiply.outer(counts, axis_counts)
+    counts = counts.reshape(1, output_shape[1], 1, output_shape[3], output_shape[4])
+
+    return reduce(lambda a, b: a + b, windows) / counts.astype(input.dtype)
+
+
+def pool_3d_numpy(the_5d_input, ds, st=None, padding=0, ignore_border=False, mode='max'):
+    """
+    Reference implementation of pool_3d, one window at a time.
+    """
+    if st is None:
+        st = ds
+    output_shape = pool_3d_output_shape(the_5d_input.shape, ds, st, padding, ignore_border)
+    output = numpy.zeros(output_shape, dtype=the_5d_input.dtype)
+
+    def window(o, n):
+        start = o * st - padding
+        return slice(max(start, 0), min(start + ds, n))
+
+    _, zdim, _, xdim, ydim = the_5d_input.shape
+    for oz in xrange(output_shape[1]):
+        for ox in xrange(output_shape[3]):
+            for oy in xrange(output_shape[4]):
+                values = the_5d_input[:, window(oz, zdim), :, window(ox, xdim), window(oy, ydim)]
+                if mode == 'max':
+                    output[:, oz, :, ox, oy] = values.max(axis=(1, 3, 4))
+                else:
+                    output[:, oz, :, ox, oy] = values.mean(axis=(1, 3, 4))
+
+    return output
 
 
 def regularized_loss(predicted, ground_truth, lambda_constant=10):
@@ -4,6 +4,7 @@ import numpy
 import theano
 import theano.tensor as T
 from layers.layer import Layer
+from layers.layer_utils import training_expression
 
 
 class LogisticRegression(Layer):
@@ -15,7 +16,7 @@ class LogisticRegression(Layer):
     determine a class membership probability.
     """
 
-    def __init__(self, input, n_in, n_out, rng=None):
+    def __init__(self, input, n_in, n_out, rng=None, train_input=None):
         """ Initialize the parameters of the logistic regression
 
         :type input: theano.tensor.TensorType
@@ -30,7 +31,12 @@ class LogisticRegression(Layer):
         :param n_out: number of output units, the dimension of the space in
                       which the labels lie
 
+        :type train_input: theano.tensor.TensorType
+        :param train_input: input of the training graph, if it differs from input
+
         """
+        self.input = input
+
         # start-snippet-1
         # initialize with 0 the weights W as a matrix of shape (n_in, n_out)
         self.W = theano.shared(
@@ -61,6 +67,7 @@ class LogisticRegression(Layer):
         # plain-k
         self.p_y_given_x = T.nnet.softmax(T.dot(input, self.W) + self.b)
         self.output = self.p_y_given_x
+        self.train_output = training_expression(self.output, {input: train_input})
 
         # symbolic description of how to compute prediction as class whose
         # probability is maximal
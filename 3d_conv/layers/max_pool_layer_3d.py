@@ -1,6 +1,5 @@
 import numpy
 import theano
-from theano.tensor.signal.downsample import *
 from layers.layer_utils import *
 from layers.layer import Layer
 
@@ -8,15 +7,16 @@ from layers.layer import Layer
 class MaxPoolLayer3D(Layer):
     """3D Layer of a convolutional network """
 
-    def __init__(self, input, input_shape, ds=2, ignore_border=False):
+    def __init__(self, input, input_shape, ds=2, ignore_border=False, st=None, padding=0, mode='max',
+                 train_input=None):
         """
-        Allocate a layer for 3d max-pooling.
+        Allocate a layer for 3d pooling.
 
         The layer takes as input a 5-D tensor. It downscales the input image by
-        the specified factor, by keeping only the maximum value of non-overlapping
-        patches of size (ds[0],ds[1])
+        the specified factor, by keeping only the maximum (or the average) value
+        of patches of size (ds, ds, ds). Pooling is done in a single pass by pool_3d.
         :type input: 5-D Theano tensor of input 3D images.
-        :param input: input images. Max pooling will be done over the 2 last
+        :param input: input images. Pooling will be done over the 2 last
             dimensions (x, y), and the second dimension (z).
         :type ds: int
         :param ds: factor by which to downscale (same on all 3 dimensions).
@@ -24,34 +24,38 @@ class MaxPoolLayer3D(Layer):
         :type ignore_border: bool
         :param ignore_border: When True, (5,5,5) input with ds=2
             will generate a (2,2,2) output. (3,3,3) otherwise.
+        :type st: int
+        :param st: stride, equal to ds if None
+        :type padding: int
+        :param padding: padding on each side of each spatial dimension,
+            requires ignore_border=True
+        :type mode: str
+        :param mode: 'max' or 'average'
+        :type train_input: 5-D Theano tensor
+        :param train_input: input of the training graph, if it differs from input
         """
 
-        # max_pool_2d X and Z
-        temp_output = max_pool_2d(input=input.dimshuffle(0, 4, 2, 3, 1),
-                                  ds=(ds, ds),
-                                  ignore_border=ignore_border,)
-        temp_output_shape = DownsampleFactorMax.out_shape(imgshape=(input_shape[0], input_shape[4], input_shape[2], input_shape[3], input_shape[1]),
-                                                          ds=(ds, ds),
-                                                          ignore_border=ignore_border)
-
-        # max_pool_2d X and Y (with X constant)
-        output = max_pool_2d(input=temp_output.dimshuffle(0, 4, 2, 3, 1),
-                             ds=(1, ds),
-                             ignore_border=ignore_border)
-        output_shape = DownsampleFactorMax.out_shape(imgshape=(temp_output_shape[0], temp_output_shape[4], temp_output_shape[2], temp_output_shape[3], temp_output_shape[1]),
-                                                     ds=(1, ds),
-                                                     ignore_border=ignore_border)
-
         self.input = input
-        self.output = output
+        self.ds = ds
+        self.st = st if st is not None else ds
+        self.padding = padding
+        self.ignore_border = ignore_border
+        self.mode = mode
+        self.output = pool_3d(input, input_shape, ds, st=st, padding=padding,
+                              ignore_border=ignore_border, mode=mode)
+        self.train_output = training_expression(self.output, {input: train_input})
         self.params = []
 
         self.input_shape = input_shape
-        self.output_shape = output_shape
+        self.output_shape = pool_3d_output_shape(input_shape, ds, st=st, padding=padding,
+                                                 ignore_border=ignore_border)
 
         print
         print "adding max-pool-3d layer"
         print "input shape: " + str(self.input_shape)
+        print "pooling mode: " + mode
         print "max-pool downscale factor: " + str(ds)
+        print "stride: " + str(st if st is not None else ds)
+        print "padding: " + str(padding)
         print "ignoring borders? (default False): " + str(ignore_border)
         print "output shape: " + str(self.output_shape)
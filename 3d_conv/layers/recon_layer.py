@@ -1,12 +1,13 @@
 import theano
 import theano.tensor as T
 import numpy
+from layers.layer_utils import training_expression
 
 
 class ReconLayer(object):
 
     def __init__(self, rng, input, n_in, n_out, W=None, b=None,
-                 activation=T.nnet.sigmoid):
+                 activation=T.nnet.sigmoid, train_input=None):
 
         self.input = input
 
@@ -24,6 +25,7 @@ class ReconLayer(object):
 
         self.W = W
         self.b = b
+        self.activation = activation
 
         lin_output = T.dot(input, self.W) + self.b
 
@@ -31,6 +33,7 @@ class ReconLayer(object):
             lin_output if activation is None
             else activation(lin_output)
         )
+        self.train_output = training_expression(self.output, {input: train_input})
 
         self.params = [self.W, self.b]
 
@@ -40,6 +43,10 @@ class ReconLayer(object):
         cost = T.mean(L)
         return cost
 
+    def negative_log_likelihood(self, y):
+        # the cost ModelBuilder.build_model minimizes
+        return self.cross_entropy_error(y)
+
     def single_pixel_cost(self, y):
         #output shape: (10, 28, 32, 28, 28)
         # return T.mean(T.nnet.categorical_crossentropy(self.output, y))
@@ -0,0 +1,200 @@
+import itertools
+import numpy
+import theano
+import theano.tensor as T
+
+#Submanifold sparse 3d convolution on the CPU. Only the active sites of a grid
+#(voxels where any input channel is non zero) are stored, as a (num sites,
+#channels) feature matrix plus the sorted linear indices of the sites in the
+#(batch size, z, x, y) grid. A convolution only computes outputs at the active
+#sites, so the active set never grows from layer to layer.
+#
+#The work is driven by a rulebook: for every filter offset, the pairs of
+#(input row, output row) such that output site + offset is active. Each
+#offset is then a gather of the input rows, one GEMM with that offset's
+#(channels in, channels out) weight matrix and a scatter into the output rows.
+#
+#Filters are stored as (filter_size^3, channels in, channels out), offsets in
+#itertools.product order over (z, x, y), and are applied as a correlation.
+
+
+class ActiveSiteHash(object):
+    """
+    Lookup from grid coordinates to feature matrix rows. The keys are the sorted
+    linear site indices, so memory is proportional to the number of active
+    sites and a lookup is a vectorised binary search.
+    """
+
+    def __init__(self, sites, spatial_shape):
+        self.keys = numpy.asarray(sites, dtype=numpy.int64)
+        self.spatial_shape = numpy.asarray(spatial_shape, dtype=numpy.int64)
+        self.coords = numpy.column_stack(numpy.unravel_index(self.keys, spatial_shape))
+
+    def lookup(self, coords):
+        """Rows of the (n, 4) (batch, z, x, y) coords, -1 where the site is inactive or off the grid."""
+        rows = numpy.empty((coords.shape[0],), dtype=numpy.int64)
+        rows.fill(-1)
+
+        inside = numpy.all((coords >= 0) & (coords < self.spatial_shape), axis=1)
+        if len(self.keys) == 0 or not inside.any():
+            return rows
+
+        keys = numpy.ravel_multi_index(coords[inside].T, self.spatial_shape)
+        found = numpy.minimum(numpy.searchsorted(self.keys, keys), len(self.keys) - 1)
+        rows[inside] = numpy.where(self.keys[found] == keys, found, -1)
+        return rows
+
+
+def filter_offsets(filter_size):
+    low = -(filter_size // 2)
+    return list(itertools.product(range(low, low + filter_size), repeat=3))
+
+
+def build_rulebook(sites, spatial_shape, filter_size):
+    """
+    (in_rows, out_rows, starts): the pairs for offset k are
+    in_rows[starts[k]:starts[k+1]] and out_rows[starts[k]:starts[k+1]].
+    Within an offset every row appears at most once.
+    """
+    table = ActiveSiteHash(sites, spatial_shape)
+    out_index = numpy.arange(len(table.keys), dtype=numpy.int64)
+
+    in_rows = []
+    out_rows = []
+    starts = [0]
+    for dz, dx, dy in filter_offsets(filter_size):
+        rows = table.lookup(table.coords + numpy.array([0, dz, dx, dy]))
+        found = rows >= 0
+        in_rows.append(rows[found])
+        out_rows.append(out_index[found])
+        starts.append(starts[-1] + len(in_rows[-1]))
+
+    return (numpy.concatenate(in_rows),
+            numpy.concatenate(out_rows),
+            numpy.asarray(starts, dtype=numpy.int64))
+
+
+def sparse_conv3d_numpy(features, filters, in_rows, out_rows, starts):
+    out = numpy.zeros((features.shape[0], filters.shape[2]), dtype=numpy.result_type(features, filters))
+    for k in xrange(filters.shape[0]):
+        pairs = slice(starts[k], starts[k + 1])
+        out[out_rows[pairs]] += features[in_rows[pairs]].dot(filters[k])
+    return out
+
+
+def sparse_conv3d_grad_features_numpy(output_grad, filters, in_rows, out_rows, starts):
+    grad = numpy.zeros((output_grad.shape[0], filters.shape[1]), dtype=numpy.result_type(output_grad, filters))
+    for k in xrange(filters.shape[0]):
+        pairs = slice(starts[k], starts[k + 1])
+        grad[in_rows[pairs]] += output_grad[out_rows[pairs]].dot(filters[k].T)
+    return grad
+
+
+def sparse_conv3d_grad_filters_numpy(features, output_grad, in_rows, out_rows, starts, filters_shape):
+    grad = numpy.zeros(filters_shape, dtype=numpy.result_type(features, output_grad))
+    for k in xrange(filters_shape[0]):
+        pairs = slice(starts[k], starts[k + 1])
+        grad[k] = features[in_rows[pairs]].T.dot(output_grad[out_rows[pairs]])
+    return grad
+
+
+class Rulebook(theano.Op):
+
+    __props__ = ('spatial_shape', 'filter_size')
+
+    def __init__(self, spatial_shape, filter_size):
+        self.spatial_shape = tuple(int(dim) for dim in spatial_shape)
+        self.filter_size = int(filter_size)
+        super(Rulebook, self).__init__()
+
+    def make_node(self, sites):
+        sites = T.as_tensor_variable(sites)
+        return theano.Apply(self, [sites], [T.lvector(), T.lvector(), T.lvector()])
+
+    def perform(self, node, inputs, output_storage):
+        rulebook = build_rulebook(inputs[0], self.spatial_shape, self.filter_size)
+        for storage, value in zip(output_storage, rulebook):
+            storage[0] = value
+
+    def grad(self, inputs, output_grads):
+        return [theano.gradient.grad_undefined(self, 0, inputs[0])]
+
+
+def rulebook(sites, spatial_shape, filter_size):
+    """Symbolic rulebook, layers sharing sites and filter_size share one after graph merging."""
+    return Rulebook(spatial_shape, filter_size)(sites)
+
+
+class _SparseConvOp(theano.Op):
+
+    __props__ = ()
+
+    def connection_pattern(self, node):
+        return [[True], [True], [False], [False], [False]]
+
+    def _node(self, a, b, rulebook, dtype):
+        a = T.as_tensor_variable(a)
+        b = T.as_tensor_variable(b)
+        rulebook = [T.as_tensor_variable(r) for r in rulebook]
+        return theano.Apply(self, [a, b] + rulebook, [T.matrix(dtype=dtype)])
+
+    def _disconnected(self):
+        return [theano.gradient.DisconnectedType()() for i in xrange(3)]
+
+
+class SparseConv3D(_SparseConvOp):
+
+    def make_node(self, features, filters, in_rows, out_rows, starts):
+        dtype = theano.scalar.upcast(features.dtype, filters.dtype)
+        return self._node(features, filters, [in_rows, out_rows, starts], dtype)
+
+    def perform(self, node, inputs, output_storage):
+        out = sparse_conv3d_numpy(*inputs)
+        output_storage[0][0] = out.astype(node.outputs[0].dtype, copy=False)
+
+    def infer_shape(self, node, input_shapes):
+        return [(input_shapes[0][0], input_shapes[1][2])]
+
+    def grad(self, inputs, output_grads):
+        features, filters, in_rows, out_rows, starts = inputs
+        output_grad, = output_grads
+        grad_features = SparseConv3DGradFeatures()(output_grad, filters, in_rows, out_rows, starts)
+        grad_filters = SparseConv3DGradFilters()(features, output_grad, in_rows, out_rows, starts, filters.shape)
+        return [T.cast(grad_features, features.dtype),
+                T.cast(grad_filters, filters.dtype)] + self._disconnected()
+
+
+class SparseConv3DGradFeatures(_SparseConvOp):
+
+    def make_node(self, output_grad, filters, in_rows, out_rows, starts):
+        dtype = theano.scalar.upcast(output_grad.dtype, filters.dtype)
+        return self._node(output_grad, filters, [in_rows, out_rows, starts], dtype)
+
+    def perform(self, node, inputs, output_storage):
+        grad = sparse_conv3d_grad_features_numpy(*inputs)
+        output_storage[0][0] = grad.astype(node.outputs[0].dtype, copy=False)
+
+    def infer_shape(self, node, input_shapes):
+        return [(input_shapes[0][0], input_shapes[1][1])]
+
+
+class SparseConv3DGradFilters(theano.Op):
+
+    __props__ = ()
+
+    def make_node(self, features, output_grad, in_rows, out_rows, starts, filters_shape):
+        inputs = [T.as_tensor_variable(v) for v in (features, output_grad, in_rows, out_rows, starts, filters_shape)]
+        dtype = theano.scalar.upcast(features.dtype, output_grad.dtype)
+        return theano.Apply(self, inputs, [T.tensor3(dtype=dtype)])
+
+    def perform(self, node, inputs, output_storage):
+        grad = sparse_conv3d_grad_filters_numpy(*inputs)
+        output_storage[0][0] = grad.astype(node.outputs[0].dtype, copy=False)
+
+    def infer_shape(self, node, input_shapes):
+        filters_shape = node.inputs[5]
+        return [(filters_shape[0], filters_shape[1], filters_shape[2])]
+
+
+def sparse_conv3d(features, filters, rulebook):
+    return SparseConv3D()(features, filters, *rulebook)
@@ -0,0 +1,130 @@
+import numpy
+import theano
+import theano.tensor as T
+from layers.layer_utils import *
+from layers.layer import Layer
+from layers.sparse_conv_3d import rulebook, sparse_conv3d
+
+#Layers working on the sparse representation of sparse_conv_3d: output is a
+#(num active sites, channels) feature matrix and sites holds the linear indices
+#of the active sites in the (batch size, z, x, y) grid. input_shape and
+#output_shape are the BZCXY shapes of the equivalent dense tensors, so these
+#layers chain with the dense ones through SparseInputLayer and SparseToDenseLayer.
+#train_sites are the active sites of the training graph, where dropout in
+#earlier dense layers can switch off voxels.
+
+
+class SparseInputLayer(Layer):
+    """Dense BZCXY tensor to the features of its active sites (voxels with any non zero channel)."""
+
+    def __init__(self, input, input_shape, train_input=None):
+
+        batch_size, zdim, nchannels, xdim, ydim = input_shape
+
+        self.input = input
+        self.spatial_shape = (batch_size, zdim, xdim, ydim)
+        self.sites = T.flatnonzero(T.any(T.neq(input, 0), axis=2))
+        self.output = input.dimshuffle(0, 1, 3, 4, 2).reshape((-1, nchannels))[self.sites]
+        self.params = []
+
+        self.train_sites = training_expression(self.sites, {input: train_input})
+        self.train_output = training_expression(self.output, {input: train_input})
+
+        self.input_shape = input_shape
+        self.output_shape = input_shape
+
+        print
+        print "adding sparse input layer"
+        print "input shape: " + str(self.input_shape)
+
+
+class SparseConvLayer3D(Layer):
+    """Submanifold sparse 3D convolution: outputs only at the active sites of its input."""
+
+    def __init__(self, rng, input, sites, input_shape, n_out, drop=None, filter_size=3, p=0.5, W=None, b=None,
+                 train_input=None, train_sites=None):
+        """
+        :type input: theano.tensor.matrix
+        :param input: (num active sites, channels in) features
+
+        :type sites: theano.tensor.lvector
+        :param sites: linear indices of the active sites
+
+        :type input_shape: tuple or list of length 5
+        :param input_shape: BZCXY shape of the equivalent dense input
+
+        :type n_out: int
+        :param n_out: number of filters
+
+        :type filter_size: int
+        :param filter_size: filters are filter_size^3, centered on each site
+
+        :param train_input, train_sites: features and sites of the training
+                                         graph, if they differ from input and sites
+        """
+
+        batch_size, zdim, nchannels_in, xdim, ydim = input_shape
+        filter_shape = (filter_size ** 3, nchannels_in, n_out)
+        if batch_size is None:
+            raise ValueError("the rulebook of a sparse conv layer needs a fixed batch size")
+
+        self.input = input
+        self.sites = sites
+        self.spatial_shape = (batch_size, zdim, xdim, ydim)
+
+        if W is None:
+            W = theano.shared(numpy.asarray(numpy.random.normal(loc=0., scale=.01, size=filter_shape), dtype=theano.config.floatX),
+                borrow=True)
+
+        if b is None:
+            b_values = numpy.ones((n_out,), dtype=theano.config.floatX)
+            b = theano.shared(value=b_values, borrow=True)
+
+        self.W = W
+        self.b = b
+
+        conv_out = sparse_conv3d(input, self.W, rulebook(sites, self.spatial_shape, filter_size))
+        out = relu(conv_out + self.b.dimshuffle('x', 0))
+
+        # dropout only in the training graph
+        self.train_sites = train_sites if train_sites is not None else sites
+        self.train_output = dropout(rng, training_expression(out, {input: train_input, sites: train_sites}), p)
+        if drop is None:
+            self.output = out
+        else:
+            self.output = T.switch(T.neq(drop, 0), self.train_output, out)
+        self.params = [self.W, self.b]
+
+        self.input_shape = input_shape
+        self.output_shape = (batch_size, zdim, n_out, xdim, ydim)
+
+        print
+        print "added sparse conv layer"
+        print "input shape: " + str(self.input_shape)
+        print "filter shape: " + str(filter_shape)
+        print "output shape: " + str(self.output_shape)
+
+
+class SparseToDenseLayer(Layer):
+    """Scatters active site features back into a dense BZCXY tensor, zeros elsewhere."""
+
+    def __init__(self, input, sites, input_shape, train_input=None, train_sites=None):
+
+        batch_size, zdim, nchannels, xdim, ydim = input_shape
+        if batch_size is None:
+            raise ValueError("a sparse to dense layer needs a fixed batch size")
+
+        dense = T.zeros((batch_size * zdim * xdim * ydim, nchannels), dtype=input.dtype)
+        dense = T.set_subtensor(dense[sites], input)
+
+        self.input = input
+        self.output = dense.reshape((batch_size, zdim, xdim, ydim, nchannels)).dimshuffle(0, 1, 4, 2, 3)
+        self.train_output = training_expression(self.output, {input: train_input, sites: train_sites})
+        self.params = []
+
+        self.input_shape = input_shape
+        self.output_shape = input_shape
+
+        print
+        print "adding sparse to dense layer"
+        print "output shape: " + str(self.output_shape)
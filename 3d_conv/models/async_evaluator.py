@@ -0,0 +1,149 @@
+import multiprocessing
+import traceback
+import numpy
+
+from collections import namedtuple
+
+from utils import tracing
+
+#Validation and test evaluation off the training loop. AsyncEvaluator forks a
+#process that inherits the compiled validate and test functions. At every
+#validation point the training loop submits a snapshot of the parameters and
+#goes on training; the evaluator loads the snapshot, runs the validation
+#batches of its own data stream, runs the test batches when the validation
+#loss is the best so far, and sends the result back. The training loop applies
+#the results to its patience when they arrive (poll).
+#
+#At most one snapshot is evaluated at a time. A snapshot submitted while the
+#evaluator is busy waits, and is replaced by a newer one, so slow evaluation
+#skips validation points instead of holding up training.
+#
+#usage:
+#   evaluator = AsyncEvaluator(params, model.validate, model.test, validation_batches, test_batches)
+#   for iteration in ...:
+#       model.train(x, y)
+#       if (iteration + 1) % validation_frequency == 0:
+#           evaluator.submit(iteration)
+#       for result in evaluator.poll():
+#           ... result.iteration, result.validation_loss, result.test_score
+#   results = evaluator.close()
+#
+#update_early_stopping applies a result to the patience as the training
+#scripts did after their synchronous validation.
+
+EvaluationResult = namedtuple('EvaluationResult', ['iteration', 'validation_loss', 'test_score'])
+
+
+def mean_loss(function, batches):
+    """Mean over the examples of the per batch mean losses, a last partial batch weighing less."""
+    losses, sizes = [], []
+    for batch_x, batch_y in batches:
+        losses.append(function(batch_x, batch_y))
+        sizes.append(len(batch_x))
+    return numpy.average(losses, weights=sizes)
+
+
+def update_early_stopping(result, best, patience, patience_increase=2, improvement_threshold=0.995):
+    """
+    (best, patience) after an evaluation result, where best is the
+    (validation loss, iteration, test score) of the best result so far.
+    """
+    best_validation_loss = best[0]
+    print('minibatch %i, validation error %f %%' % (result.iteration + 1, result.validation_loss * 100.))
+
+    # if we got the best validation score until now
+    if result.validation_loss < best_validation_loss:
+
+        #improve patience if loss improvement is good enough
+        if result.validation_loss < best_validation_loss * improvement_threshold:
+            patience = max(patience, result.iteration * patience_increase)
+
+        best = (result.validation_loss, result.iteration, result.test_score)
+        print(('     minibatch %i, test error of best model %f %%') % (result.iteration + 1, result.test_score * 100.))
+
+    return best, patience
+
+
+class AsyncEvaluator(object):
+
+    def __init__(self, params, validate, test, validation_batches, test_batches):
+        """
+        validation_batches and test_batches are called in the evaluator process
+        and return an iterable of (x, y) batches for one evaluation. The test
+        score of a result is None when validation did not improve.
+        """
+        self.params = params
+        self.validate = validate
+        self.test = test
+        self.validation_batches = validation_batches
+        self.test_batches = test_batches
+
+        self.connection, child_connection = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=self._run, args=(child_connection,))
+        self.process.daemon = True
+        self.process.start()
+
+        self.busy = False
+        self.waiting = None
+
+    def _run(self, connection):
+        best_validation_loss = numpy.inf
+        try:
+            while True:
+                snapshot = connection.recv()
+                if snapshot is None:
+                    return
+                iteration, values = snapshot
+                for p, value in zip(self.params, values):
+                    p.set_value(value, borrow=True)
+
+                validation_loss = mean_loss(self.validate, self.validation_batches())
+                test_score = None
+                if validation_loss < best_validation_loss:
+                    best_validation_loss = validation_loss
+                    test_score = mean_loss(self.test, self.test_batches())
+                connection.send(EvaluationResult(iteration, validation_loss, test_score))
+        except:
+            traceback.print_exc()
+            connection.send(None)
+        finally:
+            # the process leaves with os._exit, without the atexit handlers
+            tracing.flush()
+
+    def _send(self, snapshot):
+        self.connection.send(snapshot)
+        self.busy = True
+
+    def submit(self, iteration):
+        """Evaluates the current parameters in the background."""
+        snapshot = (iteration, [p.get_value() for p in self.params])
+        if self.busy:
+            self.waiting = snapshot
+        else:
+            self._send(snapshot)
+
+    def _receive(self):
+        result = self.connection.recv()
+        if result is None:
+            raise RuntimeError("the evaluator process failed")
+        self.busy = False
+        if self.waiting is not None:
+            self._send(self.waiting)
+            self.waiting = None
+        return result
+
+    def poll(self):
+        """The results that arrived since the last call, without waiting."""
+        results = []
+        while self.busy and self.connection.poll():
+            results.append(self._receive())
+        return results
+
+    def close(self):
+        """Waits for the submitted snapshots, stops the evaluator and returns the remaining results."""
+        results = []
+        while self.busy:
+            results.append(self._receive())
+        self.connection.send(None)
+        self.process.join()
+        return results
@@ -0,0 +1,228 @@
+import cPickle
+import json
+import os
+import Queue
+import tempfile
+import threading
+import numpy
+from theano.tensor.raw_random import RandomStateType
+
+#Checkpoints of a training run, to resume after a preemption: the parameters,
+#the RMSprop accumulators, the random streams of the dropout masks, the numpy
+#random state (the dataset iterators draw from it) and the state of the
+#training loop (iteration, patience, sampler position, ...).
+#
+#save() copies everything at once, between two training steps, and a
+#background thread writes the copy to an uncompressed .npz through a temporary
+#file and a rename, so a checkpoint file is always complete. The last keep_last
+#checkpoints are kept, and the keep_best with the lowest score (set_score, e.g.
+#the validation loss once it is known). A score goes to the checkpoint of its
+#iteration, so save a checkpoint of the parameters that are scored.
+#
+#usage:
+#   checkpointer = Checkpointer("checkpoints", params, model.accumulators, random_streams(model.train))
+#   state = checkpointer.restore()     # None on a fresh start
+#   ...
+#   checkpointer.save(iteration, epoch=epoch_count, patience=patience)
+#   checkpointer.set_score(iteration, validation_loss)
+#   ...
+#   checkpointer.close()
+
+CHECKPOINT_PATTERN = "checkpoint_%09d.npz"
+INDEX_FILENAME = "checkpoints.json"
+
+
+def random_streams(function):
+    """
+    The shared random states of a compiled function (its dropout masks), or of
+    the function in the compiled attribute of a python wrapper.
+    """
+    function = getattr(function, 'compiled', function)
+    return [function_input.variable for function_input in function.maker.inputs
+            if isinstance(function_input.variable.type, RandomStateType) and
+            hasattr(function_input.variable, 'get_value')]
+
+
+def _write_atomic(filepath, write):
+    fd, tmp_filepath = tempfile.mkstemp(dir=os.path.dirname(filepath), suffix=".tmp")
+    with os.fdopen(fd, 'wb') as f:
+        write(f)
+    os.rename(tmp_filepath, filepath)
+
+
+def load_checkpoint(filepath):
+    """(parameter values, accumulator values, state) of a checkpoint file."""
+    with numpy.load(filepath) as npz:
+        state = cPickle.loads(npz['state'].tostring())
+        params = [npz["param_%d" % i] for i in xrange(state['num_params'])]
+        accumulators = [npz["accumulator_%d" % i] for i in xrange(state['num_accumulators'])]
+    return params, accumulators, state
+
+
+class Checkpointer(object):
+
+    def __init__(self, directory, params, accumulators=(), random_streams=(), keep_last=3, keep_best=3):
+        self.directory = directory
+        self.params = list(params)
+        self.accumulators = list(accumulators)
+        self.random_streams = list(random_streams)
+        self.keep_last = keep_last
+        self.keep_best = keep_best
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.index_filepath = os.path.join(directory, INDEX_FILENAME)
+        self.checkpoints = []
+        if os.path.isfile(self.index_filepath):
+            with open(self.index_filepath) as f:
+                self.checkpoints = json.load(f)
+        # number of queued writes of each iteration, and the scores that arrived for them
+        self.pending = {}
+        self.scores = {}
+
+        # one write in progress and one waiting at most
+        self.lock = threading.Lock()
+        self.queue = Queue.Queue(maxsize=1)
+        self.error = None
+        self.thread = threading.Thread(target=self._write_loop)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def save(self, iteration, **state):
+        """Snapshots the training state now and writes it in the background."""
+        self._check_error()
+        arrays = {}
+        for i, p in enumerate(self.params):
+            arrays["param_%d" % i] = p.get_value()
+        for i, accumulator in enumerate(self.accumulators):
+            arrays["accumulator_%d" % i] = accumulator.get_value()
+
+        state = dict(state,
+                     iteration=iteration,
+                     num_params=len(self.params),
+                     num_accumulators=len(self.accumulators),
+                     numpy_random_state=numpy.random.get_state(),
+                     random_streams=[stream.get_value() for stream in self.random_streams])
+        arrays['state'] = numpy.frombuffer(cPickle.dumps(state, cPickle.HIGHEST_PROTOCOL), dtype=numpy.uint8)
+        with self.lock:
+            self.pending[iteration] = self.pending.get(iteration, 0) + 1
+        self.queue.put((iteration, arrays))
+
+    def _write_loop(self):
+        while True:
+            item = self.queue.get()
+            dequeued = item is None
+            try:
+                if item is None:
+                    return
+                iteration, arrays = item
+                filename = CHECKPOINT_PATTERN % iteration
+                _write_atomic(os.path.join(self.directory, filename), lambda f: numpy.savez(f, **arrays))
+                with self.lock:
+                    # a checkpoint written again keeps its score
+                    score = self.scores.pop(iteration, None)
+                    for checkpoint in self.checkpoints:
+                        if checkpoint['iteration'] == iteration and score is None:
+                            score = checkpoint['score']
+                    self.checkpoints = [c for c in self.checkpoints if c['iteration'] != iteration]
+                    self.checkpoints.append({'iteration': iteration, 'filename': filename, 'score': score})
+                    self._dequeued(iteration)
+                    dequeued = True
+                    self._prune()
+            except Exception as e:
+                self.error = e
+                if not dequeued:
+                    with self.lock:
+                        self._dequeued(item[0])
+            finally:
+                self.queue.task_done()
+
+    def _dequeued(self, iteration):
+        # with self.lock held
+        self.pending[iteration] -= 1
+        if self.pending[iteration] == 0:
+            del self.pending[iteration]
+            self.scores.pop(iteration, None)
+
+    def set_score(self, iteration, score):
+        """
+        The score (lower is better) of the checkpoint of an iteration, for
+        keep_best. Raises ValueError if no checkpoint of iteration was saved.
+        """
+        with self.lock:
+            if iteration in self.pending:
+                # its write is still queued
+                self.scores[iteration] = float(score)
+                return
+            for checkpoint in self.checkpoints:
+                if checkpoint['iteration'] == iteration:
+                    checkpoint['score'] = float(score)
+                    self._prune()
+                    return
+        raise ValueError("no checkpoint of iteration %d to score" % iteration)
+
+    def _prune(self):
+        by_iteration = sorted(self.checkpoints, key=lambda c: c['iteration'])
+        scored = sorted([c for c in self.checkpoints if c['score'] is not None], key=lambda c: c['score'])
+        keep = by_iteration[len(by_iteration) - self.keep_last:] + scored[:self.keep_best]
+
+        for checkpoint in self.checkpoints:
+            if checkpoint not in keep:
+                filepath = os.path.join(self.directory, checkpoint['filename'])
+                if os.path.isfile(filepath):
+                    os.remove(filepath)
+        self.checkpoints = [c for c in by_iteration if c in keep]
+        _write_atomic(self.index_filepath, lambda f: json.dump(self.checkpoints, f, indent=1))
+
+    def _check_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def wait(self):
+        """Waits for the checkpoints saved so far to be on disk."""
+        self.queue.join()
+        self._check_error()
+
+    def close(self):
+        self.wait()
+        self.queue.put(None)
+        self.thread.join()
+
+    def latest(self):
+        """Filepath of the most recent checkpoint, None if there is none."""
+        self.wait()
+        if not self.checkpoints:
+            return None
+        return os.path.join(self.directory, self.checkpoints[-1]['filename'])
+
+    def best(self):
+        """Filepath of the checkpoint with the lowest score, None if no checkpoint has one."""
+        self.wait()
+        scored = [c for c in self.checkpoints if c['score'] is not None]
+        if not scored:
+            return None
+        return os.path.join(self.directory, min(scored, key=lambda c: c['score'])['filename'])
+
+    def restore(self, filepath=None):
+        """
+        Loads a checkpoint (the latest by default) into the parameters,
+        accumulators and random streams, and the numpy random state. Returns
+        the state passed to save, with its iteration, or None without a
+        checkpoint.
+        """
+        if filepath is None:
+            filepath = self.latest()
+            if filepath is None:
+                return None
+
+        params, accumulators, state = load_checkpoint(filepath)
+        for p, value in zip(self.params, params):
+            p.set_value(value)
+        for accumulator, value in zip(self.accumulators, accumulators):
+            accumulator.set_value(value)
+        for stream, value in zip(self.random_streams, state.pop('random_streams')):
+            stream.set_value(value)
+        numpy.random.set_state(state.pop('numpy_random_state'))
+        del state['num_params'], state['num_accumulators']
+        return state
@@ -25,6 +25,8 @@ class ConvHiddenClassifyModelConfig():
 
     def __init__(self,
                batch_size=3,
+               num_micro_batches=1,
+               inference_batch_size=None,
                conv_size=(3, 3),
                downsample_factor=16,
                nkerns=(10, 25),
@@ -35,6 +37,8 @@ class ConvHiddenClassifyModelConfig():
                output=10):
 
         self.batch_size = batch_size
+        self.num_micro_batches = num_micro_batches
+        self.inference_batch_size = inference_batch_size
         self.conv_size = conv_size
         self.downsample_factor = downsample_factor
         self.nkerns = nkerns
@@ -43,6 +47,10 @@ class ConvHiddenClassifyModelConfig():
 
         self.input_shape = (batch_size, zdim/downsample_factor, 1, xdim/downsample_factor, ydim/downsample_factor)
 
+    def min_input_size(self):
+        """The smallest input side the valid convolutions leave at least one voxel of."""
+        return sum(self.conv_size[i] - 1 for i in range(len(self.nkerns))) + 1
+
     def build_model(self):
 
         y = T.ivector('y')   # the labels are presented as 1D vector of
@@ -74,7 +82,8 @@ class ConvHiddenClassifyModelConfig():
         #now add the recon layer
         mb.add_logistic_regression_layer(self.outputDim)
 
-        return mb.build_model(y)
+        return mb.build_model(y, num_micro_batches=self.num_micro_batches,
+                              inference_batch_size=self.inference_batch_size)
 
 
 if __name__ == "__main__":
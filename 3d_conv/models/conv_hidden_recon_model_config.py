@@ -29,6 +29,8 @@ class ConvHiddenReconModelConfig():
                downsample_factor=16,
                nkerns=(10, 25),
                nhidden=(1000,),
+               sparse_nkerns=(),
+               decoder_nkerns=(),
                xdim=256/2,
                ydim=256,
                zdim=256):
@@ -38,6 +40,11 @@ class ConvHiddenReconModelConfig():
         self.downsample_factor = downsample_factor
         self.nkerns = nkerns
         self.nhidden = nhidden
+        #submanifold sparse conv layers run on the occupied voxels before the dense conv layers
+        self.sparse_nkerns = sparse_nkerns
+        #when set, the output grid is decoded by deconv layers (each doubling the
+        #resolution) from a decoder_nkerns[0] channel seed grid instead of the recon layer
+        self.decoder_nkerns = decoder_nkerns
 
         self.input_shape = (batch_size, zdim/downsample_factor, 1, xdim/downsample_factor, ydim/downsample_factor)
         self.output_shape = (self.input_shape[0], reduce(mul, self.input_shape[1:]))
@@ -49,10 +56,16 @@ class ConvHiddenReconModelConfig():
 
         mb = ModelBuilder(self.input_shape)
 
+        nchannels = self.input_shape[2]
+        if len(self.sparse_nkerns) > 0:
+            for nkerns in self.sparse_nkerns:
+                mb.add_sparse_conv_layer(nkerns, filter_size=3)
+            mb.add_sparse_to_dense_layer()
+            nchannels = self.sparse_nkerns[-1]
+
         #add convolutional layers
         for i in range(len(self.nkerns)):
 
-            nchannels = self.input_shape[2]
             if i > 0:
                 nchannels = self.nkerns[i-1]
 
@@ -70,8 +83,20 @@ class ConvHiddenReconModelConfig():
             nhidden = self.nhidden[i]
             mb.add_hidden_layer(n=nhidden, activation=relu)
 
-        #now add the recon layer
-        mb.add_recon_layer(n=self.output_shape[-1], activation=T.nnet.sigmoid)
+        if len(self.decoder_nkerns) > 0:
+            #seed grid, then one upsampling deconv layer per remaining entry and the output channel
+            scale = 2 ** len(self.decoder_nkerns)
+            batch_size, zdim, nchannels, xdim, ydim = self.input_shape
+            seed_shape = (zdim / scale, self.decoder_nkerns[0], xdim / scale, ydim / scale)
+            mb.add_hidden_layer(n=reduce(mul, seed_shape), activation=relu)
+            mb.add_unflatten_layer(seed_shape)
+
+            for nkerns in self.decoder_nkerns[1:]:
+                mb.add_deconv_layer(nkerns, filter_size=4, upsample=2, activation=relu)
+            mb.add_deconv_layer(1, filter_size=4, upsample=2, activation=T.nnet.sigmoid)
+        else:
+            #now add the recon layer
+            mb.add_recon_layer(n=self.output_shape[-1], activation=T.nnet.sigmoid)
 
         return mb.build_model(y)
 
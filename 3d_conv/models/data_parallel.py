@@ -0,0 +1,253 @@
+import ctypes
+import multiprocessing
+import traceback
+import numpy
+import theano
+from theano.tensor.raw_random import RandomStateType
+
+from models.model_builder import Model
+from utils import tracing
+
+#Data parallel training on one machine. The minibatch is split in num_workers
+#shards. The calling process (rank 0) and num_workers - 1 forked worker
+#processes each hold a replica of the model and compute the gradients of one
+#shard. The gradients are averaged with an allreduce through shared memory
+#(each rank sums a slice of the parameters over all ranks, always in rank
+#order), and every replica applies the same RMSprop update to the same mean
+#gradient, so the replicas stay identical.
+#
+#The workers get their replica when they are forked, at the first train. After
+#changing the parameters or accumulators of rank 0 between two steps (with
+#Checkpointer.restore, progressive.transfer_params or set_value), call sync:
+#rank 0 then sends them to every worker at the start of the next step.
+#
+#The ModelBuilder is built with the shard size as batch size (conv3d2d needs
+#it in the input shape). The mean of the shard costs is the cost of the whole
+#minibatch, so a run matches a single process trained on the same global
+#batches up to float rounding, apart from dropout: every rank draws its masks
+#from its own random streams, seeded by rank.
+#
+#Theano's BLAS uses several threads per process; set OMP_NUM_THREADS (and the
+#BLAS thread count) to cores / num_workers before starting the script.
+#
+#usage:
+#   mb = ModelBuilder((batch_size / num_workers, 32, 1, 32, 32))
+#   ...
+#   trainer = DataParallelTrainer(mb, T.matrix('y'), num_workers)
+#   model = trainer.model   # train and test take whole minibatches
+#   ...
+#   checkpointer.restore()
+#   trainer.sync()
+#   ...
+#   trainer.close()
+
+
+class BrokenBarrierError(RuntimeError):
+    pass
+
+
+class Barrier(object):
+    """A barrier for forked processes (multiprocessing has none in python 2)."""
+
+    def __init__(self, parties):
+        self.parties = parties
+        self.count = multiprocessing.Value('i', 0, lock=False)
+        self.generation = multiprocessing.Value('i', 0, lock=False)
+        self.broken = multiprocessing.Value('i', 0, lock=False)
+        self.condition = multiprocessing.Condition()
+
+    def wait(self):
+        with self.condition:
+            if self.broken.value:
+                raise BrokenBarrierError("a process of the barrier failed")
+            generation = self.generation.value
+            self.count.value += 1
+            if self.count.value == self.parties:
+                self.count.value = 0
+                self.generation.value += 1
+                self.condition.notify_all()
+                return
+            while generation == self.generation.value:
+                if self.broken.value:
+                    raise BrokenBarrierError("a process of the barrier failed")
+                self.condition.wait(1.0)
+
+    def abort(self):
+        with self.condition:
+            self.broken.value = 1
+            self.condition.notify_all()
+
+
+def shared_array(shape, dtype):
+    """A numpy array in shared memory, inherited by forked processes."""
+    dtype = numpy.dtype(dtype)
+    size = int(numpy.prod(shape)) * dtype.itemsize
+    buf = multiprocessing.RawArray(ctypes.c_byte, max(size, 1))
+    return numpy.frombuffer(buf, dtype=dtype, count=int(numpy.prod(shape))).reshape(shape)
+
+
+def reseed_random_streams(function, seed):
+    """New random states for the random streams (dropout masks) of a compiled function."""
+    rng = numpy.random.RandomState(seed)
+    for function_input in function.maker.inputs:
+        variable = function_input.variable
+        if isinstance(variable.type, RandomStateType) and hasattr(variable, 'set_value'):
+            variable.set_value(numpy.random.RandomState(rng.randint(2 ** 30)), borrow=True)
+
+
+class DataParallelTrainer(object):
+
+    def __init__(self, model_builder, y, num_workers, seed=1234):
+        functions = model_builder.build_gradient_functions(y)
+        self.gradients = functions['gradients']
+        self.apply_gradients = functions['apply_gradients']
+        self.shard_test = functions['test']
+        self.layers = model_builder.layers
+        self.accumulators = functions['accumulators']
+
+        self.num_workers = num_workers
+        self.shard_size = model_builder.input_shape[0]
+        self.seed = seed
+
+        params = functions['params']
+        self.params = params
+        self.param_shapes = [p.get_value(borrow=True).shape for p in params]
+        self.param_dtype = params[0].dtype
+        sizes = [int(numpy.prod(shape)) for shape in self.param_shapes]
+        self.offsets = numpy.cumsum([0] + sizes)
+
+        # rank r reduces the parameters in [bounds[r], bounds[r + 1])
+        self.bounds = numpy.linspace(0, self.offsets[-1], num_workers + 1).astype(int)
+
+        self.processes = []
+        self.model = Model(train=self.train, test=self.test, validate=self.test, demonstrate=None,
+                           layers=self.layers, accumulators=self.accumulators)
+
+    def _start(self, batch_x, batch_y):
+        """Allocates the shared buffers for the shapes of the first minibatch and forks the workers."""
+        n = self.num_workers
+        self.x_shards = shared_array((n, self.shard_size) + batch_x.shape[1:], batch_x.dtype)
+        self.y_shards = shared_array((n, self.shard_size) + batch_y.shape[1:], batch_y.dtype)
+        self.grad_buffers = shared_array((n, self.offsets[-1]), self.param_dtype)
+        self.mean_gradient = shared_array((self.offsets[-1],), self.param_dtype)
+        self.costs = shared_array((n,), numpy.float64)
+        # the parameters and accumulators of rank 0, for the workers when sync_pending is set
+        self.sync_buffer = shared_array((2, self.offsets[-1]), self.param_dtype)
+        self.sync_pending = multiprocessing.Value('i', 0, lock=False)
+        self.stop = multiprocessing.Value('i', 0, lock=False)
+        self.barrier = Barrier(n)
+
+        for rank in xrange(1, n):
+            process = multiprocessing.Process(target=self._worker, args=(rank,))
+            process.daemon = True
+            process.start()
+            self.processes.append(process)
+
+    def _worker(self, rank):
+        reseed_random_streams(self.gradients, self.seed + rank)
+        try:
+            while True:
+                self.barrier.wait()
+                if self.stop.value:
+                    return
+                self._step(rank)
+        except BrokenBarrierError:
+            pass
+        except:
+            traceback.print_exc()
+            self.barrier.abort()
+        finally:
+            # the process leaves with os._exit, without the atexit handlers
+            tracing.flush()
+
+    def _variables(self):
+        return [(0, self.params), (1, self.accumulators)]
+
+    def sync(self):
+        """
+        Sends the parameters and accumulators of this process (rank 0) to the
+        workers at the start of the next step. Call it after changing them
+        between steps, the workers only copy them when they are forked.
+        """
+        if not self.processes:
+            return
+        for row, variables in self._variables():
+            for v, start, stop in zip(variables, self.offsets[:-1], self.offsets[1:]):
+                self.sync_buffer[row, start:stop] = v.get_value(borrow=True).ravel()
+        self.sync_pending.value = 1
+
+    def _receive_sync(self):
+        for row, variables in self._variables():
+            for v, start, stop, shape in zip(variables, self.offsets[:-1], self.offsets[1:], self.param_shapes):
+                v.set_value(self.sync_buffer[row, start:stop].reshape(shape).copy())
+
+    def _step(self, rank):
+        if rank > 0 and self.sync_pending.value:
+            self._receive_sync()
+
+        with tracing.span("gradients", "theano", rank=rank):
+            outputs = self.gradients(self.x_shards[rank], self.y_shards[rank])
+        self.costs[rank] = outputs[0]
+        grad_buffer = self.grad_buffers[rank]
+        for g, start, stop in zip(outputs[1:], self.offsets[:-1], self.offsets[1:]):
+            grad_buffer[start:stop] = g.ravel()
+
+        with tracing.span("allreduce", "sync", rank=rank):
+            self.barrier.wait()
+            # every worker has received the sync before this barrier
+            if rank == 0:
+                self.sync_pending.value = 0
+            start, stop = self.bounds[rank], self.bounds[rank + 1]
+            self.mean_gradient[start:stop] = self.grad_buffers[:, start:stop].sum(axis=0) / self.num_workers
+            self.barrier.wait()
+
+        with tracing.span("apply_gradients", "theano", rank=rank):
+            self.apply_gradients(*[self.mean_gradient[start:stop].reshape(shape) for start, stop, shape in
+                                   zip(self.offsets[:-1], self.offsets[1:], self.param_shapes)])
+
+    def _shards(self, batch):
+        if batch.shape[0] != self.num_workers * self.shard_size:
+            raise ValueError("minibatches must hold %d x %d examples, got %d" %
+                             (self.num_workers, self.shard_size, batch.shape[0]))
+        return batch.reshape((self.num_workers, self.shard_size) + batch.shape[1:])
+
+    def train(self, batch_x, batch_y):
+        """One RMSprop step on a minibatch of num_workers * shard size examples, returns its cost."""
+        batch_x = numpy.asarray(batch_x)
+        batch_y = numpy.asarray(batch_y)
+        if not self.processes and self.num_workers > 1:
+            self._start(batch_x, batch_y)
+        if self.num_workers == 1:
+            return self._train_single(batch_x, batch_y)
+
+        self.x_shards[:] = self._shards(batch_x)
+        self.y_shards[:] = self._shards(batch_y)
+        try:
+            self.barrier.wait()
+            self._step(0)
+        except:
+            self.barrier.abort()
+            raise
+        return self.costs.mean()
+
+    def _train_single(self, batch_x, batch_y):
+        outputs = self.gradients(batch_x, batch_y)
+        self.apply_gradients(*outputs[1:])
+        return outputs[0]
+
+    def test(self, batch_x, batch_y):
+        """Mean error of the shards of a minibatch, on the replica of this process."""
+        shards = zip(self._shards(numpy.asarray(batch_x)), self._shards(numpy.asarray(batch_y)))
+        return numpy.mean([self.shard_test(x, y) for x, y in shards])
+
+    def close(self):
+        if not self.processes:
+            return
+        self.stop.value = 1
+        try:
+            self.barrier.wait()
+        except BrokenBarrierError:
+            pass
+        for process in self.processes:
+            process.join()
+        self.processes = []
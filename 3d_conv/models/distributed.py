@@ -0,0 +1,314 @@
+import os
+import socket
+import struct
+import threading
+import time
+import numpy
+
+from collections import namedtuple
+
+from models.data_parallel import reseed_random_streams
+from models.model_builder import Model, RMS_PROP_DECAY, RMS_PROP_EPSILON
+
+#Data parallel training over several machines, with a parameter server on
+#rank 0. Every rank (one process per machine, rank 0 included) trains on its
+#shard of each global minibatch: it pulls the parameters from the server,
+#computes the gradients of its shard and pushes them back. The server applies
+#one RMSprop update (the update of ModelBuilder) per step, with the mean of the
+#gradients of all ranks for that step, summed in rank order.
+#
+#Stale synchronous parallel: a rank at step t only waits until the updates of
+#the steps before t - staleness are applied, so with staleness > 0 slow ranks
+#do not hold up the others, and gradients are computed on parameters that miss
+#at most staleness updates. With staleness = 0 every step is synchronous and
+#training matches a single process on the same global minibatches (up to float
+#rounding, and apart from dropout: every rank seeds its own random streams).
+#
+#ShardedSampler gives every rank its part of a shared shuffled order of the
+#examples. Checkpoints of the server state are written by rank 0 only.
+#
+#Messages are a fixed header (command, step, rank, cost, number of arrays)
+#followed by the raw buffers of the arrays, each after its dtype and shape, so
+#that nothing received is unpickled. The server does not authenticate the
+#ranks though: bind it to an interface of the private network of the
+#machines, not to one reachable from outside.
+#
+#usage, on every machine (rank 0 first, or the others retry until it is up):
+#   mb = ModelBuilder((shard_size, 64, 1, 64, 64))
+#   ...
+#   trainer = DistributedTrainer(mb, T.matrix('y'), rank, world_size, ('node0', 5555))
+#   sampler = ShardedSampler(num_examples, shard_size, rank, world_size)
+#   for i in xrange(n_train_batches):
+#       indices = sampler.next()
+#       trainer.train(x[indices], y[indices])
+#       trainer.checkpoint("completion_64.npz")   # no-op on ranks > 0
+#   trainer.close()
+
+CONNECT_TIMEOUT = 60.0
+
+COMMANDS = ('pull', 'sync', 'push', 'params', 'close')
+
+# command, step (the version for params), rank, cost, number of arrays
+HEADER = struct.Struct('!BqqdI')
+# dtype (numpy dtype.str) and number of dimensions, followed by the shape
+ARRAY_HEADER = struct.Struct('!4sB')
+
+Message = namedtuple('Message', ['command', 'step', 'rank', 'cost', 'arrays'])
+
+
+def send_message(sock, command, step=0, rank=0, cost=0., arrays=()):
+    arrays = [numpy.asarray(a, order='C') for a in arrays]
+    if any(a.dtype.hasobject for a in arrays):
+        raise ValueError("object arrays are not sent")
+    sock.sendall(HEADER.pack(COMMANDS.index(command), step, rank, cost, len(arrays)))
+    for a in arrays:
+        sock.sendall(ARRAY_HEADER.pack(a.dtype.str, a.ndim) + struct.pack('!%dQ' % a.ndim, *a.shape))
+        sock.sendall(buffer(a))
+
+
+def _recv_exactly(sock, size):
+    buf = bytearray(size)
+    view = memoryview(buf)
+    received = 0
+    while received < size:
+        n = sock.recv_into(view[received:], size - received)
+        if n == 0:
+            raise EOFError("connection closed")
+        received += n
+    return buf
+
+
+def recv_message(sock):
+    command, step, rank, cost, num_arrays = HEADER.unpack(str(_recv_exactly(sock, HEADER.size)))
+    if command >= len(COMMANDS):
+        raise ValueError("unknown command: %d" % command)
+
+    arrays = []
+    for i in xrange(num_arrays):
+        dtype, ndim = ARRAY_HEADER.unpack(str(_recv_exactly(sock, ARRAY_HEADER.size)))
+        dtype = numpy.dtype(dtype.rstrip('\0'))
+        if dtype.hasobject:
+            raise ValueError("object arrays are not accepted")
+        shape = struct.unpack('!%dQ' % ndim, str(_recv_exactly(sock, 8 * ndim)))
+        size = int(numpy.prod(shape)) * dtype.itemsize
+        arrays.append(numpy.ndarray(shape, dtype=dtype, buffer=_recv_exactly(sock, size)))
+
+    return Message(COMMANDS[command], step, rank, cost, arrays)
+
+
+def connect(address, timeout=CONNECT_TIMEOUT):
+    """A connection to address, retried until the server is up or timeout seconds passed."""
+    deadline = time.time() + timeout
+    while True:
+        try:
+            sock = socket.create_connection(address)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            return sock
+        except socket.error:
+            if time.time() > deadline:
+                raise
+            time.sleep(.1)
+
+
+class ParameterServer(object):
+
+    def __init__(self, params, num_workers, learning_rate=.1, staleness=0):
+        self.params = [numpy.array(p) for p in params]
+        self.accumulators = [numpy.zeros_like(p) for p in self.params]
+        self.num_workers = num_workers
+        self.learning_rate = learning_rate
+        self.staleness = staleness
+
+        # number of steps applied, and the gradients pushed for later steps
+        self.version = 0
+        self.pending = {}
+        self.costs = []
+        self.condition = threading.Condition()
+
+        self.listener = None
+        self.num_closed = 0
+
+    def pull(self, step, staleness=None):
+        """(version, parameters) for a rank at step, once the steps before step - staleness are applied."""
+        if staleness is None:
+            staleness = self.staleness
+        with self.condition:
+            while self.version < step - staleness:
+                self.condition.wait()
+            return self.version, [p.copy() for p in self.params]
+
+    def push(self, rank, step, gradients, cost):
+        with self.condition:
+            self.pending.setdefault(step, {})[rank] = (gradients, cost)
+            while len(self.pending.get(self.version, ())) == self.num_workers:
+                self._apply(self.pending.pop(self.version))
+                self.version += 1
+            self.condition.notify_all()
+
+    def _apply(self, pushed):
+        # RMSprop, as in ModelBuilder._rms_prop_updates
+        ranks = sorted(pushed.keys())
+        for i, (p, mean_square) in enumerate(zip(self.params, self.accumulators)):
+            g = pushed[ranks[0]][0][i].copy()
+            for rank in ranks[1:]:
+                g += pushed[rank][0][i]
+            g /= self.num_workers
+            mean_square[...] = RMS_PROP_DECAY * mean_square + (1 - RMS_PROP_DECAY) * g ** 2
+            p -= self.learning_rate * g / numpy.sqrt(mean_square + RMS_PROP_EPSILON)
+        self.costs.append(numpy.mean([pushed[rank][1] for rank in ranks]))
+
+    def snapshot(self):
+        """Consistent copy of (version, parameters, accumulators)."""
+        with self.condition:
+            return self.version, [p.copy() for p in self.params], [a.copy() for a in self.accumulators]
+
+    def serve(self, address):
+        """Accepts the connections of the ranks on address in background threads."""
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind(address)
+        self.listener.listen(self.num_workers)
+        thread = threading.Thread(target=self._accept)
+        thread.daemon = True
+        thread.start()
+
+    def _accept(self):
+        for i in xrange(self.num_workers):
+            sock, peer = self.listener.accept()
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            thread = threading.Thread(target=self._handle, args=(sock,))
+            thread.daemon = True
+            thread.start()
+
+    def _handle(self, sock):
+        try:
+            while True:
+                message = recv_message(sock)
+                if message.command in ('pull', 'sync'):
+                    staleness = 0 if message.command == 'sync' else None
+                    version, params = self.pull(message.step, staleness=staleness)
+                    send_message(sock, 'params', step=version, arrays=params)
+                elif message.command == 'push':
+                    self.push(message.rank, message.step, message.arrays, message.cost)
+                else:
+                    break
+        except EOFError:
+            pass
+        finally:
+            sock.close()
+            with self.condition:
+                self.num_closed += 1
+                self.condition.notify_all()
+
+    def wait_closed(self):
+        """Waits until every rank has connected and closed its connection."""
+        with self.condition:
+            while self.num_closed < self.num_workers:
+                self.condition.wait(1.0)
+        self.listener.close()
+
+
+class ShardedSampler(object):
+    """
+    Example indices for one rank. Every epoch all ranks shuffle the examples
+    with the same seed and cut the order into global minibatches of
+    world_size * batch_size examples, of which each rank takes its slice.
+    """
+
+    def __init__(self, num_examples, batch_size, rank, world_size, seed=0):
+        self.num_examples = num_examples
+        self.batch_size = batch_size
+        self.rank = rank
+        self.world_size = world_size
+        self.seed = seed
+        self.steps_per_epoch = num_examples // (batch_size * world_size)
+        if self.steps_per_epoch == 0:
+            raise ValueError("%d examples do not fill a global minibatch of %d" %
+                             (num_examples, batch_size * world_size))
+        self.set_state((0, 0))
+
+    def get_state(self):
+        return self.epoch, self.step
+
+    def set_state(self, state):
+        self.epoch, self.step = state
+        self.order = numpy.random.RandomState(self.seed + self.epoch).permutation(self.num_examples)
+
+    def next(self):
+        if self.step == self.steps_per_epoch:
+            self.set_state((self.epoch + 1, 0))
+        start = (self.step * self.world_size + self.rank) * self.batch_size
+        self.step += 1
+        return self.order[start:start + self.batch_size]
+
+    def __iter__(self):
+        return self
+
+
+class DistributedTrainer(object):
+
+    def __init__(self, model_builder, y, rank, world_size, address, staleness=0, seed=1234):
+        functions = model_builder.build_gradient_functions(y)
+        self.gradients = functions['gradients']
+        self.shard_test = functions['test']
+        self.params = functions['params']
+        self.layers = model_builder.layers
+        reseed_random_streams(self.gradients, seed + rank)
+
+        self.rank = rank
+        self.world_size = world_size
+        self.step = 0
+
+        self.server = None
+        if rank == 0:
+            self.server = ParameterServer([p.get_value() for p in self.params], world_size,
+                                          learning_rate=model_builder.learning_rate, staleness=staleness)
+            self.server.serve(address)
+        self.sock = connect(address)
+
+        self.model = Model(train=self.train, test=self.test, validate=self.test, demonstrate=None,
+                           layers=self.layers, accumulators=[])
+
+    def _pull(self, step, command='pull'):
+        send_message(self.sock, command, step=step)
+        message = recv_message(self.sock)
+        for p, value in zip(self.params, message.arrays):
+            p.set_value(value, borrow=True)
+        return message.step
+
+    def train(self, batch_x, batch_y):
+        """One step on the shard of this rank, returns its cost."""
+        self._pull(self.step)
+        outputs = self.gradients(batch_x, batch_y)
+        send_message(self.sock, 'push', step=self.step, rank=self.rank, cost=float(outputs[0]), arrays=outputs[1:])
+        self.step += 1
+        return outputs[0]
+
+    def sync(self):
+        """Loads the parameters with every update of the steps so far applied."""
+        return self._pull(self.step, command='sync')
+
+    def test(self, batch_x, batch_y):
+        """Error of a batch with the current parameters of the server."""
+        self.sync()
+        return self.shard_test(batch_x, batch_y)
+
+    def checkpoint(self, filepath):
+        """Writes the server state (rank 0 only), returns whether a file was written."""
+        if self.server is None:
+            return False
+        version, params, accumulators = self.server.snapshot()
+        arrays = {'version': numpy.array(version)}
+        for i, (p, a) in enumerate(zip(params, accumulators)):
+            arrays["param_%d" % i] = p
+            arrays["accumulator_%d" % i] = a
+        tmp_filepath = filepath + ".tmp.npz"
+        numpy.savez(tmp_filepath, **arrays)
+        os.rename(tmp_filepath, filepath)
+        return True
+
+    def close(self):
+        send_message(self.sock, 'close')
+        self.sock.close()
+        if self.server is not None:
+            self.server.wait_closed()
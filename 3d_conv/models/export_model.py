@@ -0,0 +1,92 @@
+import json
+import numpy
+import theano
+import theano.tensor as T
+
+from layers.conv_layer_3d import ConvLayer3D
+from layers.deconv_layer_3d import DeconvLayer3D
+from layers.flatten_layer import FlattenLayer, UnflattenLayer
+from layers.hidden_layer import HiddenLayer
+from layers.layer_utils import relu, leaky_relu
+from layers.logistic_regression_layer import LogisticRegression
+from layers.max_pool_layer_3d import MaxPoolLayer3D
+from layers.recon_layer import ReconLayer
+
+#Writes a trained model (the layers of a ModelBuilder) for models/numpy_model.py:
+#   <prefix>.npz - the weights, "<layer index>_W" and "<layer index>_b"
+#   <prefix>.json - the architecture, one record per layer with its type,
+#                   shapes and settings
+#
+#usage:
+#   export_model(model.layers, "completion_24")
+#   numpy_model.NumpyModel.load("completion_24").predict(x)
+
+FORMAT_VERSION = 1
+
+ACTIVATION_NAMES = [
+    (None, None),
+    (relu, 'relu'),
+    (leaky_relu, 'leaky_relu'),
+    (T.nnet.sigmoid, 'sigmoid'),
+    (T.tanh, 'tanh'),
+]
+
+
+def activation_name(activation):
+    for known, name in ACTIVATION_NAMES:
+        if activation is known:
+            return name
+    raise ValueError("activation " + str(activation) + " can not be exported")
+
+
+def pool_record(layer):
+    return {
+        'ds': layer.ds,
+        'st': layer.st,
+        'padding': layer.padding,
+        'ignore_border': layer.ignore_border,
+        'mode': layer.mode,
+        'output_shape': list(layer.output_shape),
+    }
+
+
+def layer_record(layer):
+    """(json record, {name: array}) of a layer."""
+    if isinstance(layer, ConvLayer3D):
+        record = {'type': 'conv', 'activation': 'relu'}
+        if layer.pool is not None:
+            record['pool'] = pool_record(layer.pool)
+    elif isinstance(layer, DeconvLayer3D):
+        record = {'type': 'deconv', 'activation': activation_name(layer.activation), 'upsample': layer.upsample}
+    elif isinstance(layer, MaxPoolLayer3D):
+        record = dict(pool_record(layer), type='pool')
+    elif isinstance(layer, FlattenLayer):
+        record = {'type': 'flatten'}
+    elif isinstance(layer, UnflattenLayer):
+        record = {'type': 'unflatten', 'shape': list(layer.output_shape[1:])}
+    elif isinstance(layer, (HiddenLayer, ReconLayer)):
+        record = {'type': 'dense', 'activation': activation_name(layer.activation)}
+    elif isinstance(layer, LogisticRegression):
+        record = {'type': 'dense', 'activation': 'softmax'}
+    else:
+        raise ValueError(layer.__class__.__name__ + " can not be exported")
+
+    arrays = {}
+    if len(layer.params) > 0:
+        arrays['W'] = layer.W.get_value()
+        arrays['b'] = layer.b.get_value()
+    return record, arrays
+
+
+def export_model(layers, filepath_prefix):
+    records = []
+    weights = {}
+    for index, layer in enumerate(layers):
+        record, arrays = layer_record(layer)
+        records.append(record)
+        for name, value in arrays.items():
+            weights["%d_%s" % (index, name)] = value
+
+    numpy.savez(filepath_prefix + ".npz", **weights)
+    with open(filepath_prefix + ".json", 'w') as f:
+        json.dump({'version': FORMAT_VERSION, 'floatX': theano.config.floatX, 'layers': records}, f, indent=1)
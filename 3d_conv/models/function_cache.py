@@ -0,0 +1,85 @@
+import glob
+import hashlib
+import os
+import sys
+import theano
+
+from utils import cache
+
+#Compiled theano functions of ModelBuilder.build_model, pickled in the on disk
+#cache (utils/cache.py) so that a process building the same model skips the
+#graph optimization and compilation. Theano does not re-optimize unpickled
+#functions, and their C code comes from the theano compiledir.
+#
+#The key covers the recorded architecture, the input and target types, the
+#optimizer settings, the theano version and configuration, and the source of
+#the modules that build the graphs, so editing a layer invalidates the cache.
+#Bump CACHE_VERSION when the pickled layout changes.
+
+CACHE_VERSION = 1
+
+#pickling a theano graph recurses once per node
+RECURSION_LIMIT = 50000
+
+_source_hash = None
+
+
+def describe(value):
+    """Stable text for the architecture settings (functions by name, not by address)."""
+    if isinstance(value, (list, tuple)):
+        return "(" + ", ".join(describe(v) for v in value) + ")"
+    if callable(value):
+        return getattr(value, '__name__', str(value))
+    return repr(value)
+
+
+def source_hash():
+    global _source_hash
+    if _source_hash is None:
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        filepaths = sorted(glob.glob(os.path.join(root, "layers", "*.py")))
+        filepaths += [os.path.join(root, "models", "model_builder.py")]
+        digest = hashlib.sha1()
+        for filepath in filepaths:
+            with open(filepath, 'rb') as f:
+                digest.update(f.read())
+        _source_hash = digest.hexdigest()
+    return _source_hash
+
+
+def model_key(architecture, input_shape, y, optimizer_settings):
+    description = [
+        ("cache version", CACHE_VERSION),
+        ("theano", theano.__version__),
+        ("config", (theano.config.floatX, theano.config.device, theano.config.mode,
+                    theano.config.optimizer, theano.config.cxx)),
+        ("source", source_hash()),
+        ("input shape", describe(tuple(input_shape))),
+        ("y", str(y.type) if y is not None else None),
+        ("optimizer", describe(optimizer_settings)),
+        ("architecture", describe(architecture)),
+    ]
+    return hashlib.sha1(repr(description)).hexdigest()
+
+
+def cache_filename(key):
+    return "model_functions_%s.pkl" % key[:24]
+
+
+def load(key):
+    """The dict stored by save, or None on a cache miss."""
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(max(limit, RECURSION_LIMIT))
+    try:
+        return cache.load_pickle(cache_filename(key))
+    finally:
+        sys.setrecursionlimit(limit)
+
+
+def save(key, functions):
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(max(limit, RECURSION_LIMIT))
+    try:
+        cache.save_pickle(cache_filename(key), functions)
+    finally:
+        sys.setrecursionlimit(limit)
@@ -1,6 +1,7 @@
 
 
 
+import time
 import numpy
 
 import theano
@@ -9,176 +10,529 @@ import theano.tensor as T
 from theano.tensor.nnet.conv3d2d import *
 
 from layers.conv_layer_3d import *
+from layers.deconv_layer_3d import *
 from layers.flatten_layer import *
 from layers.hidden_layer import *
 from layers.layer_utils import *
 from layers.logistic_regression_layer import *
 from layers.max_pool_layer_3d import *
 from layers.recon_layer import *
+from layers.sparse_conv_layer_3d import *
+
+from models import function_cache
+from utils import tracing
 
 from collections import namedtuple
 
-Model = namedtuple('Model', ['train', 'test', 'validate', 'demonstrate', 'layers'], verbose=False)
+Model = namedtuple('Model', ['train', 'test', 'validate', 'demonstrate', 'layers', 'accumulators'], verbose=False)
+
+InferenceModel = namedtuple('InferenceModel', ['predict', 'test', 'batch_size', 'layers'], verbose=False)
+
+# RMSprop decay of the mean square of the gradients, and the epsilon added to it
+# before the square root (also used by the parameter server of models/distributed.py)
+RMS_PROP_DECAY = 0.9
+RMS_PROP_EPSILON = 0.000001
+
+# the ModelBuilder method adding each layer class, to build an architecture again
+ADD_METHODS = {
+    'ConvLayer3D': 'add_conv_layer',
+    'MaxPoolLayer3D': 'add_max_pool_layer',
+    'SparseInputLayer': 'add_sparse_input_layer',
+    'SparseConvLayer3D': 'add_sparse_conv_layer',
+    'SparseToDenseLayer': 'add_sparse_to_dense_layer',
+    'FlattenLayer': 'add_flatten_layer',
+    'UnflattenLayer': 'add_unflatten_layer',
+    'DeconvLayer3D': 'add_deconv_layer',
+    'HiddenLayer': 'add_hidden_layer',
+    'ReconLayer': 'add_recon_layer',
+    'LogisticRegression': 'add_logistic_regression_layer',
+}
+
+
+def _swap_shared(function, swap):
+    """A copy of a compiled function on other shared variables of the same types, without compiling it again."""
+    inputs = set(function_input.variable for function_input in function.maker.inputs)
+    copied = function.copy(swap=dict((k, v) for k, v in swap.items() if k in inputs))
+    # copy builds the function on the list of outputs, which it would return as is
+    copied.unpack_single = function.unpack_single
+    return copied
 
 
 class ModelBuilder():
+    """
+    Builds a model layer by layer on inputs of input_shape, BZCXY. A batch
+    size of None builds layers taking any batch size: train and test then
+    accept minibatches of any size, including the last partial one.
+    """
 
     def __init__(self, input_shape, learning_rate=.1):
         self.learning_rate = learning_rate
 
         self.layers = []
+        self.architecture = []
 
         self.rng = numpy.random.RandomState(23455)
-        self.drop = T.iscalar('drop')
         self.input_shape = input_shape
 
-    def add_conv_layer(self, filter_shape):
+    def _append(self, layer, **settings):
+        # the architecture record keys the compiled function cache
+        self.layers.append(layer)
+        self.architecture.append((layer.__class__.__name__, sorted(settings.items())))
 
+    def _next_input(self):
+        """(inference input, training input, shape) of the next layer"""
         if len(self.layers) == 0:
             dtensor5 = theano.tensor.TensorType('float32', (0,)*5)
             input = dtensor5()
-            input_shape = self.input_shape
-        else:
-            input = self.layers[-1].output
-            input_shape = self.layers[-1].output_shape
+            return input, input, self.input_shape
+        return self.layers[-1].output, self.layers[-1].train_output, self.layers[-1].output_shape
+
+    def add_conv_layer(self, filter_shape, conv_impl='conv3d2d'):
+
+        input, train_input, input_shape = self._next_input()
 
         layer = ConvLayer3D(
             rng=self.rng,
             input=input,
+            train_input=train_input,
             image_shape=input_shape,
             filter_shape=filter_shape,
             poolsize=(0, 0),
-            drop=self.drop
+            conv_impl=conv_impl
         )
 
-        self.layers.append(layer)
+        self._append(layer, filter_shape=filter_shape, conv_impl=layer.conv_impl)
 
-    def add_max_pool_layer(self, downsample_factor=2, ignore_border=False):
+    def add_max_pool_layer(self, downsample_factor=2, ignore_border=False, stride=None, padding=0, mode='max'):
         layer = MaxPoolLayer3D(
             input=self.layers[-1].output,
-            image_shape=self.layers[-1].output_shape,
+            train_input=self.layers[-1].train_output,
+            input_shape=self.layers[-1].output_shape,
             ds=downsample_factor,
-            ignore_border=ignore_border
+            ignore_border=ignore_border,
+            st=stride,
+            padding=padding,
+            mode=mode
         )
 
-        self.layers.append(layer)
+        self._append(layer, downsample_factor=downsample_factor, ignore_border=ignore_border, stride=stride,
+                     padding=padding, mode=mode)
+
+    def add_sparse_input_layer(self):
+        input, train_input, input_shape = self._next_input()
+
+        layer = SparseInputLayer(
+            input=input,
+            train_input=train_input,
+            input_shape=input_shape
+        )
+
+        self._append(layer)
+
+    def add_sparse_conv_layer(self, n_filters, filter_size=3):
+        if len(self.layers) == 0 or not hasattr(self.layers[-1], 'sites'):
+            self.add_sparse_input_layer()
+
+        layer = SparseConvLayer3D(
+            self.rng,
+            input=self.layers[-1].output,
+            train_input=self.layers[-1].train_output,
+            sites=self.layers[-1].sites,
+            train_sites=self.layers[-1].train_sites,
+            input_shape=self.layers[-1].output_shape,
+            n_out=n_filters,
+            filter_size=filter_size
+        )
+
+        self._append(layer, n_filters=n_filters, filter_size=filter_size)
+
+    def add_sparse_to_dense_layer(self):
+        layer = SparseToDenseLayer(
+            input=self.layers[-1].output,
+            train_input=self.layers[-1].train_output,
+            sites=self.layers[-1].sites,
+            train_sites=self.layers[-1].train_sites,
+            input_shape=self.layers[-1].output_shape
+        )
+
+        self._append(layer)
 
     def add_flatten_layer(self):
         layer = FlattenLayer(
             input=self.layers[-1].output,
+            train_input=self.layers[-1].train_output,
             input_shape=self.layers[-1].output_shape,
         )
-        self.layers.append(layer)
+        self._append(layer)
+
+    def add_unflatten_layer(self, shape):
+        """shape: the (z, channels, x, y) of each example"""
+        input_shape = self.layers[-1].output_shape
+        layer = UnflattenLayer(
+            input=self.layers[-1].output,
+            train_input=self.layers[-1].train_output,
+            input_shape=input_shape,
+            output_shape=(input_shape[0],) + tuple(shape)
+        )
+        self._append(layer, shape=shape)
+
+    def add_deconv_layer(self, n_filters, filter_size=4, upsample=2, activation=relu, conv_impl='conv3d2d'):
+        input_shape = self.layers[-1].output_shape
+        filter_shape = (n_filters, filter_size, input_shape[2], filter_size, filter_size)
+
+        layer = DeconvLayer3D(
+            self.rng,
+            input=self.layers[-1].output,
+            train_input=self.layers[-1].train_output,
+            filter_shape=filter_shape,
+            image_shape=input_shape,
+            upsample=upsample,
+            activation=activation,
+            conv_impl=conv_impl
+        )
+
+        self._append(layer, n_filters=n_filters, filter_size=filter_size, upsample=upsample, activation=activation,
+                     conv_impl=layer.conv_impl)
 
     def add_hidden_layer(self, n, activation):
 
         layer = HiddenLayer(
             self.rng,
             input=self.layers[-1].output,
+            train_input=self.layers[-1].train_output,
             input_shape=self.layers[-1].output_shape,
             n_out=n,
             activation=activation,
-            drop=self.drop
         )
 
-        self.layers.append(layer)
+        self._append(layer, n=n, activation=activation)
 
     def add_recon_layer(self, n, activation):
         layer = ReconLayer(
             self.rng,
             input=self.layers[-1].output,
+            train_input=self.layers[-1].train_output,
             n_in=self.layers[-1].output_shape[-1],
             n_out=n,
             activation=activation,
         )
 
-        self.layers.append(layer)
+        self._append(layer, n=n, activation=activation)
 
     def add_logistic_regression_layer(self, n):
         layer = LogisticRegression(
             input=self.layers[-1].output,
+            train_input=self.layers[-1].train_output,
             n_in=self.layers[-1].output_shape[-1],
             n_out=n,rng=self.rng
 
 
         )
 
-        self.layers.append(layer)
+        self._append(layer, n=n)
+
+    def _rms_prop_updates(self, grads, params):
+        # train_model is a function that updates the model parameters by
+        # SGD Since this model has many parameters, it would be tedious to
+        # manually create an update rule for each model parameter. We thus
+        # create the updates list by automatically looping over all
+        # (params[i], grads[i]) pairs.
 
-    def build_model(self, y):
+        #RMSprop
+        updates = []
+        accumulators = []
+        for p, g in zip(params, grads):
+            MeanSquare = theano.shared(p.get_value() * 0.)
+            nextMeanSquare = RMS_PROP_DECAY * MeanSquare + (1 - RMS_PROP_DECAY) * g ** 2
+            g = g / T.sqrt(nextMeanSquare + RMS_PROP_EPSILON)
+            updates.append((MeanSquare, nextMeanSquare))
+            updates.append((p, p - self.learning_rate * g))
+            accumulators.append(MeanSquare)
 
-        params = []
-        for layer in self.layers:
-            params += layer.params
+        return updates, accumulators
+
+    def _training_cost(self, y):
+        # the cost we minimize during training is the NLL of the model, on the
+        # training graph (with dropout). errors are measured on the inference
+        # graph, which has no dropout masks or random streams.
+        last = self.layers[-1]
+        return training_expression(last.negative_log_likelihood(y), {last.output: last.train_output})
 
+    def _compile(self, y, params, num_micro_batches=1):
         x = self.layers[0].input
+        last = self.layers[-1]
 
-        # the cost we minimize during training is the NLL of the model
-        cost = self.layers[-1].negative_log_likelihood(y)
-        errors = self.layers[-1].errors(y)
+        cost = self._training_cost(y)
+        errors = last.errors(y)
 
-        # create a function to compute the mistakes that are made by the model
+        # create a function to compute the mistakes that are made by the model,
+        # used both to test and to validate
         test_model = theano.function(
             [x, y],
             errors,
-            givens={
-                self.drop: numpy.cast['int32'](0)
-            }, allow_input_downcast=True
+            allow_input_downcast=True
         )
 
-        validate_model = theano.function(
-            [x,y],
-            errors,
-            givens={
+        if num_micro_batches > 1:
+            return dict(self._compile_accumulation(x, y, cost, params, num_micro_batches), test=test_model)
 
-                self.drop: numpy.cast['int32'](0)
-
-            }, allow_input_downcast=True
+        # create a list of gradients for all model parameters
+        updates, accumulators = self._rms_prop_updates(T.grad(cost, params), params)
 
+        train_model = theano.function(
+            [x,y],
+            cost,
+            updates=updates,
+            allow_input_downcast=True
         )
 
-        demonstrate_model = None
-        """theano.function(
+        return {'train': train_model, 'test': test_model, 'params': params, 'accumulators': accumulators}
+
+    def _compile_accumulation(self, x, y, cost, params, num_micro_batches):
+        # gradient accumulation: accumulate adds the gradients of a micro-batch
+        # to one buffer per parameter, apply_gradients makes one RMSprop step
+        # with their mean and clears them
+        buffers = [theano.shared(p.get_value() * 0.) for p in params]
+        accumulate = theano.function(
             [x, y],
-            self.layers[-1].return_output(),
-            givens={self.drop: numpy.cast['int32'](0)}, on_unused_input='ignore'
-        )"""
+            cost,
+            updates=[(b, b + g) for b, g in zip(buffers, T.grad(cost, params))],
+            allow_input_downcast=True
+        )
 
-        # create a list of gradients for all model parameters
+        updates, accumulators = self._rms_prop_updates([b / num_micro_batches for b in buffers], params)
+        updates += [(b, T.zeros_like(b)) for b in buffers]
+        apply_gradients = theano.function([], [], updates=updates)
+
+        return {'accumulate': accumulate, 'apply_gradients': apply_gradients, 'buffers': buffers,
+                'params': params, 'accumulators': accumulators}
+
+    def _micro_batches(self, functions, num_micro_batches):
+        """train and test functions of a minibatch of num_micro_batches micro-batches"""
+        micro_batch_size = self.input_shape[0]
+
+        def split(batch_x, batch_y):
+            if len(batch_x) != num_micro_batches * micro_batch_size:
+                raise ValueError("minibatches must hold %d x %d examples, got %d" %
+                                 (num_micro_batches, micro_batch_size, len(batch_x)))
+            for start in xrange(0, len(batch_x), micro_batch_size):
+                yield batch_x[start:start + micro_batch_size], batch_y[start:start + micro_batch_size]
+
+        def train(batch_x, batch_y):
+            costs = [functions['accumulate'](x, y) for x, y in split(batch_x, batch_y)]
+            functions['apply_gradients']()
+            return numpy.mean(costs)
+        # the compiled function holding the random streams (models/checkpoint.py)
+        train.compiled = functions['accumulate']
+
+        def test(batch_x, batch_y):
+            return numpy.mean([functions['test'](x, y) for x, y in split(batch_x, batch_y)])
+
+        return train, test
+
+    def build_gradient_functions(self, y):
+        """
+        Splits the training step for data parallel training (models/data_parallel.py):
+            gradients(x, y) -> [cost] + the gradients of the parameters
+            apply_gradients(*gradients) -> None, the RMSprop update of train
+        and the test function. These are compiled, not cached.
+        """
+        x = self.layers[0].input
+        params = []
+        for layer in self.layers:
+            params += layer.params
+
+        cost = self._training_cost(y)
         grads = T.grad(cost, params)
+        gradients = theano.function([x, y], [cost] + grads, allow_input_downcast=True)
+
+        grad_inputs = [g.type() for g in grads]
+        updates, accumulators = self._rms_prop_updates(grad_inputs, params)
+        apply_gradients = theano.function(grad_inputs, [], updates=updates, allow_input_downcast=True)
+
+        test_model = theano.function([x, y], self.layers[-1].errors(y), allow_input_downcast=True)
+
+        self.accumulators = accumulators
+        return {'gradients': gradients, 'apply_gradients': apply_gradients, 'test': test_model,
+                'params': params, 'accumulators': accumulators}
+
+    def _bind_cached_params(self, params, cached_params):
+        """
+        Points the layers at the shared variables of the cached functions, with
+        this builder's initial values. Their expressions (output, train_output,
+        ...) are cloned on the cached variables too, in one clone so that each
+        layer's input stays the output of the layer before it.
+        """
+        replace = {}
+        for p, cached_p in zip(params, cached_params):
+            cached_p.set_value(p.get_value())
+            replace[p] = cached_p
+
+        expressions = []
+        for layer in self.layers:
+            layer.params = [replace.get(p, p) for p in layer.params]
+            for name, value in vars(layer).items():
+                if isinstance(value, theano.compile.SharedVariable):
+                    if value in replace:
+                        setattr(layer, name, replace[value])
+                elif isinstance(value, theano.Variable):
+                    expressions.append((layer, name, value))
+
+        cloned = theano.clone([value for layer, name, value in expressions], replace=replace)
+        for (layer, name, value), clone in zip(expressions, cloned):
+            setattr(layer, name, clone)
+
+    def _rebuild(self, input_shape):
+        """
+        The layers of this architecture built again on inputs of input_shape,
+        and the {new parameter: parameter of this builder} replacements that
+        put this builder's parameters in their graphs.
+        """
+        # the new layers draw initial values that are thrown away, leave the
+        # global random state as it was
+        random_state = numpy.random.get_state()
+        builder = ModelBuilder(input_shape, self.learning_rate)
+        for name, settings in self.architecture:
+            getattr(builder, ADD_METHODS[name])(**dict(settings))
+        numpy.random.set_state(random_state)
+
+        replace = {}
+        for layer, new_layer in zip(self.layers, builder.layers):
+            replace.update(zip(new_layer.params, layer.params))
+        return builder.layers, replace
+
+    def build_inference_model(self, y=None, batch_size=128, use_cache=True):
+        """
+        Compiles (or loads from the on disk function cache) inference functions
+        on the parameters of this model, for evaluation and serving at batch
+        sizes other than the training one:
+            predict(x) -> the output of the last layer
+            test(x, y) -> the errors, as the test function of build_model
+        Their layers take any batch size. Calls with more than batch_size
+        examples run batch_size examples at a time, which bounds the memory
+        of a call. Call after build_model, which may swap in cached parameters:
+        cached functions are copied onto the current ones.
+        """
+        params = []
+        for layer in self.layers:
+            params += layer.params
 
-        # train_model is a function that updates the model parameters by
-        # SGD Since this model has many parameters, it would be tedious to
-        # manually create an update rule for each model parameter. We thus
-        # create the updates list by automatically looping over all
-        # (params[i], grads[i]) pairs.
+        input_shape = (None,) + tuple(self.input_shape[1:])
+        layers, replace = self._rebuild(input_shape)
+        x = layers[0].input
+        last = layers[-1]
+
+        start_time = time.time()
+        key = function_cache.model_key(self.architecture, input_shape, y, ('inference',))
+
+        functions = function_cache.load(key) if use_cache else None
+        self.inference_cache_hit = functions is not None
+        if self.inference_cache_hit:
+            swap = dict(zip(functions['params'], params))
+            predict_output = _swap_shared(functions['predict'], swap)
+            test_errors = None
+            if functions['test'] is not None:
+                test_errors = _swap_shared(functions['test'], swap)
+        else:
+            predict_output = theano.function([x], theano.clone(last.output, replace=replace),
+                                             allow_input_downcast=True)
+            test_errors = None
+            if y is not None:
+                test_errors = theano.function([x, y], theano.clone(last.errors(y), replace=replace),
+                                              allow_input_downcast=True)
+            if use_cache:
+                function_cache.save(key, {'predict': predict_output, 'test': test_errors, 'params': params})
+        self.inference_build_time = time.time() - start_time
+
+        if self.inference_cache_hit:
+            print "loaded inference functions from cache in %.2fs (key %s)" % (self.inference_build_time, key[:12])
+        else:
+            print "compiled inference functions in %.2fs (key %s)" % (self.inference_build_time, key[:12])
 
-        #RMSprop
-        updates = []
-        for p, g in zip(params, grads):
-            MeanSquare = theano.shared(p.get_value() * 0.)
-            nextMeanSquare = 0.9 * MeanSquare + (1 - 0.9) * g ** 2
-            g = g / T.sqrt(nextMeanSquare + 0.000001)
-            updates.append((MeanSquare, nextMeanSquare))
-            updates.append((p, p - self.learning_rate * g))
+        def chunks(batch_x):
+            for start in xrange(0, len(batch_x), batch_size):
+                yield slice(start, start + batch_size)
 
+        def predict(batch_x):
+            return numpy.concatenate([predict_output(batch_x[s]) for s in chunks(batch_x)])
 
-        train_model = theano.function(
-            [x,y],
-            cost,
-            updates=updates,
-            givens={
+        def test(batch_x, batch_y):
+            # the errors are means over the examples of each call
+            errors = [test_errors(batch_x[s], batch_y[s]) * len(batch_x[s]) for s in chunks(batch_x)]
+            return numpy.sum(errors) / float(len(batch_x))
 
-                self.drop: numpy.cast['int32'](1)
+        if test_errors is None:
+            test = None
 
-            }, allow_input_downcast=True
-        )
+        return InferenceModel(predict=predict, test=test, batch_size=batch_size, layers=layers)
+
+    def build_model(self, y, use_cache=True, num_micro_batches=1, inference_batch_size=None):
+        """
+        Compiles (or loads from the on disk function cache) the train and test
+        functions. validate is the test function, the two were identical.
+
+        With an inference_batch_size, test and validate are instead the test
+        function of build_inference_model: they take any number of examples
+        and run up to inference_batch_size of them per call.
+
+        With num_micro_batches > 1 train and test take minibatches of
+        num_micro_batches times the batch size of input_shape, and train runs
+        them one micro-batch at a time, accumulating the gradients, before one
+        RMSprop step: the memory of a micro-batch (plus one gradient buffer per
+        parameter) for the update of the whole minibatch.
+        """
+
+        if num_micro_batches > 1 and self.input_shape[0] is None:
+            raise ValueError("gradient accumulation needs a fixed micro-batch size")
+
+        params = []
+        for layer in self.layers:
+            params += layer.params
+
+        start_time = time.time()
+        key = function_cache.model_key(self.architecture, self.input_shape, y,
+                                       ('rmsprop', self.learning_rate, RMS_PROP_DECAY, RMS_PROP_EPSILON, num_micro_batches))
+
+        functions = function_cache.load(key) if use_cache else None
+        self.cache_hit = functions is not None
+        if self.cache_hit:
+            self._bind_cached_params(params, functions['params'])
+            for accumulator in functions['accumulators'] + functions.get('buffers', []):
+                accumulator.set_value(accumulator.get_value() * 0.)
+        else:
+            functions = self._compile(y, params, num_micro_batches)
+            if use_cache:
+                function_cache.save(key, functions)
+
+        self.accumulators = functions['accumulators']
+        self.build_time = time.time() - start_time
+
+        print
+        if self.cache_hit:
+            print "loaded compiled functions from cache in %.2fs (key %s)" % (self.build_time, key[:12])
+        else:
+            print "compiled functions in %.2fs (key %s)" % (self.build_time, key[:12])
+
+        demonstrate_model = None
+
+        if num_micro_batches > 1:
+            train_model, test_model = self._micro_batches(functions, num_micro_batches)
+        else:
+            train_model, test_model = functions['train'], functions['test']
+
+        if inference_batch_size is not None:
+            test_model = self.build_inference_model(y, inference_batch_size, use_cache=use_cache).test
+
+        if tracing.enabled():
+            train_model = tracing.traced_function(train_model, "train")
+            test_model = tracing.traced_function(test_model, "test")
 
         return Model(train=train_model,
                      test=test_model,
-                     validate=validate_model,
+                     validate=test_model,
                      demonstrate=demonstrate_model,
-                     layers=self.layers)
+                     layers=self.layers,
+                     accumulators=self.accumulators)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,254 @@
+import json
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+#Forward pass of a model written by models/export_model.py, with numpy only (no
+#theano, no compilation), for serving trained completion and classification
+#models. Volumes are 5d BZCXY arrays as everywhere else, and every layer
+#follows the semantics of its theano counterpart:
+#   conv - ConvLayer3D: valid true convolution (conv3d2d), bias, relu, optional pooling
+#   deconv - DeconvLayer3D: transposed convolution cropped to upsample * input size
+#   pool - pool_3d: max or average pooling with stride, padding and partial windows
+#   dense - HiddenLayer / ReconLayer / LogisticRegression (dropout is training only)
+#   flatten / unflatten - reshapes
+#conv and dense layers written by models/quantize_model.py hold int8 weights
+#with a scale per output channel and run on int8 inputs with integer products.
+
+#im2col matrices are built a few examples at a time to bound memory
+MAX_IM2COL_ELEMENTS = 2 ** 24
+
+#int8 values are symmetric in [-INT8_MAX, INT8_MAX]
+INT8_MAX = 127
+
+#longest sum of int8 products that a float32 accumulator holds exactly (2 ** 24)
+INT8_EXACT_DEPTH = 2 ** 24 // INT8_MAX ** 2
+
+
+def softmax(x):
+    e = np.exp(x - x.max(axis=1, keepdims=True))
+    return e / e.sum(axis=1, keepdims=True)
+
+
+ACTIVATIONS = {
+    None: lambda x: x,
+    'relu': lambda x: np.maximum(x, 0),
+    'leaky_relu': lambda x: ((x + abs(x)) / 2.0) + 0.3 * ((x - abs(x)) / 2.0),
+    'sigmoid': lambda x: 1 / (1 + np.exp(-x)),
+    'tanh': np.tanh,
+    'softmax': softmax,
+}
+
+
+def int8_dot(a, b):
+    """
+    Integer matrix product of int8 arrays, as int32. numpy has no integer
+    GEMM, so the inner dimension is cut in pieces whose products sum exactly
+    in float32 and each piece is one BLAS call.
+    """
+    out = None
+    for start in xrange(0, a.shape[-1], INT8_EXACT_DEPTH):
+        part = np.dot(a[..., start:start + INT8_EXACT_DEPTH].astype(np.float32),
+                      b[start:start + INT8_EXACT_DEPTH].astype(np.float32)).astype(np.int32)
+        if out is None:
+            out = part
+        else:
+            out += part
+    return out
+
+
+def quantize(x, scale):
+    """int8 values of x for a scale (x ~= quantize(x, scale) * scale)."""
+    return np.clip(np.rint(x / scale), -INT8_MAX, INT8_MAX).astype(np.int8)
+
+
+def conv3d(signals, filters, max_im2col_elements=MAX_IM2COL_ELEMENTS, dot=np.dot, out_dtype=None):
+    """
+    Valid 3d convolution with the layout and (flipped kernel) semantics of
+    conv3d2d.conv3d, as im2col + one GEMM (dot) per chunk of examples.
+    signals (batch, z, c, x, y), filters (f, kz, c, kx, ky).
+    """
+    batch_size, zdim, nchannels, xdim, ydim = signals.shape
+    nfilters, kz, _, kx, ky = filters.shape
+    out_shape = (zdim - kz + 1, xdim - kx + 1, ydim - ky + 1)
+
+    # a true convolution is a correlation with the flipped kernel
+    kernel = np.ascontiguousarray(filters[:, ::-1, :, ::-1, ::-1].transpose(0, 2, 1, 3, 4)).reshape(nfilters, -1)
+    # BCZXY so that a window is (c, kz, kx, ky) with strides of the volume
+    volumes = np.ascontiguousarray(signals.transpose(0, 2, 1, 3, 4))
+    sb, sc, sz, sx, sy = volumes.strides
+
+    if out_dtype is None:
+        out_dtype = np.result_type(signals, filters)
+    out = np.empty((batch_size, nfilters) + out_shape, dtype=out_dtype)
+    col_length = nchannels * kz * kx * ky
+    num_windows = out_shape[0] * out_shape[1] * out_shape[2]
+    chunk = max(1, max_im2col_elements // (col_length * num_windows))
+    for start in xrange(0, batch_size, chunk):
+        part = volumes[start:start + chunk]
+        # (c, kz, kx, ky, examples, z, x, y) windows, copied into one im2col matrix
+        windows = as_strided(part, shape=(nchannels, kz, kx, ky, part.shape[0]) + out_shape,
+                             strides=(sc, sz, sx, sy, sb, sz, sx, sy))
+        cols = windows.reshape(col_length, part.shape[0] * num_windows)
+        res = dot(kernel, cols).reshape((nfilters, part.shape[0]) + out_shape)
+        out[start:start + chunk] = res.transpose(1, 0, 2, 3, 4)
+
+    return out.transpose(0, 2, 1, 3, 4)
+
+
+def transposed_conv3d(input, filters, upsample):
+    """
+    DeconvLayer3D without bias and activation: every input voxel adds its
+    filter-weighted kernel at upsample * its position (GEMM + col2im), then the
+    result is cropped to upsample * the input size.
+    """
+    batch_size, zdim, nchannels, xdim, ydim = input.shape
+    nfilters, kz, _, kx, ky = filters.shape
+
+    # (batch, z, x, y, f, kz, kx, ky) contributions in one GEMM
+    contributions = np.dot(input.transpose(0, 1, 3, 4, 2).reshape(-1, nchannels),
+                           filters.transpose(2, 0, 1, 3, 4).reshape(nchannels, -1))
+    contributions = contributions.reshape((batch_size, zdim, xdim, ydim, nfilters, kz, kx, ky))
+
+    full = np.zeros((batch_size, nfilters, (zdim - 1) * upsample + kz, (xdim - 1) * upsample + kx,
+                     (ydim - 1) * upsample + ky), dtype=contributions.dtype)
+    for az in xrange(kz):
+        for ax in xrange(kx):
+            for ay in xrange(ky):
+                full[:, :,
+                     az:az + (zdim - 1) * upsample + 1:upsample,
+                     ax:ax + (xdim - 1) * upsample + 1:upsample,
+                     ay:ay + (ydim - 1) * upsample + 1:upsample] += \
+                    contributions[..., az, ax, ay].transpose(0, 4, 1, 2, 3)
+
+    cz, cx, cy = [(k - upsample) // 2 for k in (kz, kx, ky)]
+    full = full[:, :, cz:cz + zdim * upsample, cx:cx + xdim * upsample, cy:cy + ydim * upsample]
+    return full.transpose(0, 2, 1, 3, 4)
+
+
+def pool_3d(input, output_shape, ds, st, padding=0, mode='max'):
+    """
+    pool_3d of layer_utils: the input is placed in a frame holding every window
+    exactly (padded with -inf for max, 0 for average) and the ds**3 strided views
+    of the frame are reduced.
+    """
+    spatial_axes = (1, 3, 4)
+    frame_shape = list(input.shape)
+    dst = [slice(None)] * 5
+    src = [slice(None)] * 5
+    for axis in spatial_axes:
+        frame_shape[axis] = (output_shape[axis] - 1) * st + ds
+        num_copied = min(input.shape[axis], frame_shape[axis] - padding)
+        dst[axis] = slice(padding, padding + num_copied)
+        src[axis] = slice(0, num_copied)
+
+    frame = np.empty(frame_shape, dtype=input.dtype)
+    frame.fill(-np.inf if mode == 'max' else 0)
+    frame[tuple(dst)] = input[tuple(src)]
+
+    if mode != 'max':
+        # the padding is not counted in averages
+        counts = np.zeros(frame_shape, dtype=input.dtype)
+        counts[tuple(dst)] = 1
+
+    out = None
+    count = None
+    for dz in xrange(ds):
+        for dx in xrange(ds):
+            for dy in xrange(ds):
+                window = [slice(None)] * 5
+                for axis, offset in zip(spatial_axes, (dz, dx, dy)):
+                    window[axis] = slice(offset, offset + (output_shape[axis] - 1) * st + 1, st)
+                values = frame[tuple(window)]
+                if mode == 'max':
+                    out = values.copy() if out is None else np.maximum(out, values, out=out)
+                elif out is None:
+                    out = values.copy()
+                    count = counts[tuple(window)].copy()
+                else:
+                    out += values
+                    count += counts[tuple(window)]
+
+    if mode == 'max':
+        return out
+    return out / count
+
+
+def forward_layer(record, weights, x):
+    layer_type = record['type']
+
+    if layer_type == 'conv':
+        if record.get('quantized') == 'int8':
+            out = conv3d(quantize(x, weights['input_scale']), weights['W'], dot=int8_dot, out_dtype=np.int32)
+            out = out.astype(x.dtype) * (weights['input_scale'] * weights['W_scale']).reshape(1, 1, -1, 1, 1)
+        else:
+            out = conv3d(x, weights['W'])
+        out = ACTIVATIONS[record['activation']](out + weights['b'].reshape(1, 1, -1, 1, 1))
+        if 'pool' in record:
+            out = forward_layer(dict(record['pool'], type='pool'), weights, out)
+        return out
+
+    if layer_type == 'deconv':
+        out = transposed_conv3d(x, weights['W'], record['upsample'])
+        return ACTIVATIONS[record['activation']](out + weights['b'].reshape(1, 1, -1, 1, 1))
+
+    if layer_type == 'pool':
+        output_shape = record['output_shape']
+        return pool_3d(x, output_shape, record['ds'], record['st'], record['padding'], record['mode'])
+
+    if layer_type == 'dense':
+        if record.get('quantized') == 'int8':
+            out = int8_dot(quantize(x, weights['input_scale']), weights['W']).astype(x.dtype)
+            out = out * (weights['input_scale'] * weights['W_scale'])
+        else:
+            out = np.dot(x, weights['W'])
+        return ACTIVATIONS[record['activation']](out + weights['b'])
+
+    if layer_type == 'flatten':
+        return x.reshape(x.shape[0], -1)
+
+    if layer_type == 'unflatten':
+        return x.reshape([x.shape[0]] + record['shape'])
+
+    raise ValueError("unknown layer type " + str(layer_type))
+
+
+class NumpyModel(object):
+
+    def __init__(self, architecture, weights):
+        self.architecture = architecture
+        self.layers = architecture['layers']
+        self.weights = []
+        for index in xrange(len(self.layers)):
+            prefix = "%d_" % index
+            self.weights.append(dict((name[len(prefix):], value) for name, value in weights.items()
+                                     if name.startswith(prefix)))
+        self.dtype = np.dtype(architecture.get('floatX', 'float32'))
+
+    @classmethod
+    def load(cls, filepath_prefix):
+        with open(filepath_prefix + ".json") as f:
+            architecture = json.load(f)
+        with np.load(filepath_prefix + ".npz") as npz:
+            weights = dict((name, npz[name]) for name in npz.files)
+        return cls(architecture, weights)
+
+    def save(self, filepath_prefix):
+        """Writes the model in the format of models/export_model.py."""
+        arrays = {}
+        for index, weights in enumerate(self.weights):
+            for name, value in weights.items():
+                arrays["%d_%s" % (index, name)] = value
+        np.savez(filepath_prefix + ".npz", **arrays)
+        with open(filepath_prefix + ".json", 'w') as f:
+            json.dump(self.architecture, f, indent=1)
+
+    def weight_bytes(self):
+        """Memory held by the weight matrices and filters."""
+        return sum(weights['W'].nbytes for weights in self.weights if 'W' in weights)
+
+    def predict(self, x):
+        """Output of the last layer for a batch (any batch size) of inputs."""
+        out = np.asarray(x, dtype=self.dtype)
+        for record, weights in zip(self.layers, self.weights):
+            out = forward_layer(record, weights, out)
+        return out
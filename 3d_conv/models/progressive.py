@@ -0,0 +1,177 @@
+import time
+import numpy
+import scipy.ndimage
+
+from layers.flatten_layer import FlattenLayer
+
+#Coarse to fine training: the first epochs run on inputs downscaled by a large
+#factor (downscale_3d), then the input grows stage by stage up to the target
+#resolution. Each stage builds its model at its resolution and starts from the
+#parameters of the previous stage (transfer_params):
+#   - convolution filters do not depend on the input size and are copied,
+#   - a dense layer after the flatten layer has one row per (z, channel, x, y)
+#     of the flattened feature maps; with dense='interpolate' its rows are
+#     resampled trilinearly to the new feature map size and scaled by the
+#     ratio of the sizes, so its pre-activations keep their magnitude; with
+#     dense='reinit' it keeps the fresh initialization of the new model,
+#   - a dense layer with one column per voxel of a cubic grid (a recon layer)
+#     has its columns resampled the same way,
+#   - any other parameter copies when its shape is unchanged, and keeps its
+#     fresh initialization otherwise.
+#
+#The schedule is a list of stages, coarse first, e.g. for 256^3 grids:
+#   [{'downsample_factor': 32, 'epochs': 10},
+#    {'downsample_factor': 16, 'epochs': 190}]
+#parse_schedule checks it, and with the input_size and the min_input_size of
+#the model (below which its layers have no voxel left) it rejects the stages
+#the model cannot be built at, before any of them is compiled.
+#
+#TimeToTarget records the wall clock time from the start of training to the
+#first validation error at or below a target, to compare a schedule with
+#training at the final resolution from the start (utils/benchmark_progressive.py).
+
+
+def parse_schedule(stages, input_size=None, min_input_size=1):
+    """
+    Checks a schedule (a list of dicts, or of (downsample_factor, epochs) pairs)
+    and returns it as dicts. With an input_size (the full resolution side), the
+    downscaled side of every stage has to be a whole number of voxels and at
+    least min_input_size.
+    """
+    schedule = []
+    for stage in stages:
+        if not isinstance(stage, dict):
+            stage = {'downsample_factor': stage[0], 'epochs': stage[1]}
+        if stage['epochs'] < 1:
+            raise ValueError("a stage needs at least one epoch: %s" % (stage,))
+        if input_size is not None:
+            factor = stage['downsample_factor']
+            if input_size % factor != 0:
+                raise ValueError("downsample_factor: %i does not divide the input size %i" % (factor, input_size))
+            if input_size / factor < min_input_size:
+                raise ValueError("downsample_factor: %i leaves %i^3 inputs, the model needs at least %i^3" %
+                                 (factor, input_size / factor, min_input_size))
+        if schedule and stage['downsample_factor'] > schedule[-1]['downsample_factor']:
+            raise ValueError("stages go from coarse to fine, %i comes after %i" %
+                             (stage['downsample_factor'], schedule[-1]['downsample_factor']))
+        schedule.append(dict(stage))
+    if not schedule:
+        raise ValueError("the schedule has no stage")
+    return schedule
+
+
+def resample(values, axes, new_sizes):
+    """values with the given axes resampled (trilinear interpolation) to new_sizes."""
+    zoom = [1.] * values.ndim
+    for axis, new_size in zip(axes, new_sizes):
+        zoom[axis] = new_size / float(values.shape[axis])
+    resampled = scipy.ndimage.zoom(values.astype(numpy.float64), zoom, order=1, mode='nearest')
+    # zoom rounds the output shape
+    for axis, new_size in zip(axes, new_sizes):
+        assert resampled.shape[axis] == new_size
+    return resampled.astype(values.dtype)
+
+
+def _cube_side(n):
+    side = int(round(n ** (1 / 3.)))
+    if side ** 3 == n:
+        return side
+    return None
+
+
+def _transfer_dense(W, b, new_W, new_b, source_grid, target_grid, dense):
+    """
+    The (W, b) of a dense layer of the target model, from the source ones.
+    source_grid and target_grid are the (z, channels, x, y) of the flattened
+    inputs, or None when the input is not a flattened grid.
+    """
+    if dense == 'reinit':
+        return None
+
+    n_in, n_out = W.shape
+    new_n_in, new_n_out = new_W.shape
+    if n_in != new_n_in:
+        if source_grid is None or target_grid is None or source_grid[1] != target_grid[1]:
+            return None
+        grid_W = W.reshape(tuple(source_grid) + (n_out,))
+        z, channels, x, y = target_grid
+        grid_W = resample(grid_W, (0, 2, 3), (z, x, y))
+        # as many times fewer inputs, each carrying as many times more of the sum
+        W = grid_W.reshape(new_n_in, n_out) * (float(n_in) / new_n_in)
+
+    if n_out != new_n_out:
+        side, new_side = _cube_side(n_out), _cube_side(new_n_out)
+        if side is None or new_side is None:
+            return None
+        W = resample(W.reshape(new_n_in, side, side, side), (1, 2, 3),
+                     (new_side,) * 3).reshape(new_n_in, new_n_out)
+        b = resample(b.reshape(side, side, side), (0, 1, 2), (new_side,) * 3).ravel()
+
+    return W, b
+
+
+def transfer_params(source_layers, target_layers, dense='interpolate'):
+    """
+    Sets the parameters of target_layers (the same architecture at another
+    resolution) from those of source_layers. Returns a list of (layer index,
+    'copied' | 'interpolated' | 'reinitialized') for the layers with parameters.
+    """
+    if dense not in ('interpolate', 'reinit'):
+        raise ValueError("dense: %s must be interpolate or reinit" % dense)
+    if len(source_layers) != len(target_layers):
+        raise ValueError("the models have %i and %i layers" % (len(source_layers), len(target_layers)))
+
+    report = []
+    for i, (source, target) in enumerate(zip(source_layers, target_layers)):
+        if type(source) is not type(target):
+            raise ValueError("layer %i is a %s and a %s" % (i, type(source).__name__, type(target).__name__))
+        if not target.params:
+            continue
+
+        values = [p.get_value() for p in source.params]
+        if all(v.shape == p.get_value(borrow=True).shape for v, p in zip(values, target.params)):
+            for p, v in zip(target.params, values):
+                p.set_value(v)
+            report.append((i, 'copied'))
+            continue
+
+        transferred = None
+        if len(values) == 2 and values[0].ndim == 2:
+            source_grid = target_grid = None
+            if i > 0 and isinstance(source_layers[i - 1], FlattenLayer):
+                source_grid = source_layers[i - 1].input_shape[1:]
+                target_grid = target_layers[i - 1].input_shape[1:]
+            new_W, new_b = [p.get_value(borrow=True) for p in target.params]
+            transferred = _transfer_dense(values[0], values[1], new_W, new_b, source_grid, target_grid, dense)
+
+        if transferred is None:
+            report.append((i, 'reinitialized'))
+        else:
+            for p, v in zip(target.params, transferred):
+                p.set_value(v.astype(p.dtype))
+            report.append((i, 'interpolated'))
+    return report
+
+
+class TimeToTarget(object):
+
+    def __init__(self, target_error, start_time=None):
+        self.target_error = target_error
+        self.start_time = time.time() if start_time is None else start_time
+        self.time = None
+        self.iteration = None
+
+    def update(self, iteration, validation_error):
+        """Records the first validation error at or below the target, returns True once it is reached."""
+        if self.time is None and self.target_error is not None and validation_error <= self.target_error:
+            self.time = time.time() - self.start_time
+            self.iteration = iteration
+        return self.time is not None
+
+    def summary(self):
+        if self.target_error is None:
+            return "no target validation error"
+        if self.time is None:
+            return "target validation error %.2f%% not reached" % (self.target_error * 100.)
+        return "target validation error %.2f%% reached after %.1fs (iteration %i)" % (
+            self.target_error * 100., self.time, self.iteration)
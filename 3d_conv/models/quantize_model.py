@@ -0,0 +1,109 @@
+import numpy as np
+
+from layers.layer_utils import numpy_jaccard_similarity
+from models import numpy_model
+from models.numpy_model import INT8_MAX, NumpyModel, forward_layer
+
+#Post-training int8 quantization of an exported model (models/export_model.py)
+#for the numpy engine. The weights of the conv (ConvLayer3D) and dense
+#(HiddenLayer, ReconLayer) layers become int8 with one scale per output
+#channel, and the input of each of these layers is quantized with a scale
+#calibrated on a few batches of a dataset iterator. Deconv layers and biases
+#stay in floating point.
+#
+#usage:
+#   model = NumpyModel.load("completion_24")
+#   quantized = quantize_model(model, calibrate(model, dataset.iterator(batch_size=10)))
+#   print_report(accuracy_report(model, quantized, dataset.iterator(batch_size=10)))
+#   quantized.save("completion_24_int8")
+
+QUANTIZED_TYPES = ('conv', 'dense')
+
+#output channel axis of the weights of each quantized layer type
+CHANNEL_AXES = {'conv': 0, 'dense': 1}
+
+
+def quantize_per_channel(W, axis):
+    """(int8 weights, float32 scale per channel of axis) with W ~= q * scale."""
+    reduce_axes = tuple(a for a in xrange(W.ndim) if a != axis)
+    max_abs = np.abs(W).max(axis=reduce_axes)
+    scale = (np.where(max_abs > 0, max_abs, 1) / INT8_MAX).astype(np.float32)
+    shape = [1] * W.ndim
+    shape[axis] = -1
+    return numpy_model.quantize(W, scale.reshape(shape)), scale
+
+
+def calibrate(model, iterator, num_batches=10, percentile=100.0):
+    """
+    Range of the input of every conv and dense layer of model over num_batches
+    batches of iterator, as {layer index: range}. The range of a batch is its
+    largest absolute value, or that percentile of the absolute values to clip
+    outliers.
+    """
+    ranges = {}
+    for i in xrange(num_batches):
+        batch_x, batch_y = iterator.next()
+        out = np.asarray(batch_x, dtype=model.dtype)
+        for index, (record, weights) in enumerate(zip(model.layers, model.weights)):
+            if record['type'] in QUANTIZED_TYPES:
+                if percentile >= 100:
+                    batch_range = np.abs(out).max()
+                else:
+                    batch_range = np.percentile(np.abs(out), percentile)
+                ranges[index] = max(ranges.get(index, 0), float(batch_range))
+            out = forward_layer(record, weights, out)
+    return ranges
+
+
+def quantize_model(model, input_ranges):
+    """The int8 NumpyModel of model for the input ranges returned by calibrate."""
+    layers = []
+    weights = {}
+    for index, (record, arrays) in enumerate(zip(model.layers, model.weights)):
+        record = dict(record)
+        arrays = dict(arrays)
+        if record['type'] in QUANTIZED_TYPES:
+            arrays['W'], arrays['W_scale'] = quantize_per_channel(arrays['W'], CHANNEL_AXES[record['type']])
+            input_range = input_ranges[index] if input_ranges[index] > 0 else 1
+            arrays['input_scale'] = np.float32(input_range / INT8_MAX)
+            record['quantized'] = 'int8'
+        layers.append(record)
+        for name, value in arrays.items():
+            weights["%d_%s" % (index, name)] = value
+
+    return NumpyModel(dict(model.architecture, layers=layers), weights)
+
+
+def accuracy_report(model, quantized, iterator, num_batches=10, threshold=0.5):
+    """
+    Jaccard similarity of the thresholded outputs of the float and the int8
+    model with the targets of num_batches batches of iterator, their agreement
+    with each other, and the memory held by the weights.
+    """
+    float_scores = []
+    int8_scores = []
+    agreements = []
+    for i in xrange(num_batches):
+        batch_x, batch_y = iterator.next()
+        expected = (model.predict(batch_x) > threshold).astype(np.float32)
+        out = (quantized.predict(batch_x) > threshold).astype(np.float32)
+        target = (np.asarray(batch_y) > threshold).astype(np.float32)
+        float_scores.append(numpy_jaccard_similarity(expected, target))
+        int8_scores.append(numpy_jaccard_similarity(out, target))
+        agreements.append(numpy_jaccard_similarity(out, expected))
+
+    return {
+        'float_jaccard': float(np.mean(float_scores)),
+        'int8_jaccard': float(np.mean(int8_scores)),
+        'agreement_jaccard': float(np.mean(agreements)),
+        'float_weight_bytes': model.weight_bytes(),
+        'int8_weight_bytes': quantized.weight_bytes(),
+    }
+
+
+def print_report(report):
+    print "jaccard similarity with the targets: float %.4f, int8 %.4f (int8 vs float %.4f)" % (
+        report['float_jaccard'], report['int8_jaccard'], report['agreement_jaccard'])
+    print "weights: float %.1fMB, int8 %.1fMB (%.1fx smaller)" % (
+        report['float_weight_bytes'] / 2.0 ** 20, report['int8_weight_bytes'] / 2.0 ** 20,
+        float(report['float_weight_bytes']) / report['int8_weight_bytes'])
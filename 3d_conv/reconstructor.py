@@ -29,6 +29,7 @@ from layers.hidden_layer import *
 from layers.conv_layer_3d import *
 from layers.layer_utils import *
 from layers.layer_utils import downscale_3d
+from models.async_evaluator import AsyncEvaluator, update_early_stopping
 
 
 from matplotlib import pyplot as plt
@@ -131,7 +132,7 @@ class reconLayer(object):
 
 def evaluate(learning_rate=0.001, n_epochs=200,
                     dataset='mnist.pkl.gz',
-                    nkerns=[20, 30], batch_size=32):
+                    nkerns=[20, 30], batch_size=32, report=None):
     """ Demonstrates lenet on MNIST dataset
 
     :type learning_rate: float
@@ -146,6 +147,13 @@ def evaluate(learning_rate=0.001, n_epochs=200,
 
     :type nkerns: list of ints
     :param nkerns: number of kernels on each layer
+
+    :type report: callable or None
+    :param report: called with (iteration, validation loss) at every
+                   validation, training stops when it returns False
+                   (the channel.report of utils/sweep.py)
+
+    Returns (best validation loss, its iteration, its test score).
     """
 
     rng = numpy.random.RandomState(23455)
@@ -351,6 +359,20 @@ def evaluate(learning_rate=0.001, n_epochs=200,
 
     epoch_count = 0
 
+    def batches(dataset, num_batches):
+        iterator = dataset.iterator(batch_size=batch_size,
+                                    num_batches=num_batches,
+                                    mode='even_shuffled_sequential', type='default')
+        for i in xrange(num_batches):
+            yield iterator.next()
+
+    # validation and test run in a background process on snapshots of the
+    # parameters, their results arrive a few minibatches later
+    evaluator = AsyncEvaluator(params, validate_model, test_model,
+                               lambda: batches(validation_dataset, n_valid_batches),
+                               lambda: batches(test_dataset, n_test_batches))
+    best = (best_validation_loss, best_iter, test_score)
+
     while (epoch_count < n_epochs) and (not done_looping):
 
         epoch_count += 1
@@ -382,38 +404,14 @@ def evaluate(learning_rate=0.001, n_epochs=200,
 
             if (mini_batch_count + 1) % validation_frequency == 0:
 
-                validation_iterator = validation_dataset.iterator(batch_size=batch_size,
-                                                                  num_batches=n_valid_batches,
-                                                                  mode='even_shuffled_sequential', type = 'default')
-
-                # compute zero-one loss on validation set
-                validation_losses = 0
-
-                demo_x = 0
-                demo_y = 0
-                for i in xrange(n_valid_batches):
-                    mini_batch_x, mini_batch_y = validation_iterator.next()
-
-                    #mini_batch_x = downscale_3d(mini_batch_x, downsample_factor)
-                    #mini_batch_y = downscale_3d(mini_batch_y, downsample_factor)
-
-                    validation_losses += validate_model(mini_batch_x, mini_batch_y)
-                    if i == 0:
-                        demo_x = mini_batch_x
-                        demo_y = mini_batch_y
-
-                this_validation_loss = validation_losses/n_valid_batches
-
                 print "training cost: ", cost_ij
-                print('epoch %i, minibatch %i/%i, validation error %f %%' %
-                      (epoch_count, minibatch_index + 1, n_train_batches,
-                       this_validation_loss * 100.))
-
+                evaluator.submit(mini_batch_count)
 
                 # get 1 example for demonstrating the model:
-
-
                 if epoch_count > 0:
+                    validation_iterator = validation_dataset.iterator(batch_size=batch_size,
+                                                                      num_batches=1,
+                                                                      mode='even_shuffled_sequential', type = 'default')
                     mini_batch_x, mini_batch_y = validation_iterator.next()
                     #mini_batch_x = downscale_3d(mini_batch_x, downsample_factor)
                     #mini_batch_y = downscale_3d(mini_batch_y, downsample_factor)
@@ -448,52 +446,26 @@ def evaluate(learning_rate=0.001, n_epochs=200,
                         output = open("../reconData/firstrun/shapes%depoch%d.pkl" % (epoch_count, i), 'wb')
                         cPickle.dump(toSave,output)
                         output.close()
+
+            for result in evaluator.poll():
                 f = open("../reconData/firstrun/firstrunlog.txt", "a")
-                toOutput = "%i %f %f\n" % (epoch_count, cost_ij, this_validation_loss)
+                toOutput = "%i %f %f\n" % (epoch_count, cost_ij, result.validation_loss)
                 f.write(toOutput)
                 f.close()
 
+                best, patience = update_early_stopping(result, best, patience, patience_increase,
+                                                       improvement_threshold)
+                if report is not None and not report(result.iteration, result.validation_loss):
+                    done_looping = True
 
-
-                # if we got the best validation score until now
-                if this_validation_loss < best_validation_loss:
-
-                    #improve patience if loss improvement is good enough
-                    if this_validation_loss < best_validation_loss *  \
-                       improvement_threshold:
-                        patience = max(patience, mini_batch_count * patience_increase)
-
-                    # save best validation score and iteration number
-                    best_validation_loss = this_validation_loss
-                    best_iter = mini_batch_count
-
-                    # test it on the test set
-                    test_losses = 0
-
-                    test_iterator = test_dataset.iterator(batch_size=batch_size,
-                                                      num_batches=n_test_batches,
-                                                      mode='even_shuffled_sequential', type='default')
-
-
-
-                    for j in xrange(n_test_batches):
-                        batch_x, batch_y = test_iterator.next()
-                        #batch_x = downscale_3d(batch_x, downsample_factor)
-                        #batch_y = downscale_3d(batch_y, downsample_factor)
-
-                        test_losses += test_model(batch_x, batch_y)
-                        test_score = test_losses/n_test_batches
-
-
-                    print(('     epoch %i, minibatch %i/%i, test error of '
-                           'best model %f %%') %
-                          (epoch_count, minibatch_index + 1, n_train_batches,
-                           test_score * 100.))
-
-            if patience <= mini_batch_count:
+            if done_looping or patience <= mini_batch_count:
                 done_looping = True
                 break
 
+    for result in evaluator.close():
+        best, patience = update_early_stopping(result, best, patience, patience_increase, improvement_threshold)
+    best_validation_loss, best_iter, test_score = best
+
     end_time = time.clock()
     print('Optimization complete.')
     print('Best validation score of %f %% obtained at iteration %i, '
@@ -502,10 +474,16 @@ def evaluate(learning_rate=0.001, n_epochs=200,
     print >> sys.stderr, ('The code for file ' +
                           os.path.split(__file__)[1] +
                           ' ran for %.2fm' % ((end_time - start_time) / 60.))
+    return best_validation_loss, best_iter, test_score
 
 if __name__ == '__main__':
     evaluate()
 
 
 def experiment(state, channel):
-    evaluate(state.learning_rate, dataset=state.dataset)
+    # the other arguments of evaluate that the state sets (e.g. swept by utils/sweep.py)
+    kwargs = dict((name, state[name]) for name in ('n_epochs', 'nkerns', 'batch_size') if name in state)
+    state.score, state.best_iter, state.test_score = evaluate(state.learning_rate, dataset=state.dataset,
+                                                              report=getattr(channel, 'report', None),
+                                                              **kwargs)
+    return channel.COMPLETE
@@ -18,6 +18,10 @@ from layers.conv_layer_3d import *
 from layers.layer_utils import *
 from layers.recon_layer import *
 from models.conv_hidden_classifier import *
+from models.async_evaluator import AsyncEvaluator, update_early_stopping
+from models.checkpoint import Checkpointer, random_streams
+from models.progressive import TimeToTarget, parse_schedule, transfer_params
+from utils.telemetry import TrainingTelemetry, timed
 
 ########################################
 #Settings
@@ -36,6 +40,16 @@ n_valid_batches = 5
 n_test_batches = 5
 batch_size = 6
 
+# the model trains on micro-batches of batch_size examples and makes one update
+# per num_micro_batches of them (gradient accumulation), so every minibatch
+# holds batch_size * num_micro_batches examples
+num_micro_batches = 1
+
+# validation and test run through inference functions taking any batch size,
+# up to inference_batch_size examples per call: their minibatches are grouped
+# into batches of about that size
+inference_batch_size = 128
+
 # early-stopping parameters
 # look as this many examples regardless
 initial_patience = 10000
@@ -48,11 +62,34 @@ patience_increase = 2
 # considered significant
 improvement_threshold = 0.995
 
+# checkpoints written at the end of every epoch, a run started again resumes
+# from the latest one
+checkpoint_dir = 'checkpoints'
+
+# one json line per minibatch with its time breakdown and throughput
+telemetry_file = 'telemetry.jsonl'
+
+# coarse to fine training (models/progressive.py): (downsample_factor, epochs)
+# stages trained in order before the remaining epochs at downsample_factor,
+# e.g. ((32, 10),) for 10 epochs on 8^3 inputs before the 16^3 ones (the two
+# valid 3^3 convolutions need inputs of at least 5^3). The dense layers of a
+# stage are 'interpolate'd from the previous stage or 'reinit'ialized
+progressive_schedule = ()
+progressive_dense = 'interpolate'
+
+# the wall clock time to the first validation error at or below it, at the
+# final resolution, is reported
+target_validation_error = None
+
 
 def train(model,
           train_dataset,
           test_dataset,
-          validation_dataset):
+          validation_dataset,
+          downsample_factor=downsample_factor,
+          n_epochs=n_epochs,
+          checkpoint_dir=checkpoint_dir,
+          time_to_target=None):
 
     patience = initial_patience
 
@@ -74,12 +111,52 @@ def train(model,
 
     categories = train_dataset.get_categories()
 
+    def batches(dataset, num_batches):
+        # the iterator reads full resolution minibatches of the training
+        # size, the inference functions get them downscaled and grouped
+        iterator = dataset.iterator(batch_size=batch_size * num_micro_batches,
+                                    num_batches=num_batches,
+                                    mode='even_shuffled_sequential', type='classify')
+        group_x, group_y = [], []
+        for i in xrange(num_batches):
+            batch_x, batch_y = iterator.next(categories)
+            group_x.append(downscale_3d(batch_x, downsample_factor))
+            group_y.append(batch_y)
+            if sum(len(x) for x in group_x) >= inference_batch_size or i == num_batches - 1:
+                yield numpy.concatenate(group_x), numpy.concatenate(group_y)
+                group_x, group_y = [], []
+
+    # validation and test run in a background process on snapshots of the
+    # parameters, their results arrive a few minibatches later
+    params = []
+    for layer in model.layers:
+        params += layer.params
+    evaluator = AsyncEvaluator(params, model.validate, model.test,
+                               lambda: batches(validation_dataset, n_valid_batches),
+                               lambda: batches(test_dataset, n_test_batches))
+
+    best = (best_validation_loss, best_iter, test_score)
+
+    telemetry = TrainingTelemetry(telemetry_file)
+    checkpointer = Checkpointer(checkpoint_dir, params, model.accumulators, random_streams(model.train))
+    state = checkpointer.restore()
+    if state is not None:
+        epoch_count = state['epoch']
+        patience = state['patience']
+        best = state['best']
+        # a run that stopped early (patience) is not trained any further
+        done_looping = state.get('stopped', False)
+        if done_looping:
+            print '... stopped early at iteration %i, nothing to resume' % state['iteration']
+        else:
+            print '... resuming after epoch %i (iteration %i)' % (epoch_count, state['iteration'])
+
     while (epoch_count < n_epochs) and (not done_looping):
 
         epoch_count += 1
 
 
-        train_iterator = train_dataset.iterator(batch_size=batch_size,
+        train_iterator = train_dataset.iterator(batch_size=batch_size * num_micro_batches,
                                                 num_batches=n_train_batches,
                                                 mode='even_shuffled_sequential', type='classify')
 
@@ -87,86 +164,56 @@ def train(model,
 
             mini_batch_count = (epoch_count - 1) * n_train_batches + minibatch_index
 
-            if mini_batch_count % 100 == 0:
-                print 'training @ iter = ', mini_batch_count
-
-            mini_batch_x, mini_batch_y = train_iterator.next(categories)
-
-            mini_batch_x = downscale_3d(mini_batch_x, downsample_factor)
-
-            cost_ij = model.train(mini_batch_x, mini_batch_y)
-
-            if (mini_batch_count + 1) % validation_frequency == 0:
+            telemetry.start_step()
 
-                validation_iterator = validation_dataset.iterator(batch_size=batch_size,
-                                                                  num_batches=n_valid_batches,
-                                                                  mode='even_shuffled_sequential', type = 'classify')
+            with timed('data_wait'):
+                mini_batch_x, mini_batch_y = train_iterator.next(categories)
 
-                # compute zero-one loss on validation set
-                validation_losses = 0
+            with timed('assembly'):
+                mini_batch_x = downscale_3d(mini_batch_x, downsample_factor)
 
-                demo_x = 0
-                demo_y = 0
-                for i in xrange(n_valid_batches):
-                    mini_batch_x, mini_batch_y = validation_iterator.next(categories)
-                    mini_batch_x = downscale_3d(mini_batch_x, downsample_factor)
+            with timed('host_copy'):
+                mini_batch_x = numpy.ascontiguousarray(mini_batch_x, dtype=numpy.float32)
+                mini_batch_y = numpy.ascontiguousarray(mini_batch_y, dtype=numpy.int32)
 
+            with timed('compute'):
+                cost_ij = model.train(mini_batch_x, mini_batch_y)
 
-                    validation_losses += model.validate(mini_batch_x, mini_batch_y)
-                    if i == 0:
-                        demo_x = mini_batch_x
-                        demo_y = mini_batch_y
+            record = telemetry.end_step(mini_batch_count, len(mini_batch_x), mini_batch_x[0].size,
+                                        cost=float(cost_ij))
 
-                this_validation_loss = validation_losses/n_valid_batches
+            if mini_batch_count % 100 == 0:
+                print 'training @ iter = ', mini_batch_count
+                print telemetry.summary(record)
 
+            if (mini_batch_count + 1) % validation_frequency == 0:
                 print "training cost: ", cost_ij
-                print('epoch %i, minibatch %i/%i, validation error %f %%' %
-                      (epoch_count, minibatch_index + 1, n_train_batches,
-                       this_validation_loss * 100.))
-
-
-                # get 1 example for demonstrating the model:
-
-
-
-
-
-                # if we got the best validation score until now
-                if this_validation_loss < best_validation_loss:
-
-                    #improve patience if loss improvement is good enough
-                    if this_validation_loss < best_validation_loss *  \
-                       improvement_threshold:
-                        patience = max(patience, mini_batch_count * patience_increase)
-
-                    # save best validation score and iteration number
-                    best_validation_loss = this_validation_loss
-                    best_iter = mini_batch_count
-
-                    # test it on the test set
-                    test_losses = 0
-
-                    test_iterator = test_dataset.iterator(batch_size=batch_size,
-                                                      num_batches=n_test_batches,
-                                                      mode='even_shuffled_sequential', type='classify')
-
-                    for j in xrange(n_test_batches):
-                        batch_x, batch_y = test_iterator.next(categories)
-                        batch_x = downscale_3d(batch_x, downsample_factor)
-
-                        test_losses += model.test(batch_x, batch_y)
-                        test_score = test_losses/n_test_batches
-
-                    print(('     epoch %i, minibatch %i/%i, test error of '
-                           'best model %f %%') %
-                          (epoch_count, minibatch_index + 1, n_train_batches,
-                           test_score * 100.))
-
+                evaluator.submit(mini_batch_count)
+                # a checkpoint of the parameters being validated, which their
+                # score goes to (keep_best). Resuming from it runs its epoch again
+                checkpointer.save(mini_batch_count, epoch=epoch_count - 1, patience=patience, best=best)
+
+            for result in evaluator.poll():
+                best, patience = update_early_stopping(result, best, patience, patience_increase,
+                                                       improvement_threshold)
+                checkpointer.set_score(result.iteration, result.validation_loss)
+                if time_to_target is not None:
+                    time_to_target.update(result.iteration, result.validation_loss)
 
             if patience <= mini_batch_count:
                 done_looping = True
                 break
 
+        checkpointer.save(mini_batch_count, epoch=epoch_count, patience=patience, best=best, stopped=done_looping)
+
+    for result in evaluator.close():
+        best, patience = update_early_stopping(result, best, patience, patience_increase, improvement_threshold)
+        checkpointer.set_score(result.iteration, result.validation_loss)
+        if time_to_target is not None:
+            time_to_target.update(result.iteration, result.validation_loss)
+    checkpointer.close()
+    telemetry.close()
+    best_validation_loss, best_iter, test_score = best
 
     end_time = time.clock()
     print('Optimization complete.')
@@ -176,6 +223,7 @@ def train(model,
     print >> sys.stderr, ('The code for file ' +
                           os.path.split(__file__)[1] +
                           ' ran for %.2fm' % ((end_time - start_time) / 60.))
+    return best
 
 
 if __name__ == "__main__":
@@ -186,13 +234,40 @@ if __name__ == "__main__":
     test_dataset = ModelNetDataset(models_dir, patch_size, dataset_type='test')
     validation_dataset = ModelNetDataset(models_dir, patch_size, dataset_type='train')
 
-    model_config = ConvHiddenClassifyModelConfig(batch_size=batch_size,
-                                                 downsample_factor=downsample_factor,
-                                                 xdim=xdim,
-                                                 ydim=ydim,
-                                                 zdim=zdim)
-
-    model = model_config.build_model()
-
-
-    train(model, train_dataset, test_dataset, validation_dataset)
+    final_epochs = n_epochs - sum(epochs for factor, epochs in progressive_schedule)
+    schedule = parse_schedule(list(progressive_schedule) + [(downsample_factor, final_epochs)],
+                              input_size=min(xdim, ydim, zdim),
+                              min_input_size=ConvHiddenClassifyModelConfig().min_input_size())
+    time_to_target = TimeToTarget(target_validation_error)
+
+    previous_model = None
+    for stage_index, stage in enumerate(schedule):
+        model_config = ConvHiddenClassifyModelConfig(batch_size=batch_size,
+                                                     num_micro_batches=num_micro_batches,
+                                                     inference_batch_size=inference_batch_size,
+                                                     downsample_factor=stage['downsample_factor'],
+                                                     xdim=xdim,
+                                                     ydim=ydim,
+                                                     zdim=zdim)
+
+        model = model_config.build_model()
+        if previous_model is not None:
+            for layer_index, how in transfer_params(previous_model.layers, model.layers, progressive_dense):
+                print "layer %i %s" % (layer_index, how)
+
+        stage_checkpoint_dir = checkpoint_dir
+        if len(schedule) > 1:
+            stage_checkpoint_dir = os.path.join(checkpoint_dir, "stage_%i" % stage_index)
+            print "... stage %i: %i^3 inputs for %i epochs" % (stage_index, xdim / stage['downsample_factor'],
+                                                              stage['epochs'])
+
+        # only the errors of the final resolution count toward the target
+        final_stage = stage_index == len(schedule) - 1
+        train(model, train_dataset, test_dataset, validation_dataset,
+              downsample_factor=stage['downsample_factor'],
+              n_epochs=stage['epochs'],
+              checkpoint_dir=stage_checkpoint_dir,
+              time_to_target=time_to_target if final_stage else None)
+        previous_model = model
+
+    print time_to_target.summary()
@@ -0,0 +1,57 @@
+
+import sys
+import time
+import numpy
+import theano.tensor as T
+
+from layers.layer_utils import relu
+from models.data_parallel import DataParallelTrainer
+from models.model_builder import ModelBuilder
+
+#Training throughput of DataParallelTrainer for 1, 2, 4, ... workers at a fixed
+#global batch size. Set OMP_NUM_THREADS=1 to measure scaling over processes
+#rather than over BLAS threads.
+#
+#usage: python benchmark_data_parallel.py [max_workers [num_steps]]
+
+BATCH_SIZE = 16
+PATCH_SIZE = 32
+
+
+def build_model(batch_size):
+    mb = ModelBuilder((batch_size, PATCH_SIZE, 1, PATCH_SIZE, PATCH_SIZE))
+    mb.add_conv_layer((16, 5, 1, 5, 5))
+    mb.add_max_pool_layer(2)
+    mb.add_conv_layer((32, 3, 16, 3, 3))
+    mb.add_max_pool_layer(2)
+    mb.add_flatten_layer()
+    mb.add_hidden_layer(1000, relu)
+    mb.add_recon_layer(24 ** 3, T.nnet.sigmoid)
+    return mb
+
+
+if __name__ == '__main__':
+
+    max_workers = 4
+    num_steps = 10
+    if len(sys.argv) > 1:
+        max_workers = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        num_steps = int(sys.argv[2])
+
+    x = (numpy.random.rand(BATCH_SIZE, PATCH_SIZE, 1, PATCH_SIZE, PATCH_SIZE) > .9).astype(numpy.float32)
+    y = (numpy.random.rand(BATCH_SIZE, 24 ** 3) > .9).astype(numpy.float32)
+
+    num_workers = 1
+    while num_workers <= max_workers:
+        trainer = DataParallelTrainer(build_model(BATCH_SIZE / num_workers), T.matrix('y'), num_workers)
+        try:
+            trainer.train(x, y)
+            start_time = time.time()
+            for i in xrange(num_steps):
+                trainer.train(x, y)
+            elapsed = time.time() - start_time
+        finally:
+            trainer.close()
+        print "%d workers: %.1f examples/s" % (num_workers, num_steps * BATCH_SIZE / elapsed)
+        num_workers *= 2
@@ -0,0 +1,73 @@
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+import numpy
+import theano
+import theano.tensor as T
+
+from layers.layer_utils import relu
+from models import numpy_model
+from models.export_model import export_model
+from models.model_builder import ModelBuilder
+
+#Compares serving a completion model with theano (compile, then run) and with
+#the numpy engine (load the export, then run).
+#
+#usage: python benchmark_numpy_model.py [num_repeats]
+
+BATCH_SIZE = 10
+PATCH_SIZE = 32
+
+
+def build_model():
+    mb = ModelBuilder((BATCH_SIZE, PATCH_SIZE, 1, PATCH_SIZE, PATCH_SIZE))
+    mb.add_conv_layer((16, 5, 1, 5, 5))
+    mb.add_max_pool_layer(2)
+    mb.add_conv_layer((32, 3, 16, 3, 3))
+    mb.add_max_pool_layer(2)
+    mb.add_flatten_layer()
+    mb.add_hidden_layer(1000, relu)
+    mb.add_recon_layer(24 ** 3, T.nnet.sigmoid)
+    return mb
+
+
+def time_calls(f, x, num_repeats):
+    start_time = time.time()
+    for i in xrange(num_repeats):
+        f(x)
+    return (time.time() - start_time) / num_repeats
+
+
+if __name__ == '__main__':
+
+    num_repeats = 10
+    if len(sys.argv) > 1:
+        num_repeats = int(sys.argv[1])
+
+    mb = build_model()
+    x = (numpy.random.rand(BATCH_SIZE, PATCH_SIZE, 1, PATCH_SIZE, PATCH_SIZE) > .9).astype(numpy.float32)
+
+    start_time = time.time()
+    theano_predict = theano.function([mb.layers[0].input], mb.layers[-1].output)
+    theano_predict(x)
+    theano_startup = time.time() - start_time
+    theano_time = time_calls(theano_predict, x, num_repeats)
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        prefix = os.path.join(tmp_dir, "model")
+        export_model(mb.layers, prefix)
+
+        start_time = time.time()
+        model = numpy_model.NumpyModel.load(prefix)
+        model.predict(x)
+        numpy_startup = time.time() - start_time
+        numpy_time = time_calls(model.predict, x, num_repeats)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    print "theano: startup (compile + first batch) %.2fs, %.1fms per batch" % (theano_startup, theano_time * 1000)
+    print "numpy: startup (load + first batch) %.2fs, %.1fms per batch" % (numpy_startup, numpy_time * 1000)
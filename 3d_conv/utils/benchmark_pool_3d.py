@@ -0,0 +1,67 @@
+
+import time
+import sys
+import numpy
+import theano
+import theano.tensor as T
+
+from theano.tensor.signal.pool import pool_2d
+
+from layers.layer_utils import pool_3d
+
+#Times forward and forward+backward of the single pass pool_3d (which
+#max_pool_3d and MaxPoolLayer3D go through) against the two stage max pooling
+#max_pool_3d used to do, max_pool_2d twice with two dimshuffles.
+#
+#usage: python benchmark_pool_3d.py [num_repeats]
+
+BATCH_SIZE = 10
+NUM_CHANNELS = 16
+PATCH_SIZES = (24, 32, 72)
+DS = 2
+
+
+def two_stage_max_pool_3d(input, ds):
+    # max_pool_2d X and Z
+    temp_output = pool_2d(input.dimshuffle(0, 4, 2, 3, 1), ds=(ds, ds), ignore_border=False)
+    # max_pool_2d X and Y (with X constant)
+    return pool_2d(temp_output.dimshuffle(0, 4, 2, 3, 1), ds=(1, ds), ignore_border=False)
+
+
+def time_function(f, input, num_repeats):
+    f(input)
+    start_time = time.time()
+    for i in xrange(num_repeats):
+        f(input)
+    return (time.time() - start_time) / num_repeats
+
+
+def benchmark(patch_size, num_repeats):
+    input_shape = (BATCH_SIZE, patch_size, NUM_CHANNELS, patch_size, patch_size)
+    input = numpy.random.rand(*input_shape).astype(theano.config.floatX)
+
+    dtensor5 = theano.tensor.TensorType(theano.config.floatX, (0,)*5)
+    x = dtensor5('x')
+
+    results = {}
+    for name, output in (('two_stage', two_stage_max_pool_3d(x, DS)),
+                         ('single_pass', pool_3d(x, input_shape, DS))):
+        forward = theano.function([x], output)
+        backward = theano.function([x], T.grad(output.sum(), x))
+        results[name] = (time_function(forward, input, num_repeats),
+                         time_function(backward, input, num_repeats))
+    return results
+
+
+if __name__ == '__main__':
+
+    num_repeats = 10
+    if len(sys.argv) > 1:
+        num_repeats = int(sys.argv[1])
+
+    for patch_size in PATCH_SIZES:
+        results = benchmark(patch_size, num_repeats)
+        for name, (forward_time, backward_time) in sorted(results.items()):
+            print "%i^3 %s: forward %.2fms, forward+backward %.2fms" % (patch_size, name,
+                                                                      forward_time * 1000,
+                                                                      backward_time * 1000)
@@ -0,0 +1,112 @@
+
+import sys
+import time
+import numpy
+import theano.tensor as T
+
+from layers.layer_utils import downscale_3d, relu
+from models.model_builder import ModelBuilder
+from models.progressive import TimeToTarget, parse_schedule, transfer_params
+
+#Wall clock time to a target validation error of a coarse to fine schedule
+#against training at the final resolution from the start, on a synthetic
+#three class problem (ellipsoids, boxes and cylinders of random sizes and
+#positions in 32^3 grids, one sigmoid output per class, the error is that of
+#the thresholded outputs). Each stage downscales the same 32^3 batches with
+#downscale_3d. Only the validation errors of the final stage, at 32^3, count
+#toward the target. The times include building the models of the stages.
+#
+#usage: python benchmark_progressive.py [target_error] [max_seconds]
+
+PATCH_SIZE = 32
+BATCH_SIZE = 8
+NUM_CLASSES = 3
+VALIDATION_BATCHES = 4
+VALIDATION_FREQUENCY = 10
+# two valid 3^3 convolutions, each followed by a 2x max pooling keeping the partial windows
+MIN_INPUT_SIZE = 7
+
+FIXED_SCHEDULE = [(1, 10 ** 6)]
+PROGRESSIVE_SCHEDULE = [(2, 150), (1, 10 ** 6)]
+
+
+def shape_batch(rng, batch_size=BATCH_SIZE, size=PATCH_SIZE):
+    """(batch in BZCXY, one hot labels) of random ellipsoids (0), boxes (1) and z cylinders (2)."""
+    x = numpy.zeros((batch_size, size, 1, size, size), dtype=numpy.float32)
+    labels = rng.randint(NUM_CLASSES, size=batch_size)
+    z_, x_, y_ = numpy.ogrid[:size, :size, :size]
+    for i in xrange(batch_size):
+        radii = rng.uniform(.15, .3, 3) * size
+        center = rng.uniform(.35, .65, 3) * size
+        dz, dx, dy = [numpy.abs(c - center[k]) / radii[k] for k, c in enumerate((z_, x_, y_))]
+        if labels[i] == 0:
+            grid = dz ** 2 + dx ** 2 + dy ** 2 <= 1
+        elif labels[i] == 1:
+            grid = (dz <= 1) & (dx <= 1) & (dy <= 1)
+        else:
+            grid = (dz <= 1) & (dx ** 2 + dy ** 2 <= 1)
+        x[i, :, 0] = grid
+    return x, numpy.eye(NUM_CLASSES, dtype=numpy.float32)[labels]
+
+
+def build_model(patch_size):
+    mb = ModelBuilder((BATCH_SIZE, patch_size, 1, patch_size, patch_size), learning_rate=.001)
+    mb.add_conv_layer((8, 3, 1, 3, 3))
+    mb.add_max_pool_layer(2)
+    mb.add_conv_layer((16, 3, 8, 3, 3))
+    mb.add_max_pool_layer(2)
+    mb.add_flatten_layer()
+    mb.add_hidden_layer(64, relu)
+    mb.add_recon_layer(NUM_CLASSES, T.nnet.sigmoid)
+    return mb.build_model(T.matrix('y'))
+
+
+def run(schedule, target_error, max_seconds, seed=0):
+    """(time to target, iterations) of a schedule of (downsample_factor, iterations) stages."""
+    rng = numpy.random.RandomState(seed)
+    validation = [shape_batch(numpy.random.RandomState(1000 + i)) for i in xrange(VALIDATION_BATCHES)]
+    time_to_target = TimeToTarget(target_error)
+    iteration = 0
+    previous_model = None
+    schedule = parse_schedule(schedule, input_size=PATCH_SIZE, min_input_size=MIN_INPUT_SIZE)
+    for stage_index, stage in enumerate(schedule):
+        factor = stage['downsample_factor']
+        final_stage = stage_index == len(schedule) - 1
+        model = build_model(PATCH_SIZE / factor)
+        if previous_model is not None:
+            transfer_params(previous_model.layers, model.layers)
+        previous_model = model
+
+        for stage_iteration in xrange(stage['epochs']):
+            x, y = shape_batch(rng)
+            model.train(downscale_3d(x, factor), y)
+            iteration += 1
+            if iteration % VALIDATION_FREQUENCY == 0:
+                error = numpy.mean([model.validate(downscale_3d(vx, factor), vy) for vx, vy in validation])
+                print "iteration %i, %i^3: validation error %.2f%% after %.1fs" % (
+                    iteration, PATCH_SIZE / factor, error * 100., time.time() - time_to_target.start_time)
+                if final_stage and time_to_target.update(iteration, error):
+                    return time_to_target
+                if time.time() - time_to_target.start_time > max_seconds:
+                    return time_to_target
+    return time_to_target
+
+
+if __name__ == '__main__':
+
+    target_error = .25
+    max_seconds = 1200.
+    if len(sys.argv) > 1:
+        target_error = float(sys.argv[1])
+    if len(sys.argv) > 2:
+        max_seconds = float(sys.argv[2])
+
+    results = []
+    for name, schedule in (('fixed %i^3' % PATCH_SIZE, FIXED_SCHEDULE),
+                           ('progressive %s' % ' -> '.join('%i^3' % (PATCH_SIZE / f) for f, n in PROGRESSIVE_SCHEDULE),
+                            PROGRESSIVE_SCHEDULE)):
+        results.append((name, run(schedule, target_error, max_seconds)))
+
+    print
+    for name, time_to_target in results:
+        print "%s: %s" % (name, time_to_target.summary())
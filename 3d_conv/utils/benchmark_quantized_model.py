@@ -0,0 +1,56 @@
+
+import os
+import shutil
+import sys
+import tempfile
+import numpy
+
+from models import numpy_model, quantize_model
+from models.export_model import export_model
+from utils.benchmark_numpy_model import BATCH_SIZE, PATCH_SIZE, build_model, time_calls
+
+#Quantizes the completion model of benchmark_numpy_model.py to int8 and compares
+#it with the float numpy engine: weight memory, time per batch and agreement of
+#the thresholded outputs. Pass an hdf5 reconstruction dataset (with a trained
+#model export) to calibrate and report on real examples instead of random ones.
+#
+#usage: python benchmark_quantized_model.py [num_repeats [export_prefix hdf5_filepath]]
+
+
+class RandomIterator(object):
+
+    def next(self):
+        batch_x = (numpy.random.rand(BATCH_SIZE, PATCH_SIZE, 1, PATCH_SIZE, PATCH_SIZE) > .9).astype(numpy.float32)
+        return batch_x, numpy.zeros((BATCH_SIZE, 24 ** 3), dtype=numpy.float32)
+
+
+if __name__ == '__main__':
+
+    num_repeats = 10
+    if len(sys.argv) > 1:
+        num_repeats = int(sys.argv[1])
+
+    if len(sys.argv) > 3:
+        from datasets.hdf5_reconstruction_dataset import ReconstructionDataset
+        model = numpy_model.NumpyModel.load(sys.argv[2])
+        iterator = ReconstructionDataset(sys.argv[3]).iterator(batch_size=BATCH_SIZE)
+    else:
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            mb = build_model()
+            for layer in mb.layers:
+                for p in layer.params:
+                    p.set_value(((numpy.random.rand(*p.get_value().shape) - .5) * .1).astype(p.dtype))
+            prefix = os.path.join(tmp_dir, "model")
+            export_model(mb.layers, prefix)
+            model = numpy_model.NumpyModel.load(prefix)
+        finally:
+            shutil.rmtree(tmp_dir)
+        iterator = RandomIterator()
+
+    quantized = quantize_model.quantize_model(model, quantize_model.calibrate(model, iterator))
+    quantize_model.print_report(quantize_model.accuracy_report(model, quantized, iterator))
+
+    x, y = iterator.next()
+    print "float: %.1fms per batch" % (time_calls(model.predict, x, num_repeats) * 1000)
+    print "int8: %.1fms per batch" % (time_calls(quantized.predict, x, num_repeats) * 1000)
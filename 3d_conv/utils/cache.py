@@ -0,0 +1,71 @@
+
+import cPickle
+import json
+import os
+import tempfile
+
+#On disk cache shared by the tools that remember expensive results between
+#runs (conv implementation timings, compiled theano functions, ...). Lives in
+#$CONV3D_CACHE_DIR, or ~/.cache/3d_conv when that is not set.
+
+CACHE_DIR_ENV = "CONV3D_CACHE_DIR"
+
+
+def cache_dir():
+    path = os.environ.get(CACHE_DIR_ENV)
+    if not path:
+        path = os.path.join(os.path.expanduser("~"), ".cache", "3d_conv")
+    if not os.path.isdir(path):
+        try:
+            os.makedirs(path)
+        except OSError:
+            #another process created it first
+            if not os.path.isdir(path):
+                raise
+    return path
+
+
+def cache_filepath(filename):
+    return os.path.join(cache_dir(), filename)
+
+
+def load_json(filename):
+    """Contents of a json cache file, {} if it is missing or unreadable."""
+    filepath = cache_filepath(filename)
+    if not os.path.isfile(filepath):
+        return {}
+    try:
+        with open(filepath) as f:
+            return json.load(f)
+    except ValueError:
+        return {}
+
+
+def save_json(filename, data):
+    """Writes a json cache file through a temporary file and a rename so readers never see half of it."""
+    filepath = cache_filepath(filename)
+    fd, tmp_filepath = tempfile.mkstemp(dir=os.path.dirname(filepath), suffix=".tmp")
+    with os.fdopen(fd, 'w') as f:
+        json.dump(data, f, indent=1, sort_keys=True)
+    os.rename(tmp_filepath, filepath)
+
+
+def load_pickle(filename):
+    """Unpickled contents of a cache file, None if it is missing or unreadable."""
+    filepath = cache_filepath(filename)
+    if not os.path.isfile(filepath):
+        return None
+    try:
+        with open(filepath, 'rb') as f:
+            return cPickle.load(f)
+    except Exception as e:
+        print "ignoring unreadable cache file " + filepath + ": " + str(e)
+        return None
+
+
+def save_pickle(filename, data):
+    filepath = cache_filepath(filename)
+    fd, tmp_filepath = tempfile.mkstemp(dir=os.path.dirname(filepath), suffix=".tmp")
+    with os.fdopen(fd, 'wb') as f:
+        cPickle.dump(data, f, protocol=cPickle.HIGHEST_PROTOCOL)
+    os.rename(tmp_filepath, filepath)
@@ -0,0 +1,63 @@
+
+import os
+import sys
+import h5py
+import numpy as np
+
+string_dtype = h5py.special_dtype(vlen=bytes)
+
+#Merges a directory of per example hdf5 files (each with a 'data' and a 'label'
+#dataset holding a single example, like the melanoma dataset) into one chunked
+#hdf5 file that MelonomaDataset can read directly:
+#
+#   data - (num_examples,) + example shape, one chunk per example
+#   label - (num_examples, 1), the first label entry of each example
+#   filenames - (num_examples,) source file of each example
+#   label_index/<label> - sorted indices of the examples with that label
+#
+#usage: python consolidate_hdf5_examples.py in_dir out_file.h5
+
+
+def consolidate(example_filepaths, out_filepath):
+
+    num_examples = len(example_filepaths)
+
+    with h5py.File(example_filepaths[0], 'r') as first:
+        example_shape = first['data'].shape[1:]
+        data_dtype = first['data'].dtype
+        label_dtype = first['label'].dtype
+
+    out = h5py.File(out_filepath, 'w')
+    out.create_dataset('data', (num_examples,) + example_shape, dtype=data_dtype,
+                       chunks=(1,) + example_shape)
+    out.create_dataset('label', (num_examples, 1), dtype=label_dtype)
+    out.create_dataset('filenames', (num_examples,), dtype=string_dtype)
+
+    labels = np.empty((num_examples,), dtype=label_dtype)
+    for index, example_filepath in enumerate(example_filepaths):
+
+        if index % 1000 == 0:
+            print("working on number: " + str(index))
+
+        with h5py.File(example_filepath, 'r') as example:
+            out['data'][index] = example['data'][0]
+            labels[index] = example['label'][0].flat[0]
+        out['filenames'][index] = os.path.basename(example_filepath)
+
+    out['label'][:, 0] = labels
+
+    label_index = out.create_group('label_index')
+    for label in np.unique(labels):
+        label_index.create_dataset(str(label), data=np.nonzero(labels == label)[0])
+
+    out.close()
+
+
+if __name__ == '__main__':
+
+    in_dir, out_filepath = sys.argv[1:3]
+
+    example_filepaths = sorted(os.path.join(in_dir, filename) for filename in os.listdir(in_dir) if ".h5" in filename)
+    print("Number of examples: " + str(len(example_filepaths)))
+
+    consolidate(example_filepaths, out_filepath)
@@ -0,0 +1,115 @@
+
+import hashlib
+import os
+import tempfile
+import numpy as np
+
+
+#Batched version of the MNIST -> 3D conversion done in digitCompletion.load_data.
+#Each 28x28 digit is resized to size x size, then stood up in a size^3 volume
+#as a vertical sheet rotated by a random angle about the vertical (Y) axis.
+#Volumes are uint8, with the original 0-255 intensities.
+
+CACHE_VERSION = 1
+
+
+def bilinear_matrix(size_in, size_out):
+    """(size_out, size_in) matrix doing 1d bilinear interpolation with pixel centers aligned."""
+    matrix = np.zeros((size_out, size_in))
+
+    src = (np.arange(size_out) + .5) * size_in / float(size_out) - .5
+    src = np.clip(src, 0, size_in - 1)
+    low = np.floor(src).astype(int)
+    high = np.minimum(low + 1, size_in - 1)
+    weight = src - low
+
+    matrix[np.arange(size_out), low] += 1 - weight
+    matrix[np.arange(size_out), high] += weight
+    return matrix
+
+
+def resize_images(images, size):
+    """
+    Resizes a stack of square images (n, h, w) to (n, size, size) uint8 in one
+    shot.  Like scipy.misc.imresize, each image is first scaled to 0-255.
+    """
+    images = np.asarray(images, dtype=np.float64)
+    low = images.min(axis=(1, 2), keepdims=True)
+    high = images.max(axis=(1, 2), keepdims=True)
+    images = (images - low) * (255.0 / np.maximum(high - low, 1e-12))
+
+    rows = bilinear_matrix(images.shape[1], size)
+    cols = bilinear_matrix(images.shape[2], size)
+    resized = np.einsum('ij,njk,lk->nil', rows, images, cols)
+
+    return np.clip(np.rint(resized), 0, 255).astype(np.uint8)
+
+
+def extrude_digits(images, rng=np.random, max_angle=.4 * np.pi):
+    """
+    Scatters each (size, size) image into a (size, size, size) ZXY volume: row r of
+    the image is written along Y at the rotated position of x = r about the
+    vertical axis, with an angle drawn uniformly from [-max_angle, max_angle].
+    """
+    num_images, size = images.shape[0:2]
+    offset = size / 2 - 1
+
+    angles = max_angle * (2 * rng.rand(num_images) - 1)
+    old_x = np.arange(size) - offset
+
+    new_x = np.rint(np.cos(angles)[:, None] * old_x + offset).astype(int)
+    new_z = np.rint(np.sin(angles)[:, None] * old_x + offset).astype(int)
+
+    volumes = np.zeros((num_images, size, size, size), dtype=np.uint8)
+    volumes[np.arange(num_images)[:, None], new_z, new_x, :] = images
+    return volumes
+
+
+def digit_volumes(flat_images, num_examples=None, size=20, seed=23455):
+    """flat_images is (n, 784) as stored in mnist.pkl.gz."""
+    if num_examples is None:
+        num_examples = flat_images.shape[0]
+
+    images = flat_images[:num_examples].reshape(num_examples, 28, 28)
+    return extrude_digits(resize_images(images, size), rng=np.random.RandomState(seed))
+
+
+def file_hash(filepath, block_size=2 ** 20):
+    sha1 = hashlib.sha1()
+    with open(filepath, 'rb') as f:
+        block = f.read(block_size)
+        while block:
+            sha1.update(block)
+            block = f.read(block_size)
+    return sha1.hexdigest()
+
+
+def cached_digit_volumes(source_filepath, split_name, flat_images, num_examples=None,
+                         size=20, seed=23455, cache_dir=None):
+    """
+    digit_volumes, cached next to the source file (or in cache_dir) in an
+    uncompressed .npz keyed on the source file's hash and the conversion settings.
+    """
+    if num_examples is None:
+        num_examples = flat_images.shape[0]
+    if cache_dir is None:
+        cache_dir = os.path.dirname(os.path.abspath(source_filepath))
+
+    key = hashlib.sha1("%s %s %d %d %d %d" % (file_hash(source_filepath), split_name,
+                                              num_examples, size, seed, CACHE_VERSION)).hexdigest()
+    cache_filepath = os.path.join(cache_dir, "digit_volumes_%s_%s.npz" % (split_name, key[:16]))
+
+    if os.path.isfile(cache_filepath):
+        print "loading cached digit volumes from " + cache_filepath
+        return np.load(cache_filepath)['volumes']
+
+    volumes = digit_volumes(flat_images, num_examples=num_examples, size=size, seed=seed)
+
+    #write to a temporary file first so that an interrupted run never leaves a truncated cache,
+    #one per process as the trials of a sweep (utils/sweep.py) may fill the cache together
+    fd, tmp_filepath = tempfile.mkstemp(dir=cache_dir, suffix=".tmp.npz")
+    with os.fdopen(fd, 'wb') as f:
+        np.savez(f, volumes=volumes)
+    os.rename(tmp_filepath, cache_filepath)
+
+    return volumes
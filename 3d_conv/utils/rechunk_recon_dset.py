@@ -0,0 +1,59 @@
+
+import sys
+import h5py
+import numpy as np
+
+#Copies a reconstruction dataset (x and y of shape (num_examples, size, size,
+#size, 1), as precompute_recon_dset.py writes them) into one chunked for random
+#crops (datasets/patch_dataset.py):
+#
+#   x, y - the same grids, in chunks of one example and chunk_size^3 voxels,
+#          so that a crop aligned on the chunk grid reads only its own chunks
+#          (precompute_recon_dset.py chunks 100 whole examples together)
+#   occupancy - (num_examples, size / chunk_size, size / chunk_size, size / chunk_size),
+#               the number of occupied y voxels of each chunk
+#
+#usage: python rechunk_recon_dset.py in_file.h5 out_file.h5 [chunk_size]
+
+
+def chunk_occupancy(grid, chunk_size):
+    """Number of non zero voxels of each chunk_size^3 chunk of a (size, size, size, ...) grid."""
+    n = grid.shape[0] / chunk_size
+    occupied = (grid != 0).reshape(grid.shape[:3] + (-1,)).any(axis=-1)
+    return occupied.reshape(n, chunk_size, n, chunk_size, n, chunk_size).sum(axis=(1, 3, 5)).astype(np.int32)
+
+
+def rechunk(in_filepath, out_filepath, chunk_size=32):
+
+    with h5py.File(in_filepath, 'r') as src, h5py.File(out_filepath, 'w') as out:
+        num_examples, size = src['x'].shape[:2]
+        if size % chunk_size != 0:
+            raise ValueError("chunk_size: %i does not divide the grid size %i" % (chunk_size, size))
+
+        for key in ('x', 'y'):
+            out.create_dataset(key, src[key].shape, dtype=src[key].dtype,
+                               chunks=(1, chunk_size, chunk_size, chunk_size) + src[key].shape[4:])
+        n = size / chunk_size
+        out.create_dataset('occupancy', (num_examples, n, n, n), dtype=np.int32)
+        out['occupancy'].attrs['chunk_size'] = chunk_size
+
+        # one example at a time: a 256^3 example is 64MB of float32
+        for index in xrange(num_examples):
+
+            if index % 1000 == 0:
+                print("working on number: " + str(index))
+
+            y = src['y'][index]
+            out['x'][index] = src['x'][index]
+            out['y'][index] = y
+            out['occupancy'][index] = chunk_occupancy(y, chunk_size)
+
+
+if __name__ == '__main__':
+
+    in_filepath, out_filepath = sys.argv[1:3]
+    chunk_size = 32
+    if len(sys.argv) > 3:
+        chunk_size = int(sys.argv[3])
+
+    rechunk(in_filepath, out_filepath, chunk_size)
@@ -9,7 +9,10 @@ import PyKDL
 from off_utils.off_handler import OffHandler
 import math
 
+from utils.tracing import traced
 
+
+@traced("create_voxel_grid_around_point", "voxelize")
 def create_voxel_grid_around_point(points, patch_center, voxel_resolution=0.001, num_voxels_per_dim=72):
 
     voxel_grid = np.zeros((num_voxels_per_dim,
@@ -0,0 +1,469 @@
+
+import argparse
+import imp
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import sqlite3
+import subprocess
+import sys
+import time
+import traceback
+from distutils.spawn import find_executable
+import numpy
+
+from utils import cache
+
+#Local hyperparameter sweeps over the jobman style experiment(state, channel)
+#entry points of the trainer scripts. The trials of a grid or a random search
+#run in a pool of subprocesses sized to the cores and the memory of the
+#machine, and their results go to an SQLite database:
+#
+#   python -m utils.sweep reconstructor.py sweep.json --db sweeps/learning_rate.db
+#
+#with sweep.json
+#   {"fixed": {"dataset": "/srv/3d_conv_data/recon.h5"},
+#    "random": {"learning_rate": {"log_uniform": [1e-5, 1e-2]}, "batch_size": [16, 32]},
+#    "num_trials": 20, "seed": 0,
+#    "halving": {"min_resource": 500, "eta": 3, "mode": "min"}}
+#("grid": {"learning_rate": [1e-4, 1e-3]} expands every combination instead).
+#
+#The entry point gets state, a dict with attribute access holding the fixed and
+#swept parameters, and channel. It sets state.score (lower is better unless
+#mode is "max") and may return channel.COMPLETE. With "halving", a trial calls
+#channel.report(step, score) at every evaluation; report returns False when the
+#trial should stop (successive halving: at steps min_resource * eta^k only the
+#best 1 / eta of the trials that got there so far go on). Trials are never
+#paused, so a trial is compared with the ones ahead of it, and the first eta
+#trials at each rung always go on.
+#
+#Every trial is a new python process with its BLAS and OpenMP thread counts set
+#to threads_per_trial (optionally pinned to its own cores with taskset), all
+#sharing the compiled function cache of utils/cache.py and the theano
+#compiledir. Running the same command again resumes the sweep: the finished
+#trials are kept and the ones that did not finish run again.
+
+BLAS_THREAD_ENV = ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS",
+                   "VECLIB_MAXIMUM_THREADS", "NUMEXPR_NUM_THREADS")
+
+PENDING = 'pending'
+RUNNING = 'running'
+COMPLETE = 'complete'
+STOPPED = 'stopped'
+FAILED = 'failed'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS trials (
+    id INTEGER PRIMARY KEY,
+    entry_point TEXT NOT NULL,
+    params TEXT NOT NULL,
+    halving TEXT,
+    status TEXT NOT NULL,
+    score REAL,
+    result TEXT,
+    error TEXT,
+    started REAL,
+    finished REAL
+);
+CREATE TABLE IF NOT EXISTS reports (
+    trial_id INTEGER NOT NULL,
+    step INTEGER NOT NULL,
+    score REAL NOT NULL,
+    time REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS rungs (
+    trial_id INTEGER NOT NULL,
+    rung INTEGER NOT NULL,
+    score REAL NOT NULL,
+    PRIMARY KEY (trial_id, rung)
+);
+"""
+
+
+def grid_search(grid, fixed=None):
+    """Every combination of the values of grid (a dict of lists), each with the fixed parameters."""
+    names = sorted(grid)
+    trials = []
+    for values in itertools.product(*[grid[name] for name in names]):
+        params = dict(fixed or {})
+        params.update(zip(names, values))
+        trials.append(params)
+    return trials
+
+
+def sample(spec, rng):
+    """
+    One value of a random search dimension: a list is a choice, a dict one of
+    {"uniform": [low, high]}, {"log_uniform": [low, high]}, {"randint": [low, high]}.
+    """
+    if isinstance(spec, list):
+        return spec[rng.randint(len(spec))]
+    (kind, (low, high)), = spec.items()
+    if kind == 'uniform':
+        return float(rng.uniform(low, high))
+    if kind == 'log_uniform':
+        return float(math.exp(rng.uniform(math.log(low), math.log(high))))
+    if kind == 'randint':
+        return int(rng.randint(low, high + 1))
+    raise ValueError("unknown distribution: %s" % kind)
+
+
+def random_search(space, num_trials, fixed=None, seed=0):
+    """num_trials parameter sets drawn from space (see sample), each with the fixed parameters."""
+    rng = numpy.random.RandomState(seed)
+    names = sorted(space)
+    trials = []
+    for i in xrange(num_trials):
+        params = dict(fixed or {})
+        for name in names:
+            params[name] = sample(space[name], rng)
+        trials.append(params)
+    return trials
+
+
+def available_memory_mb():
+    """MemAvailable of /proc/meminfo, None where there is none."""
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) / 1024.
+    except IOError:
+        pass
+    return None
+
+
+def pool_size(threads_per_trial=1, memory_per_trial_mb=None):
+    """How many trials of threads_per_trial threads (and memory_per_trial_mb) fit on this machine."""
+    size = max(1, multiprocessing.cpu_count() // threads_per_trial)
+    memory = available_memory_mb()
+    if memory_per_trial_mb and memory is not None:
+        size = min(size, max(1, int(memory // memory_per_trial_mb)))
+    return size
+
+
+class SweepDB(object):
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        # trials write their reports while the scheduler reads and updates
+        self.connection = sqlite3.connect(filepath, timeout=60, isolation_level=None)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.executescript(SCHEMA)
+
+    def add_trials(self, entry_point, trials, halving=None):
+        """Adds the parameter sets that are not in the database yet, returns how many."""
+        existing = set(row['params'] for row in
+                       self.connection.execute("SELECT params FROM trials WHERE entry_point = ?", (entry_point,)))
+        added = 0
+        for params in trials:
+            encoded = json.dumps(params, sort_keys=True)
+            if encoded in existing:
+                continue
+            existing.add(encoded)
+            self.connection.execute("INSERT INTO trials (entry_point, params, halving, status) VALUES (?, ?, ?, ?)",
+                                    (entry_point, encoded, json.dumps(halving), PENDING))
+            added += 1
+        return added
+
+    def trial(self, trial_id):
+        row = self.connection.execute("SELECT * FROM trials WHERE id = ?", (trial_id,)).fetchone()
+        return self._decode(row)
+
+    def trials(self, status=None, entry_point=None):
+        """The trials, of a status and of an entry point if they are given."""
+        conditions, values = [], []
+        for name, value in (('status', status), ('entry_point', entry_point)):
+            if value is not None:
+                conditions.append(name + " = ?")
+                values.append(value)
+        where = " WHERE " + " AND ".join(conditions) if conditions else ""
+        rows = self.connection.execute("SELECT * FROM trials%s ORDER BY id" % where, values)
+        return [self._decode(row) for row in rows]
+
+    def _decode(self, row):
+        trial = dict(row)
+        trial['params'] = json.loads(trial['params'])
+        trial['halving'] = json.loads(trial['halving']) if trial['halving'] else None
+        trial['result'] = json.loads(trial['result']) if trial['result'] else None
+        return trial
+
+    def set_status(self, trial_id, status, **fields):
+        names = ['status'] + sorted(fields)
+        values = [status] + [fields[name] for name in sorted(fields)]
+        self.connection.execute("UPDATE trials SET %s WHERE id = ?" % ", ".join(n + " = ?" for n in names),
+                                values + [trial_id])
+
+    def reset_unfinished(self, entry_point):
+        """
+        Trials of entry_point left running by a sweep that was interrupted run
+        again. The sweeps of other entry points sharing the database are left alone.
+        """
+        self.connection.execute("UPDATE trials SET status = ? WHERE status = ? AND entry_point = ?",
+                                (PENDING, RUNNING, entry_point))
+        for table in ("rungs", "reports"):
+            self.connection.execute("DELETE FROM %s WHERE trial_id IN "
+                                    "(SELECT id FROM trials WHERE status = ? AND entry_point = ?)" % table,
+                                    (PENDING, entry_point))
+
+    def add_report(self, trial_id, step, score):
+        self.connection.execute("INSERT INTO reports VALUES (?, ?, ?, ?)", (trial_id, step, score, time.time()))
+
+    def reports(self, trial_id):
+        return [(row['step'], row['score']) for row in
+                self.connection.execute("SELECT step, score FROM reports WHERE trial_id = ? ORDER BY step, time",
+                                        (trial_id,))]
+
+    def enter_rung(self, trial_id, rung, score):
+        """
+        Records the score of a trial at a rung, returns the scores at that rung
+        of every trial of the same entry point.
+        """
+        self.connection.execute("INSERT OR REPLACE INTO rungs VALUES (?, ?, ?)", (trial_id, rung, score))
+        rows = self.connection.execute(
+            "SELECT rungs.score FROM rungs JOIN trials ON rungs.trial_id = trials.id "
+            "WHERE rungs.rung = ? AND trials.entry_point = (SELECT entry_point FROM trials WHERE id = ?)",
+            (rung, trial_id))
+        return [row['score'] for row in rows]
+
+    def close(self):
+        self.connection.close()
+
+
+class SuccessiveHalving(object):
+
+    def __init__(self, min_resource=1, eta=3, mode='min'):
+        if mode not in ('min', 'max'):
+            raise ValueError("mode: %s must be min or max" % mode)
+        self.min_resource = min_resource
+        self.eta = eta
+        self.mode = mode
+
+    def rung(self, step):
+        """The last rung (0 at min_resource) a trial at step has reached, -1 before the first."""
+        rung = -1
+        while step >= self.min_resource * self.eta ** (rung + 1):
+            rung += 1
+        return rung
+
+    def keep(self, scores, score):
+        """Whether score is in the best 1 / eta of the scores (which include it) of its rung."""
+        if len(scores) <= self.eta:
+            return True
+        if self.mode == 'min':
+            better = sum(1 for s in scores if s < score)
+        else:
+            better = sum(1 for s in scores if s > score)
+        return better < int(math.ceil(len(scores) / float(self.eta)))
+
+
+class State(dict):
+    """The jobman state: the parameters of a trial, with attribute access."""
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        self[name] = value
+
+
+class Channel(object):
+
+    COMPLETE = COMPLETE
+    INCOMPLETE = 'incomplete'
+
+    def __init__(self, db, trial_id, state, halving=None):
+        self.db = db
+        self.trial_id = trial_id
+        self.state = state
+        self.halving = halving
+        self.rung = -1
+        self.last_score = None
+        self.stopped = False
+
+    def save(self):
+        """Stores the state as it is now in the result of the trial."""
+        self.db.set_status(self.trial_id, RUNNING, result=_encode_state(self.state))
+
+    def report(self, step, score):
+        """Records an intermediate score, returns False when the trial should stop."""
+        score = float(score)
+        self.db.add_report(self.trial_id, step, score)
+        self.last_score = score
+        if self.halving is None or self.stopped:
+            return not self.stopped
+
+        rung = self.halving.rung(step)
+        if rung > self.rung:
+            self.rung = rung
+            if not self.halving.keep(self.db.enter_rung(self.trial_id, rung, score), score):
+                self.stopped = True
+        return not self.stopped
+
+
+def _encode_state(state):
+    return json.dumps(state, sort_keys=True, default=repr)
+
+
+def load_entry_point(entry_point):
+    """The function of "script.py:function" (experiment by default)."""
+    filepath, _, function_name = entry_point.partition(':')
+    module = imp.load_source("sweep_entry_point", filepath)
+    return getattr(module, function_name or 'experiment')
+
+
+def run_trial(db_filepath, trial_id):
+    """Runs one trial, in the process the scheduler started for it."""
+    db = SweepDB(db_filepath)
+    trial = db.trial(trial_id)
+    halving = SuccessiveHalving(**trial['halving']) if trial['halving'] else None
+    state = State(trial['params'])
+    channel = Channel(db, trial_id, state, halving)
+
+    db.set_status(trial_id, RUNNING, started=time.time())
+    try:
+        function = load_entry_point(trial['entry_point'])
+        returned = function(state, channel)
+    except:
+        db.set_status(trial_id, FAILED, error=traceback.format_exc(), finished=time.time(),
+                      result=_encode_state(state))
+        raise
+
+    score = state.get('score', channel.last_score)
+    if channel.stopped:
+        status = STOPPED
+    elif returned == Channel.INCOMPLETE:
+        status = FAILED
+    else:
+        status = COMPLETE
+    db.set_status(trial_id, status, score=None if score is None else float(score),
+                  result=_encode_state(state), finished=time.time())
+    db.close()
+
+
+def _trial_command(db_filepath, trial_id, cores):
+    command = [sys.executable, '-m', 'utils.sweep', '--run-trial', db_filepath, str(trial_id)]
+    if cores is not None:
+        command = ['taskset', '-c', ",".join(str(core) for core in cores)] + command
+    return command
+
+
+def run_sweep(entry_point, trials, db_filepath, num_workers=None, threads_per_trial=1,
+              memory_per_trial_mb=None, halving=None, pin_cores=False, poll_interval=1.0):
+    """
+    Runs the trials (parameter dicts) of entry_point that are not finished in
+    the database yet, num_workers at a time (pool_size by default), and
+    returns every trial of entry_point in the database, best first.
+    """
+    entry_point_path, _, function_name = entry_point.partition(':')
+    entry_point = os.path.abspath(entry_point_path) + (':' + function_name if function_name else '')
+    db_filepath = os.path.abspath(db_filepath)
+    log_dir = os.path.splitext(db_filepath)[0] + "_logs"
+    if not os.path.isdir(log_dir):
+        os.makedirs(log_dir)
+
+    if num_workers is None:
+        num_workers = pool_size(threads_per_trial, memory_per_trial_mb)
+    if pin_cores and find_executable('taskset') is None:
+        print "taskset not found, trials are not pinned to cores"
+        pin_cores = False
+
+    db = SweepDB(db_filepath)
+    db.reset_unfinished(entry_point)
+    db.add_trials(entry_point, trials, halving)
+    pending = [trial['id'] for trial in db.trials(PENDING, entry_point)]
+
+    env = dict(os.environ)
+    for name in BLAS_THREAD_ENV:
+        env[name] = str(threads_per_trial)
+    # one compiled function cache for every trial
+    env[cache.CACHE_DIR_ENV] = cache.cache_dir()
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env['PYTHONPATH'] = os.pathsep.join([root] + [p for p in env.get('PYTHONPATH', '').split(os.pathsep) if p])
+
+    print "%d trials to run, %d at a time, %d threads each" % (len(pending), num_workers, threads_per_trial)
+    running = {}
+    free_slots = range(num_workers)
+    try:
+        while pending or running:
+            while pending and free_slots:
+                trial_id = pending.pop(0)
+                slot = free_slots.pop(0)
+                cores = None
+                if pin_cores:
+                    cores = range(slot * threads_per_trial, (slot + 1) * threads_per_trial)
+                log = open(os.path.join(log_dir, "trial_%d.log" % trial_id), 'a')
+                process = subprocess.Popen(_trial_command(db_filepath, trial_id, cores), env=env,
+                                           cwd=os.path.dirname(entry_point_path) or None,
+                                           stdout=log, stderr=subprocess.STDOUT)
+                log.close()
+                running[trial_id] = (process, slot)
+
+            time.sleep(poll_interval)
+            for trial_id, (process, slot) in running.items():
+                if process.poll() is None:
+                    continue
+                del running[trial_id]
+                free_slots.append(slot)
+                trial = db.trial(trial_id)
+                if process.returncode != 0 and trial['status'] != FAILED:
+                    # killed before it could record anything
+                    db.set_status(trial_id, FAILED, error="exit status %d" % process.returncode,
+                                  finished=time.time())
+                trial = db.trial(trial_id)
+                print "trial %d %s, score %s" % (trial_id, trial['status'], trial['score'])
+    finally:
+        for process, slot in running.values():
+            process.terminate()
+
+    finished = db.trials(entry_point=entry_point)
+    db.close()
+    return sort_trials(finished, halving['mode'] if halving else 'min')
+
+
+def sort_trials(trials, mode='min'):
+    """Trials with a score, best first, then the others."""
+    scored = [t for t in trials if t['score'] is not None]
+    scored.sort(key=lambda t: t['score'], reverse=(mode == 'max'))
+    return scored + [t for t in trials if t['score'] is None]
+
+
+def trials_of_config(config):
+    if 'grid' in config:
+        return grid_search(config['grid'], config.get('fixed'))
+    return random_search(config['random'], config['num_trials'], config.get('fixed'), config.get('seed', 0))
+
+
+def main(argv):
+    if argv[:1] == ['--run-trial']:
+        run_trial(argv[1], int(argv[2]))
+        return 0
+
+    parser = argparse.ArgumentParser(description="Runs a hyperparameter sweep of an experiment(state, channel).")
+    parser.add_argument('entry_point', help="script.py or script.py:function")
+    parser.add_argument('config', help="json file of the sweep")
+    parser.add_argument('--db', required=True, help="sqlite database of the results")
+    parser.add_argument('--workers', type=int, help="trials at a time, sized to cores and memory by default")
+    parser.add_argument('--threads-per-trial', type=int, default=1)
+    parser.add_argument('--memory-per-trial-mb', type=float)
+    parser.add_argument('--pin-cores', action='store_true')
+    args = parser.parse_args(argv)
+
+    with open(args.config) as f:
+        config = json.load(f)
+    trials = run_sweep(args.entry_point, trials_of_config(config), args.db, args.workers,
+                       args.threads_per_trial, args.memory_per_trial_mb, config.get('halving'),
+                       args.pin_cores)
+    print
+    for trial in trials[:10]:
+        print "%-10s %-10s %s" % (trial['score'], trial['status'], json.dumps(trial['params'], sort_keys=True))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
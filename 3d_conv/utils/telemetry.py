@@ -0,0 +1,128 @@
+
+import collections
+import json
+import resource
+import time
+
+#Per-step training telemetry, one JSON line per step:
+#   {"iteration": 41, "step_time": 1.92, "data_wait": 0.61, "assembly": 0.05, "host_copy": 0.01,
+#    "compute": 1.24, "other": 0.01, "examples_per_s": 3.1, "voxels_per_s": 51000.0,
+#    "avg_step_time": 1.95, ..., "max_rss_mb": 2210.4, ...}
+#
+#Phases are timed with the timed() context manager, in the training loop and
+#inside the dataset iterators. Times are exclusive: the time of a phase nested
+#in another one (assembly inside the data_wait of an iterator's next) is only
+#counted for the inner phase. timed() is a no-op outside of a step, so the
+#iterators can be used without telemetry. The avg_* fields are moving averages
+#over the last window steps, and max_rss_mb is the resident set high-water mark
+#of the process.
+#
+#usage:
+#   telemetry = TrainingTelemetry("telemetry.jsonl")
+#   for iteration in ...:
+#       telemetry.start_step()
+#       with timed('data_wait'):
+#           x, y = iterator.next()
+#       with timed('compute'):
+#           cost = model.train(x, y)
+#       telemetry.end_step(iteration, len(x), x[0].size, cost=float(cost))
+#   telemetry.close()
+
+PHASES = ('data_wait', 'assembly', 'host_copy', 'compute')
+
+#the telemetry of the step in progress, if any
+_active = None
+
+
+class _NoTiming(object):
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *args):
+        pass
+
+
+_NO_TIMING = _NoTiming()
+
+
+class _Timing(object):
+
+    def __init__(self, telemetry, phase):
+        self.telemetry = telemetry
+        self.phase = phase
+
+    def __enter__(self):
+        self.telemetry.nested.append(0.)
+        self.start = time.time()
+
+    def __exit__(self, *args):
+        elapsed = time.time() - self.start
+        nested = self.telemetry.nested.pop()
+        self.telemetry.phases[self.phase] += elapsed - nested
+        if self.telemetry.nested:
+            self.telemetry.nested[-1] += elapsed
+
+
+def timed(phase):
+    """Context manager adding its time to a phase of the current step."""
+    if _active is None:
+        return _NO_TIMING
+    return _Timing(_active, phase)
+
+
+def max_rss_mb():
+    # ru_maxrss is in kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+
+class TrainingTelemetry(object):
+
+    def __init__(self, filepath, window=50):
+        self.file = open(filepath, 'a')
+        self.history = collections.deque(maxlen=window)
+        self.phases = None
+        self.nested = []
+
+    def start_step(self):
+        global _active
+        self.phases = collections.defaultdict(float)
+        self.nested = []
+        self.step_start = time.time()
+        _active = self
+
+    def end_step(self, iteration, num_examples, voxels_per_example, **fields):
+        """Writes the record of the step (returned) with any extra fields."""
+        global _active
+        _active = None
+        step_time = time.time() - self.step_start
+
+        record = {'iteration': iteration, 'step_time': step_time}
+        for phase in PHASES:
+            record[phase] = self.phases.get(phase, 0.)
+        for phase, seconds in self.phases.items():
+            record[phase] = seconds
+        record['other'] = step_time - sum(self.phases.values())
+        record['examples_per_s'] = num_examples / step_time
+        record['voxels_per_s'] = num_examples * voxels_per_example / step_time
+
+        self.history.append(record)
+        for name in ('step_time', 'examples_per_s', 'voxels_per_s') + PHASES:
+            record['avg_' + name] = sum(r[name] for r in self.history) / len(self.history)
+        record['max_rss_mb'] = max_rss_mb()
+        record.update(fields)
+
+        self.file.write(json.dumps(record) + "\n")
+        self.file.flush()
+        return record
+
+    def summary(self, record):
+        """One line of the moving averages of a record, for the training log."""
+        return ("%.2fs/step (data wait %.2fs, assembly %.2fs, host copy %.2fs, compute %.2fs), "
+                "%.1f examples/s, %.3g voxels/s, max rss %.0fMB" %
+                (record['avg_step_time'], record['avg_data_wait'], record['avg_assembly'],
+                 record['avg_host_copy'], record['avg_compute'], record['avg_examples_per_s'],
+                 record['avg_voxels_per_s'], record['max_rss_mb']))
+
+    def close(self):
+        self.file.close()
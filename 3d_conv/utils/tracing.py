@@ -0,0 +1,213 @@
+
+import atexit
+import functools
+import glob
+import json
+import os
+import tempfile
+import thread
+import threading
+import time
+
+#Span tracing in the Chrome trace event format, to open in chrome://tracing or
+#https://ui.perfetto.dev. A span is a named, timed section of code on one
+#thread; a counter is a set of values at a point in time:
+#
+#   with span("voxelize", "data", num_points=len(points)):
+#       ...
+#
+#   @traced("ModelNetIterator.next", "iterator")
+#   def next(self):
+#       ...
+#
+#   counter("queue", batches=len(queue))
+#
+#Tracing is off unless $CONV3D_TRACE holds the path of the trace to write, or
+#enable(path) is called. Off, span() returns a shared no-op context manager and
+#a traced function costs one test of a global.
+#
+#Every process buffers its own events (tagged with its pid and the thread ids)
+#and appends them to <path>.<pid>.jsonl when the buffer is full and on flush().
+#At exit the process that enabled tracing flushes and merges the part files of
+#all the processes into <path>. Forked processes (multiprocessing) leave with
+#os._exit and must call flush() before returning. Processes started separately
+#with the same $CONV3D_TRACE each merge at their exit, so give them their own
+#paths or merge the parts once they are all done:
+#   python -m utils.tracing trace.json
+
+TRACE_ENV = "CONV3D_TRACE"
+
+#events buffered before a write to the part file
+FLUSH_EVENTS = 10000
+
+#the trace to write, None when tracing is off
+_path = None
+_root_pid = None
+
+_lock = threading.Lock()
+_events = []
+#the process owning _events: a forked child starts with a copy of the parent's
+_events_pid = None
+_atexit_registered = False
+
+
+class _NoSpan(object):
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *args):
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+def enabled():
+    return _path is not None
+
+
+def enable(path):
+    """Starts tracing this process, and the processes it forks, to path."""
+    global _path, _root_pid, _atexit_registered
+    _path = os.path.abspath(path)
+    _root_pid = os.getpid()
+    if not _atexit_registered:
+        atexit.register(_exit)
+        _atexit_registered = True
+
+
+def disable():
+    """Stops tracing, writing the events buffered so far to the part file."""
+    global _path
+    flush()
+    _path = None
+
+
+def _record(event):
+    global _events, _events_pid
+    pid = os.getpid()
+    with _lock:
+        if _events_pid != pid:
+            _events = []
+            _events_pid = pid
+        event['pid'] = pid
+        event['tid'] = thread.get_ident()
+        _events.append(event)
+        full = len(_events) >= FLUSH_EVENTS
+    if full:
+        flush()
+
+
+class _Span(object):
+
+    def __init__(self, name, category, args):
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.time()
+
+    def __exit__(self, *args):
+        end = time.time()
+        event = {'name': self.name, 'cat': self.category, 'ph': 'X',
+                 'ts': self.start * 1e6, 'dur': (end - self.start) * 1e6}
+        if self.args:
+            event['args'] = self.args
+        _record(event)
+
+
+def span(name, category="", **args):
+    """Context manager recording the time spent in its body, with args as details."""
+    if _path is None:
+        return _NO_SPAN
+    return _Span(name, category, args)
+
+
+def counter(name, **values):
+    """Records numeric values, drawn as a stacked graph along the timeline."""
+    if _path is None:
+        return
+    _record({'name': name, 'ph': 'C', 'ts': time.time() * 1e6, 'args': values})
+
+
+def traced(name, category="function"):
+    """Decorator recording a span for each call of a function."""
+    def decorate(f):
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            if _path is None:
+                return f(*args, **kwargs)
+            with _Span(name, category, None):
+                return f(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def traced_function(function, name, category="theano"):
+    """
+    A compiled theano function (or its python wrapper) recording a span for
+    each call. The compiled function stays in the compiled attribute
+    (models/checkpoint.py).
+    """
+    wrapper = traced(name, category)(function)
+    wrapper.compiled = getattr(function, 'compiled', function)
+    return wrapper
+
+
+def _part_filepath(path, pid):
+    return "%s.%d.jsonl" % (path, pid)
+
+
+def flush():
+    """Appends the events buffered by this process to its part file."""
+    global _events
+    if _path is None:
+        return
+    with _lock:
+        if _events_pid != os.getpid():
+            return
+        events, _events = _events, []
+    if events:
+        with open(_part_filepath(_path, os.getpid()), 'a') as f:
+            for event in events:
+                f.write(json.dumps(event) + "\n")
+
+
+def merge(path):
+    """Writes the events of the part files of path to path, as one trace, and removes the parts."""
+    part_filepaths = sorted(glob.glob(path + ".*.jsonl"))
+    events = []
+    for part_filepath in part_filepaths:
+        with open(part_filepath) as f:
+            events += [json.loads(line) for line in f if line.strip()]
+
+    fd, tmp_filepath = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp")
+    with os.fdopen(fd, 'w') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+    os.rename(tmp_filepath, path)
+
+    for part_filepath in part_filepaths:
+        os.remove(part_filepath)
+    return len(events)
+
+
+def _exit():
+    if _path is None:
+        return
+    flush()
+    if os.getpid() == _root_pid:
+        merge(_path)
+
+
+if os.environ.get(TRACE_ENV):
+    enable(os.environ[TRACE_ENV])
+
+
+if __name__ == "__main__":
+    import sys
+    #this process has nothing to add to the traces
+    disable()
+    for trace_path in sys.argv[1:]:
+        print "%s: %d events" % (trace_path, merge(trace_path))
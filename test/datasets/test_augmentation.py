@@ -0,0 +1,79 @@
+import unittest
+
+import numpy as np
+
+from datasets import augmentation
+
+
+class TestAugmentationPipeline(unittest.TestCase):
+
+    def setUp(self):
+
+        self.rng = np.random.RandomState(0)
+        self.batch_x = (self.rng.rand(4, 6, 1, 6, 6) > .7).astype(np.float32)
+        self.batch_y = (self.rng.rand(4, 6, 1, 6, 6) > .5).astype(np.float32)
+
+    def test_plan_groups_consecutive_ops(self):
+
+        pipeline = augmentation.AugmentationPipeline([augmentation.Flip(),
+                                                      augmentation.Translation(1),
+                                                      augmentation.VoxelDropout(.1),
+                                                      augmentation.GaussianNoisePostProcessor(.01, 0, .5)])
+
+        self.assertEqual(len(pipeline.stages), 2)
+        self.assertEqual(pipeline.stages[0].name, 'Flip+Translation')
+        self.assertEqual(pipeline.stages[1].name, 'VoxelDropout+GaussianNoisePostProcessor')
+
+    def test_flip_matches_numpy(self):
+
+        pipeline = augmentation.AugmentationPipeline([augmentation.Flip(axes=(2,), prob_flipped=1.0)])
+        batch_x, batch_y = pipeline.apply(self.batch_x, self.batch_y)
+
+        self.assertTrue(np.array_equal(batch_x, self.batch_x[:, :, :, :, ::-1]))
+        self.assertTrue(np.array_equal(batch_y, self.batch_y[:, :, :, :, ::-1]))
+
+    def test_rotation_is_shared_between_x_and_y(self):
+
+        pipeline = augmentation.AugmentationPipeline([augmentation.DiscreteRotation(plane=(1, 2))],
+                                                     rng=np.random.RandomState(3))
+        batch_x, batch_y = pipeline.apply(self.batch_x, self.batch_x.copy())
+
+        self.assertTrue(np.array_equal(batch_x, batch_y))
+        for i in xrange(batch_x.shape[0]):
+            rotations = [np.rot90(self.batch_x[i, :, 0], k, axes=(1, 2)) for k in xrange(4)]
+            self.assertTrue(any(np.array_equal(batch_x[i, :, 0], r) for r in rotations))
+
+    def test_translation_keeps_occupancy_inside(self):
+
+        batch_x = np.zeros((1, 6, 1, 6, 6), dtype=np.float32)
+        batch_x[0, 2:4, 0, 2:4, 2:4] = 1
+
+        pipeline = augmentation.AugmentationPipeline([augmentation.Translation(1)])
+        out_x, out_y = pipeline.apply(batch_x, batch_x)
+
+        self.assertEqual(out_x.sum(), batch_x.sum())
+        self.assertTrue(np.array_equal(out_x, out_y))
+
+    def test_elementwise_ops_only_touch_x(self):
+
+        pipeline = augmentation.AugmentationPipeline([augmentation.VoxelDropout(.5),
+                                                      augmentation.OcclusionMask(prob_occluded=1.0)])
+        batch_x, batch_y = pipeline.apply(self.batch_x, self.batch_y)
+
+        self.assertEqual(batch_x.dtype, np.float32)
+        self.assertTrue(batch_x.sum() < self.batch_x.sum())
+        self.assertTrue(batch_y is self.batch_y)
+        self.assertEqual(set(pipeline.timings.keys()), set(['VoxelDropout', 'OcclusionMask']))
+
+    def test_gaussian_noise_post_processor_standalone(self):
+
+        batch_x, batch_y = augmentation.GaussianNoisePostProcessor(.1, 0, 1.0).apply(self.batch_x, self.batch_y)
+
+        self.assertEqual(batch_x.shape, self.batch_x.shape)
+        self.assertEqual(batch_x.dtype, np.float32)
+        self.assertFalse(np.array_equal(batch_x, self.batch_x))
+        self.assertTrue(batch_y is self.batch_y)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+import unittest
+import shutil
+import tempfile
+import os
+
+import h5py
+import numpy as np
+
+from datasets import hdf5_handle_pool
+from datasets.hdf5_handle_pool import HDF5HandlePool
+from utils.consolidate_hdf5_examples import consolidate
+
+
+class TestHDF5HandlePool(unittest.TestCase):
+
+    def setUp(self):
+
+        self.data_dir = tempfile.mkdtemp()
+        self.example_filepaths = []
+        for i in range(5):
+            example_filepath = os.path.join(self.data_dir, 'example_%i.h5' % i)
+            with h5py.File(example_filepath, 'w') as f:
+                f['data'] = np.ones((1, 2, 3, 3)) * i
+                f['label'] = np.array([[-1 if i % 2 else 1]])
+            self.example_filepaths.append(example_filepath)
+
+    def tearDown(self):
+
+        shutil.rmtree(self.data_dir)
+
+    def test_least_recently_used_file_is_closed(self):
+
+        pool = HDF5HandlePool(max_open_files=2)
+        first = pool.get(self.example_filepaths[0])
+        pool.get(self.example_filepaths[1])
+        pool.get(self.example_filepaths[0])
+        pool.get(self.example_filepaths[2])
+
+        self.assertEqual(set(pool.handles.keys()), set([self.example_filepaths[0], self.example_filepaths[2]]))
+        self.assertTrue(bool(first))
+        pool.close()
+        self.assertEqual(len(pool.handles), 0)
+
+    def test_read_rows_from_per_example_files(self):
+
+        pool = HDF5HandlePool(max_open_files=2)
+        locations = [(self.example_filepaths[i], 0) for i in (3, 1, 3, 4)]
+        data = pool.read_rows(locations, 'data')
+
+        self.assertEqual(data.shape, (4, 2, 3, 3))
+        self.assertEqual(list(data[:, 0, 0, 0]), [3, 1, 3, 4])
+        pool.close()
+
+    def test_keys_read_together_when_files_are_evicted(self):
+
+        opened = []
+
+        def counting_file(filepath, mode):
+            opened.append(filepath)
+            return h5py.File(filepath, mode)
+
+        pool = HDF5HandlePool(max_open_files=2)
+        first = pool.get(self.example_filepaths[0])
+        del opened[:]
+        hdf5_handle_pool.h5py = type('counting_h5py', (), {'File': staticmethod(counting_file)})
+        try:
+            locations = [(self.example_filepaths[i], 0) for i in (1, 2, 3, 4)]
+            data, labels = pool.read_rows(locations, ('data', 'label'))
+        finally:
+            hdf5_handle_pool.h5py = h5py
+
+        #each file of the batch is opened once for both keys
+        self.assertEqual(opened, self.example_filepaths[1:])
+        self.assertEqual(list(data[:, 0, 0, 0]), [1, 2, 3, 4])
+        self.assertEqual(list(labels[:, 0]), [-1, 1, -1, 1])
+        #and the evicted handles are closed
+        self.assertFalse(bool(first))
+        self.assertEqual(set(pool.handles.keys()), set(self.example_filepaths[3:]))
+        pool.close()
+
+    def test_consolidated_file(self):
+
+        out_filepath = os.path.join(self.data_dir, 'consolidated.h5')
+        consolidate(self.example_filepaths, out_filepath)
+
+        pool = HDF5HandlePool()
+        locations = [(out_filepath, i) for i in (4, 0, 2, 0)]
+        data = pool.read_rows(locations, 'data')
+        labels = pool.read_rows(locations, 'label')
+
+        self.assertEqual(list(data[:, 0, 0, 0]), [4, 0, 2, 0])
+        self.assertEqual(list(labels[:, 0]), [1, 1, 1, 1])
+        self.assertEqual(list(pool.get(out_filepath)['label_index']['-1'][:]), [1, 3])
+        pool.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import h5py
+import numpy as np
+
+from datasets.patch_dataset import PatchDataset, sliding_window_predict, window_sums
+from utils.rechunk_recon_dset import rechunk
+
+
+class TestPatchDataset(unittest.TestCase):
+
+    def setUp(self):
+
+        self.data_dir = tempfile.mkdtemp()
+        self.filepath = os.path.join(self.data_dir, 'recon.h5')
+        rng = np.random.RandomState(0)
+        self.x = rng.rand(3, 16, 16, 16, 1).astype(np.float32)
+        #the objects only occupy the [8:12, 0:4, 4:8] chunk of each grid
+        self.y = np.zeros((3, 16, 16, 16, 1), dtype=np.float32)
+        self.y[:, 8:12, 0:4, 4:8] = rng.rand(3, 4, 4, 4, 1) > .5
+        with h5py.File(self.filepath, 'w') as f:
+            f.create_dataset('x', data=self.x, chunks=(3, 16, 16, 16, 1))
+            f.create_dataset('y', data=self.y, chunks=(3, 16, 16, 16, 1))
+
+        self.chunked_filepath = os.path.join(self.data_dir, 'recon_chunked.h5')
+        rechunk(self.filepath, self.chunked_filepath, chunk_size=4)
+
+    def tearDown(self):
+
+        shutil.rmtree(self.data_dir)
+
+    def test_rechunk(self):
+
+        with h5py.File(self.chunked_filepath, 'r') as f:
+            self.assertEqual(f['x'].chunks, (1, 4, 4, 4, 1))
+            self.assertTrue(np.array_equal(f['y'][:], self.y))
+            occupancy = f['occupancy'][:]
+        self.assertEqual(occupancy.shape, (3, 4, 4, 4))
+        self.assertEqual(occupancy[:, 2, 0, 1].tolist(), [int(self.y[i].sum()) for i in range(3)])
+        self.assertEqual(occupancy.sum(), self.y.sum())
+
+    def test_window_sums(self):
+
+        grids = np.random.RandomState(1).randint(5, size=(2, 5, 5, 5))
+        sums = window_sums(grids, 2)
+        self.assertEqual(sums.shape, (2, 4, 4, 4))
+        self.assertEqual(sums[1, 3, 0, 2], grids[1, 3:5, 0:2, 2:4].sum())
+        self.assertEqual(sums[0, 1, 2, 3], grids[0, 1:3, 2:4, 3:5].sum())
+
+    def test_crops(self):
+
+        self.assertRaises(ValueError, PatchDataset, self.filepath, 8)
+
+        np.random.seed(2)
+        dataset = PatchDataset(self.chunked_filepath, patch_size=8, occupied_fraction=1.)
+        iterator = dataset.iterator(batch_size=5, num_batches=2)
+        batch_x, batch_y = iterator.next()
+        self.assertEqual(batch_x.shape, (5, 8, 1, 8, 8))
+
+        for (index, start), x, y in zip(iterator.crops, batch_x, batch_y):
+            self.assertTrue(all(s % 4 == 0 for s in start))
+            crop = (index,) + tuple(slice(s, s + 8) for s in start)
+            self.assertTrue(np.array_equal(x, self.x[crop].transpose(2, 3, 0, 1)))
+            self.assertTrue(np.array_equal(y, self.y[crop].transpose(2, 3, 0, 1)))
+            #every crop covers the occupied chunk
+            self.assertEqual(y.sum(), self.y[index].sum())
+
+    def test_sliding_window_predict(self):
+
+        grids = self.x.transpose(0, 3, 4, 1, 2)
+        calls = []
+
+        def predict(batch_x):
+            calls.append(len(batch_x))
+            return (batch_x * 2).reshape(len(batch_x), -1)
+
+        for stride in (8, 5):
+            del calls[:]
+            predictions = sliding_window_predict(predict, grids, 8, stride=stride, batch_size=10)
+            self.assertTrue(np.allclose(predictions, grids * 2))
+            self.assertTrue(max(calls) <= 10)
+        #starts 0, 5 and 8 along each axis
+        self.assertEqual(sum(calls), 3 * 27)
+
+
+if __name__ == '__main__':
+    unittest.main()
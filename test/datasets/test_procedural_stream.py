@@ -0,0 +1,76 @@
+import unittest
+
+import numpy as np
+
+from datasets import procedural_stream
+from datasets.geometric_3d_dataset import Geometric3DDataset
+
+
+def random_batch(seed):
+    rng = np.random.RandomState(seed)
+    return rng.rand(3, 4).astype(np.float32), rng.randint(0, 10, 3)
+
+
+def seeding_batch(seed):
+    np.random.seed(seed)
+    return random_batch(seed)
+
+
+def failing_batch(seed):
+    if seed != 2 ** 32 - 1:
+        raise ValueError("boom")
+    return random_batch(seed)
+
+
+class TestProceduralStream(unittest.TestCase):
+
+    def test_stream_does_not_depend_on_num_workers(self):
+
+        batches = []
+        for num_workers in (1, 3):
+            stream = procedural_stream.ProceduralStream(random_batch, num_workers=num_workers, seed=5)
+            batches.append([stream.next() for i in xrange(7)])
+            stream.close()
+
+        for (x1, y1), (x2, y2) in zip(*batches):
+            self.assertTrue(np.array_equal(x1, x2))
+            self.assertTrue(np.array_equal(y1, y2))
+
+        expected_x, expected_y = random_batch(procedural_stream.batch_seed(5, 4))
+        self.assertTrue(np.array_equal(batches[0][4][0], expected_x))
+
+    def test_batch_seeds_do_not_collide(self):
+
+        self.assertNotEqual(procedural_stream.batch_seed(0, 1000003), procedural_stream.batch_seed(7919, 0))
+        seeds = set(procedural_stream.batch_seed(seed, i) for seed in xrange(20) for i in xrange(100))
+        self.assertEqual(len(seeds), 2000)
+
+    def test_global_random_state_is_kept(self):
+
+        np.random.seed(3)
+        expected = np.random.RandomState(3).rand()
+        stream = procedural_stream.ProceduralStream(seeding_batch, num_workers=1)
+        self.assertEqual(np.random.rand(), expected)
+        stream.close()
+
+    def test_geometric_dataset_stream(self):
+
+        dataset = Geometric3DDataset(patch_size=12, task=Geometric3DDataset.KINECT_COMPLETION_TASK)
+        generator = procedural_stream.IteratorBatchGenerator(dataset, batch_size=2)
+
+        stream = procedural_stream.ProceduralStream(generator, num_workers=2, seed=1)
+        batch_x, batch_y = stream.next()
+        stream.close()
+
+        self.assertEqual(batch_x.shape, (2, 12, 1, 12, 12))
+        self.assertEqual(batch_y.shape, (2, 12, 1, 12, 12))
+        self.assertTrue(np.all(batch_y[batch_x]))
+
+    def test_worker_errors_are_raised(self):
+
+        stream = procedural_stream.ProceduralStream(failing_batch, num_workers=1)
+        self.assertRaises(RuntimeError, stream.next)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import unittest
+
+import numpy as np
+
+from datasets import view_synthesis_dataset
+
+
+class TestViewSynthesis(unittest.TestCase):
+
+    def setUp(self):
+
+        self.patch_size = 12
+        self.grids = np.zeros((2, self.patch_size, 1, self.patch_size, self.patch_size), dtype=np.float32)
+        self.grids[:, 3:9, 0, 4:8, 2:10] = 1
+
+    def test_random_rotations_are_orthonormal(self):
+
+        rotations = view_synthesis_dataset.random_rotations(5, np.random.RandomState(0))
+
+        for rotation in rotations:
+            self.assertTrue(np.allclose(np.dot(rotation, rotation.T), np.eye(3)))
+            self.assertAlmostEqual(np.linalg.det(rotation), 1.0)
+
+    def test_identity_rotation(self):
+
+        rotated = view_synthesis_dataset.rotate_grids(self.grids, np.array([np.eye(3)] * 2))
+
+        self.assertTrue(np.array_equal(rotated, self.grids))
+
+    def test_quarter_turn_matches_rot90(self):
+
+        #rotate (x, y) -> (-y, x) about the z axis
+        quarter_turn = np.array([[1, 0, 0],
+                                 [0, 0, -1],
+                                 [0, 1, 0]])
+        rotated = view_synthesis_dataset.rotate_grids(self.grids, np.array([quarter_turn] * 2))
+
+        expected = np.rot90(self.grids[0, :, 0], 1, axes=(1, 2))
+        self.assertTrue(np.array_equal(rotated[0, :, 0], expected))
+
+    def test_visible_surface_of_box_is_front_face(self):
+
+        views = view_synthesis_dataset.render_visible_surface(self.grids)
+
+        self.assertEqual(views.shape, self.grids.shape)
+        self.assertEqual(views[0].sum(), 4 * 8)
+        self.assertEqual(views[0, 3, 0, 4:8, 2:10].sum(), 4 * 8)
+
+        shadow = view_synthesis_dataset.render_visible_surface(self.grids, fill_shadow=True)
+        self.assertEqual(shadow[0].sum(), (self.patch_size - 3) * 4 * 8)
+
+    def test_post_processor_keeps_x_inside_y(self):
+
+        post_processor = view_synthesis_dataset.ViewSynthesisPostProcessor(rng=np.random.RandomState(1))
+        batch_x, batch_y = post_processor.apply(None, self.grids)
+
+        self.assertTrue(batch_x.sum() > 0)
+        self.assertTrue(np.all(batch_y[batch_x > 0] == 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import unittest
+import numpy as np
+import theano
+import theano.tensor as T
+
+from models.async_evaluator import AsyncEvaluator, EvaluationResult, mean_loss, update_early_stopping
+
+
+class TestAsyncEvaluator(unittest.TestCase):
+
+    def setUp(self):
+        self.w = theano.shared(np.ones(3, dtype=theano.config.floatX))
+        x = T.matrix('x')
+        y = T.vector('y')
+        #the error of a batch is the mean of x.w - y
+        error = T.mean(T.dot(x, self.w) - y)
+        self.validate = theano.function([x, y], error, allow_input_downcast=True)
+        self.test = theano.function([x, y], 10 * error, allow_input_downcast=True)
+
+    def batches(self):
+        return [(np.ones((2, 3)), np.zeros(2))] * 2
+
+    def test_snapshots(self):
+
+        evaluator = AsyncEvaluator([self.w], self.validate, self.test, self.batches, self.batches)
+        evaluator.submit(0)
+        #training goes on, the submitted snapshot is evaluated
+        self.w.set_value(np.zeros(3, dtype=theano.config.floatX))
+        evaluator.submit(1)
+        self.w.set_value(np.ones(3, dtype=theano.config.floatX) * 2)
+        evaluator.submit(2)
+        results = evaluator.close()
+
+        #the second snapshot was replaced while the first was evaluated
+        self.assertEqual([r.iteration for r in results], [0, 2])
+        self.assertAlmostEqual(results[0].validation_loss, 3)
+        self.assertAlmostEqual(results[0].test_score, 30)
+        #no test run without a validation improvement
+        self.assertAlmostEqual(results[1].validation_loss, 6)
+        self.assertIsNone(results[1].test_score)
+
+    def test_mean_loss_weighs_batches_by_size(self):
+
+        #a full batch of 4 with loss 1 and a last batch of 1 with loss 6
+        batches = [(np.zeros((4, 2)), None), (np.zeros((1, 2)), None)]
+        losses = iter([1., 6.])
+        self.assertAlmostEqual(mean_loss(lambda x, y: next(losses), batches), 2.)
+
+    def test_update_early_stopping(self):
+
+        best = (np.inf, 0, 0.)
+        best, patience = update_early_stopping(EvaluationResult(99, .5, .4), best, 10)
+        self.assertEqual(best, (.5, 99, .4))
+        self.assertEqual(patience, 198)
+        best, patience = update_early_stopping(EvaluationResult(199, .6, None), best, patience)
+        self.assertEqual(best, (.5, 99, .4))
+        self.assertEqual(patience, 198)
+
+
+if __name__ == '__main__':
+    unittest.main()
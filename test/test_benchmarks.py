@@ -0,0 +1,75 @@
+import os
+import shutil
+import tempfile
+import unittest
+import h5py
+import numpy as np
+
+from benchmarks import synthetic
+from benchmarks.run_benchmarks import SkipBenchmark, compare, run_benchmark
+
+
+def read_binvox(filepath):
+    with open(filepath, 'rb') as f:
+        header = [f.readline().strip() for i in xrange(5)]
+        pairs = np.frombuffer(f.read(), dtype=np.uint8).reshape(-1, 2)
+    size = int(header[1].split()[1])
+    values = np.repeat(pairs[:, 0], pairs[:, 1]).astype(bool)
+    return values.reshape(size, size, size).transpose(0, 2, 1)
+
+
+class TestBenchmarks(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_binvox_round_trip(self):
+
+        rng = np.random.RandomState(0)
+        #long runs of empty voxels are split in runs of 255
+        grid = synthetic.occupancy_grid(32, rng)
+        filepath = os.path.join(self.tmp_dir, "model.binvox")
+        synthetic.write_binvox(filepath, grid)
+        self.assertTrue(np.array_equal(read_binvox(filepath), grid))
+
+    def test_partial_view_inside_model(self):
+
+        filepath = synthetic.write_reconstruction_hdf5(os.path.join(self.tmp_dir, "recon.h5"), 3, 24,
+                                                       np.random.RandomState(0))
+        with h5py.File(filepath, 'r') as f:
+            x, y = f['x'][:], f['y'][:]
+        self.assertEqual(x.shape, (3, 24, 24, 24, 1))
+        self.assertTrue(np.all(y[x > 0] > 0))
+        self.assertLess(x.sum(), y.sum())
+
+    def test_run_benchmark(self):
+
+        record = run_benchmark('sum', 24, lambda size, rng, tmp_dir: lambda: np.ones(size).sum(), 3, self.tmp_dir)
+        self.assertEqual(record['repeats'], 3)
+        self.assertLessEqual(record['min'], record['median'])
+
+        def skipped(size, rng, tmp_dir):
+            raise SkipBenchmark("needs a gpu")
+        self.assertEqual(run_benchmark('gpu', 24, skipped, 3, self.tmp_dir)['skipped'], "needs a gpu")
+
+    def test_compare(self):
+
+        baseline = {'results': [{'name': 'a', 'size': 24, 'median': 1.},
+                                {'name': 'b', 'size': 24, 'median': 1.},
+                                {'name': 'c', 'size': 24, 'median': 1.},
+                                {'name': 'd', 'size': 24, 'skipped': "ImportError"}]}
+        results = {'results': [{'name': 'a', 'size': 24, 'median': 1.2},
+                               {'name': 'b', 'size': 24, 'median': .5},
+                               {'name': 'c', 'size': 24, 'median': 1.2},
+                               {'name': 'd', 'size': 24, 'median': 1.},
+                               {'name': 'a', 'size': 32, 'median': 1.}]}
+        regressions, improvements = compare(results, baseline, threshold=.1, thresholds={'c': .25})
+        self.assertEqual(regressions, [('a@24', 1., 1.2)])
+        self.assertEqual(improvements, [('b@24', 1., .5)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import theano
+import theano.tensor as T
+
+from layers.layer_utils import relu
+from models.checkpoint import Checkpointer, random_streams
+from models.model_builder import ModelBuilder
+
+
+class TestCheckpoint(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.directory = os.path.join(self.tmp_dir, "checkpoints")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_keep_last_and_best(self):
+
+        w = theano.shared(np.zeros(3))
+        checkpointer = Checkpointer(self.directory, [w], keep_last=2, keep_best=1)
+        for iteration in xrange(5):
+            w.set_value(np.ones(3) * iteration)
+            checkpointer.save(iteration, epoch=iteration)
+            checkpointer.set_score(iteration, [3, 1, 2, 5, 4][iteration])
+        checkpointer.close()
+
+        self.assertEqual(sorted(f for f in os.listdir(self.directory) if f.endswith(".npz")),
+                         ["checkpoint_000000001.npz", "checkpoint_000000003.npz", "checkpoint_000000004.npz"])
+
+        #a new run finds the checkpoints of the previous one
+        checkpointer = Checkpointer(self.directory, [w])
+        self.assertTrue(checkpointer.best().endswith("checkpoint_000000001.npz"))
+        state = checkpointer.restore()
+        self.assertEqual(state, {'iteration': 4, 'epoch': 4})
+        self.assertTrue(np.array_equal(w.get_value(), np.ones(3) * 4))
+        checkpointer.close()
+
+    def test_scores_of_validated_checkpoints(self):
+
+        #as train.py: a checkpoint when validating (every 2 iterations), one
+        #at the end of each epoch (every 3), scores arriving later
+        w = theano.shared(np.zeros(3))
+        checkpointer = Checkpointer(self.directory, [w], keep_last=1, keep_best=2)
+        scores = {1: 5., 3: 2., 5: 1., 7: 4.}
+        for iteration in xrange(9):
+            if iteration in scores:
+                checkpointer.save(iteration, epoch=iteration // 3)
+            if iteration % 3 == 2:
+                checkpointer.save(iteration, epoch=iteration // 3 + 1)
+            if iteration - 2 in scores:
+                checkpointer.set_score(iteration - 2, scores[iteration - 2])
+        checkpointer.set_score(7, scores[7])
+        self.assertRaises(ValueError, checkpointer.set_score, 4, 0.)
+        checkpointer.close()
+
+        self.assertEqual([(c['iteration'], c['score']) for c in checkpointer.checkpoints],
+                         [(3, 2.), (5, 1.), (8, None)])
+        self.assertTrue(checkpointer.best().endswith("checkpoint_000000005.npz"))
+        self.assertEqual((checkpointer.scores, checkpointer.pending), ({}, {}))
+
+    def test_no_checkpoint(self):
+
+        checkpointer = Checkpointer(self.directory, [])
+        self.assertIsNone(checkpointer.restore())
+        checkpointer.close()
+
+    @unittest.skipIf(theano.config.floatX != 'float32', "ModelBuilder conv models need floatX=float32")
+    def test_resume_training(self):
+
+        mb = ModelBuilder((2, 6, 1, 6, 6))
+        mb.add_conv_layer((3, 3, 1, 3, 3))
+        mb.add_flatten_layer()
+        mb.add_hidden_layer(10, relu)
+        mb.add_recon_layer(5, T.nnet.sigmoid)
+        model = mb.build_model(T.matrix('y'), use_cache=False)
+        params = []
+        for layer in model.layers:
+            params += layer.params
+
+        rng = np.random.RandomState(0)
+        batches = [(rng.rand(2, 6, 1, 6, 6).astype(np.float32), (rng.rand(2, 5) > .5).astype(np.float32))
+                   for i in xrange(3)]
+
+        checkpointer = Checkpointer(self.directory, params, model.accumulators, random_streams(model.train))
+        self.assertEqual(len(checkpointer.random_streams), 2)
+        model.train(*batches[0])
+        checkpointer.save(0, patience=10)
+        expected_draw = np.random.rand()
+        expected_costs = [model.train(x, y) for x, y in batches[1:]]
+        expected_params = [p.get_value() for p in params]
+
+        #training again from the checkpoint repeats the dropout masks, the
+        #RMSprop steps and the numpy random draws
+        self.assertEqual(checkpointer.restore(), {'iteration': 0, 'patience': 10})
+        self.assertEqual(np.random.rand(), expected_draw)
+        self.assertEqual([model.train(x, y) for x, y in batches[1:]], expected_costs)
+        for p, expected in zip(params, expected_params):
+            self.assertTrue(np.array_equal(p.get_value(), expected))
+        checkpointer.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import unittest
+import numpy as np
+import theano
+import theano.tensor as T
+
+from layers.layer_utils import relu
+from models.data_parallel import DataParallelTrainer
+from models.model_builder import ModelBuilder
+
+
+def model_builder(batch_size):
+    mb = ModelBuilder((batch_size, 6, 1, 6, 6))
+    mb.add_conv_layer((3, 3, 1, 3, 3))
+    mb.add_flatten_layer()
+    mb.add_hidden_layer(10, relu)
+    mb.add_recon_layer(5, T.nnet.sigmoid)
+    #train on the inference graph, without dropout, so that runs are deterministic
+    mb.layers[-1].train_output = mb.layers[-1].output
+    return mb
+
+
+@unittest.skipIf(theano.config.floatX != 'float32', "ModelBuilder conv models need floatX=float32")
+class TestDataParallel(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.batches = [(rng.rand(4, 6, 1, 6, 6).astype(np.float32), (rng.rand(4, 5) > .5).astype(np.float32))
+                        for i in xrange(3)]
+
+    def test_matches_single_process(self):
+
+        single = model_builder(4)
+        model = single.build_model(T.matrix('y'), use_cache=False)
+
+        #start from the same weights (the initialization depends on the shapes)
+        mb = model_builder(2)
+        for layer, single_layer in zip(mb.layers, single.layers):
+            for p, single_p in zip(layer.params, single_layer.params):
+                p.set_value(single_p.get_value())
+        expected_costs = [model.train(x, y) for x, y in self.batches]
+        trainer = DataParallelTrainer(mb, T.matrix('y'), num_workers=2)
+        try:
+            costs = [trainer.model.train(x, y) for x, y in self.batches]
+            x, y = self.batches[0]
+            self.assertTrue(np.allclose(trainer.model.test(x, y), model.test(x, y), rtol=1e-4))
+        finally:
+            trainer.close()
+
+        self.assertTrue(np.allclose(costs, expected_costs, rtol=1e-4))
+        for layer, expected_layer in zip(mb.layers, single.layers):
+            for p, expected_p in zip(layer.params, expected_layer.params):
+                self.assertTrue(np.allclose(p.get_value(), expected_p.get_value(), rtol=1e-4, atol=1e-6))
+
+    def test_sync_after_changing_parameters(self):
+
+        single = model_builder(4)
+        model = single.build_model(T.matrix('y'), use_cache=False)
+        mb = model_builder(2)
+        for layer, single_layer in zip(mb.layers, single.layers):
+            for p, single_p in zip(layer.params, single_layer.params):
+                p.set_value(single_p.get_value())
+
+        def scale_hidden(layers):
+            W = layers[2].W
+            W.set_value(W.get_value() * 2)
+
+        trainer = DataParallelTrainer(mb, T.matrix('y'), num_workers=2)
+        try:
+            costs, expected_costs = [], []
+            for i, (x, y) in enumerate(self.batches):
+                if i == 1:
+                    #as a restore would, after the workers are forked
+                    scale_hidden(single.layers)
+                    scale_hidden(mb.layers)
+                    trainer.sync()
+                expected_costs.append(model.train(x, y))
+                costs.append(trainer.model.train(x, y))
+        finally:
+            trainer.close()
+
+        self.assertTrue(np.allclose(costs, expected_costs, rtol=1e-4))
+
+    def test_minibatch_size(self):
+
+        trainer = DataParallelTrainer(model_builder(2), T.matrix('y'), num_workers=2)
+        try:
+            x, y = self.batches[0]
+            self.assertRaises(ValueError, trainer.train, x[:3], y[:3])
+        finally:
+            trainer.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
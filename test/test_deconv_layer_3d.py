@@ -0,0 +1,65 @@
+import itertools
+import unittest
+import numpy as np
+import theano
+import theano.tensor as T
+
+from layers.deconv_layer_3d import DeconvLayer3D
+from models.conv_hidden_recon_model_config import ConvHiddenReconModelConfig
+
+
+def transposed_conv_numpy(x, W, upsample):
+    """Every input voxel adds its filter-weighted copy of the kernel at upsample * its position."""
+    batch_size, zdim, nchannels, xdim, ydim = x.shape
+    nfilters, fz, _, fx, fy = W.shape
+    full = np.zeros((batch_size, (zdim - 1) * upsample + fz, nfilters,
+                     (xdim - 1) * upsample + fx, (ydim - 1) * upsample + fy))
+    for az, ax, ay in itertools.product(range(fz), range(fx), range(fy)):
+        full[:, az:az + (zdim - 1) * upsample + 1:upsample, :,
+             ax:ax + (xdim - 1) * upsample + 1:upsample,
+             ay:ay + (ydim - 1) * upsample + 1:upsample] += np.einsum('bzcxy,fc->bzfxy', x, W[:, az, :, ax, ay])
+
+    cz, cx, cy = [(f - upsample) // 2 for f in (fz, fx, fy)]
+    return full[:, cz:cz + zdim * upsample, :, cx:cx + xdim * upsample, cy:cy + ydim * upsample]
+
+
+class TestDeconvLayer3d(unittest.TestCase):
+
+    def test_matches_numpy_reference(self):
+
+        rng = np.random.RandomState(0)
+        image_shape = (2, 3, 2, 4, 2)
+        filter_shape = (3, 4, 2, 3, 2)
+        x_value = rng.rand(*image_shape).astype(theano.config.floatX)
+        W = theano.shared(rng.rand(*filter_shape).astype(theano.config.floatX))
+
+        x = T.TensorType(theano.config.floatX, (0,)*5)()
+        layer = DeconvLayer3D(rng, x, filter_shape, image_shape, upsample=2, activation=None, W=W)
+        out = theano.function([x], layer.output)(x_value)
+
+        expected = transposed_conv_numpy(x_value, W.get_value(), 2) + 1
+        self.assertEqual(out.shape, layer.output_shape)
+        self.assertEqual(layer.output_shape, (2, 6, 3, 8, 4))
+        self.assertTrue(np.allclose(out, expected))
+
+    @unittest.skipIf(theano.config.floatX != 'float32', "ModelBuilder conv models need floatX=float32")
+    def test_recon_model_with_decoder(self):
+
+        model_config = ConvHiddenReconModelConfig(batch_size=2, conv_size=(3,), downsample_factor=1, nkerns=(4,),
+                                                  nhidden=(20,), decoder_nkerns=(4, 2), xdim=8, ydim=8, zdim=8)
+        model = model_config.build_model()
+        self.assertEqual(model.layers[-1].output_shape, (2, 8, 1, 8, 8))
+
+        #parameters of the decoder do not depend on the output resolution
+        self.assertEqual(model.layers[-1].W.get_value().shape, (1, 4, 2, 4, 4))
+
+        rng = np.random.RandomState(0)
+        x = (rng.rand(2, 8, 1, 8, 8) > .5).astype(np.float32)
+        y = x.reshape(2, -1)
+        costs = [model.train(x, y) for i in range(3)]
+        self.assertTrue(np.all(np.isfinite(costs)))
+        self.assertTrue(0 <= model.test(x, y) <= 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import unittest
+import shutil
+import tempfile
+import os
+
+import numpy as np
+
+from utils import digit_volumes
+
+
+class TestDigitVolumes(unittest.TestCase):
+
+    def setUp(self):
+
+        self.flat_images = np.random.RandomState(0).rand(30, 28 * 28)
+        self.cache_dir = tempfile.mkdtemp()
+        self.source_filepath = os.path.join(self.cache_dir, 'mnist.pkl.gz')
+        with open(self.source_filepath, 'wb') as f:
+            f.write('not really mnist')
+
+    def tearDown(self):
+
+        shutil.rmtree(self.cache_dir)
+
+    def test_resize_keeps_constant_images_constant(self):
+
+        images = np.ones((2, 28, 28)) * np.array([0, 1])[:, None, None]
+
+        resized = digit_volumes.resize_images(images, 20)
+
+        self.assertEqual(resized.shape, (2, 20, 20))
+        self.assertEqual(resized.dtype, np.uint8)
+        #a constant image has no range to scale to 0-255, it maps to 0
+        self.assertTrue(np.all(resized[0] == 0))
+        self.assertTrue(np.all(resized[1] == 0))
+        self.assertTrue(np.allclose(digit_volumes.bilinear_matrix(28, 20).sum(axis=1), 1))
+
+    def test_zero_angle_extrusion_is_a_sheet(self):
+
+        images = np.arange(2 * 20 * 20).reshape(2, 20, 20) % 255 + 1
+        volumes = digit_volumes.extrude_digits(images.astype(np.uint8), max_angle=0)
+
+        self.assertEqual(volumes.shape, (2, 20, 20, 20))
+        self.assertTrue(np.array_equal(volumes[:, 9, :, :], images))
+        self.assertEqual(np.count_nonzero(volumes), images.size)
+
+    def test_cache_round_trip(self):
+
+        volumes = digit_volumes.cached_digit_volumes(self.source_filepath, 'train', self.flat_images,
+                                                     num_examples=10)
+        cache_files = [f for f in os.listdir(self.cache_dir) if f.startswith('digit_volumes_train')]
+        self.assertEqual(len(cache_files), 1)
+
+        cached = digit_volumes.cached_digit_volumes(self.source_filepath, 'train', self.flat_images,
+                                                    num_examples=10)
+        self.assertTrue(np.array_equal(volumes, cached))
+        self.assertEqual(volumes.shape, (10, 20, 20, 20))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,156 @@
+import multiprocessing
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+import numpy as np
+import theano
+import theano.tensor as T
+
+from models.distributed import DistributedTrainer, ParameterServer, ShardedSampler, send_message, recv_message
+from test_data_parallel import model_builder
+
+
+def free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+class TestMessages(unittest.TestCase):
+
+    def test_round_trip(self):
+
+        a, b = socket.socketpair()
+        arrays = [np.arange(24, dtype=np.float32).reshape(2, 3, 4), np.array(7, dtype=np.int64)]
+        send_message(a, 'push', step=5, rank=2, cost=.25, arrays=arrays)
+        send_message(a, 'close')
+
+        message = recv_message(b)
+        self.assertEqual((message.command, message.step, message.rank, message.cost), ('push', 5, 2, .25))
+        for received, sent in zip(message.arrays, arrays):
+            self.assertEqual(received.dtype, sent.dtype)
+            self.assertTrue(np.array_equal(received, sent))
+        self.assertEqual(recv_message(b), ('close', 0, 0, 0., []))
+
+        #only plain arrays cross the wire
+        self.assertRaises(ValueError, send_message, a, 'push', arrays=[np.array([None])])
+        a.close()
+        b.close()
+
+
+class TestParameterServer(unittest.TestCase):
+
+    def test_bounded_staleness(self):
+
+        server = ParameterServer([np.ones(3, dtype=np.float32)], num_workers=2, staleness=1)
+        gradient = [np.ones(3, dtype=np.float32)]
+
+        #one step ahead is allowed, two are not
+        self.assertEqual(server.pull(1)[0], 0)
+        result = []
+        thread = threading.Thread(target=lambda: result.append(server.pull(2)))
+        thread.start()
+        thread.join(.2)
+        self.assertTrue(thread.is_alive())
+
+        #the step is applied once every rank pushed it
+        server.push(1, 0, gradient, 1.)
+        self.assertEqual(server.version, 0)
+        server.push(0, 0, gradient, 3.)
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        version, params = result[0]
+        self.assertEqual(version, 1)
+        self.assertTrue(np.all(params[0] < 1))
+        self.assertEqual(server.costs, [2.])
+
+    def test_steps_apply_in_order(self):
+
+        server = ParameterServer([np.zeros(2, dtype=np.float32)], num_workers=1, staleness=2)
+        server.push(0, 1, [np.ones(2, dtype=np.float32)], 0.)
+        self.assertEqual(server.version, 0)
+        server.push(0, 0, [np.ones(2, dtype=np.float32)], 0.)
+        self.assertEqual(server.version, 2)
+
+
+class TestShardedSampler(unittest.TestCase):
+
+    def test_shards(self):
+
+        samplers = [ShardedSampler(10, 2, rank, 2, seed=3) for rank in xrange(2)]
+        steps = [[sampler.next() for i in xrange(2)] for sampler in samplers]
+        indices = np.concatenate([np.concatenate(s) for s in steps])
+        self.assertEqual(len(set(indices)), 8)
+
+        #the next epoch reshuffles, and the position can be restored
+        state = samplers[0].get_state()
+        expected = samplers[0].next()
+        self.assertEqual(samplers[0].get_state(), (1, 1))
+        samplers[0].set_state(state)
+        self.assertTrue(np.array_equal(samplers[0].next(), expected))
+
+
+def run_rank(rank, world_size, port, batches):
+    trainer = DistributedTrainer(model_builder(2), T.matrix('y'), rank, world_size, ('127.0.0.1', port))
+    for x, y in batches:
+        trainer.train(x[2 * rank:2 * rank + 2], y[2 * rank:2 * rank + 2])
+    trainer.close()
+
+
+@unittest.skipIf(theano.config.floatX != 'float32', "ModelBuilder conv models need floatX=float32")
+class TestDistributedTrainer(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_matches_single_process(self):
+
+        rng = np.random.RandomState(0)
+        batches = [(rng.rand(4, 6, 1, 6, 6).astype(np.float32), (rng.rand(4, 5) > .5).astype(np.float32))
+                   for i in xrange(3)]
+
+        #the server starts from the weights of rank 0
+        mb = model_builder(2)
+        single = model_builder(4)
+        for layer, single_layer in zip(mb.layers, single.layers):
+            for p, single_p in zip(layer.params, single_layer.params):
+                single_p.set_value(p.get_value())
+        model = single.build_model(T.matrix('y'), use_cache=False)
+        for x, y in batches:
+            model.train(x, y)
+
+        port = free_port()
+        process = multiprocessing.Process(target=run_rank, args=(1, 2, port, batches))
+        process.start()
+
+        trainer = DistributedTrainer(mb, T.matrix('y'), 0, 2, ('127.0.0.1', port))
+        for x, y in batches:
+            trainer.train(x[:2], y[:2])
+        #the last update needs the gradients of rank 1
+        self.assertEqual(trainer.sync(), 3)
+
+        filepath = os.path.join(self.tmp_dir, "checkpoint.npz")
+        self.assertTrue(trainer.checkpoint(filepath))
+        trainer.close()
+        process.join()
+        self.assertEqual(process.exitcode, 0)
+
+        for layer, single_layer in zip(mb.layers, single.layers):
+            for p, single_p in zip(layer.params, single_layer.params):
+                self.assertTrue(np.allclose(p.get_value(), single_p.get_value(), rtol=1e-3, atol=1e-5))
+
+        with np.load(filepath) as checkpoint:
+            self.assertEqual(checkpoint['version'], 3)
+            self.assertTrue(np.array_equal(checkpoint['param_0'], mb.layers[0].params[0].get_value()))
+
+
+if __name__ == '__main__':
+    unittest.main()
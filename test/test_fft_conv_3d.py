@@ -0,0 +1,91 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import theano
+import theano.tensor as T
+from theano.tensor.nnet.conv3d2d import conv3d
+
+from layers import conv_autotune
+from layers.fft_conv_3d import fft_conv3d
+from layers.conv_layer_3d import ConvLayer3D
+from utils import cache
+
+
+class TestFFTConv3d(unittest.TestCase):
+
+    def setUp(self):
+
+        self.image_shape = (2, 7, 3, 6, 5)
+        self.filter_shape = (4, 3, 3, 2, 3)
+        rng = np.random.RandomState(0)
+        self.signals = rng.rand(*self.image_shape).astype(theano.config.floatX)
+        self.filters = rng.rand(*self.filter_shape).astype(theano.config.floatX)
+
+        dtensor5 = T.TensorType(theano.config.floatX, (0,)*5)
+        self.s = dtensor5()
+        self.w = dtensor5()
+
+    def compile(self, conv):
+        out = conv(signals=self.s, filters=self.w, signals_shape=self.image_shape,
+                   filters_shape=self.filter_shape, border_mode='valid')
+        #a non uniform output gradient so that flipped kernels are caught
+        cost = (out * T.arange(out.size).reshape(out.shape)).sum()
+        return theano.function([self.s, self.w], [out] + T.grad(cost, [self.s, self.w]))
+
+    def test_matches_conv3d2d(self):
+
+        expected = self.compile(conv3d)(self.signals, self.filters)
+        out = self.compile(fft_conv3d)(self.signals, self.filters)
+
+        for a, b in zip(out, expected):
+            self.assertEqual(a.shape, b.shape)
+            self.assertTrue(np.allclose(a, b, rtol=1e-3, atol=1e-3))
+
+    def test_border_mode(self):
+
+        self.assertRaises(ValueError, fft_conv3d, self.s, self.w, border_mode='full')
+
+    def test_conv_layer_impl(self):
+
+        f = theano.function([self.s], ConvLayer3D(np.random.RandomState(0), self.s, self.filter_shape,
+                                                  self.image_shape, drop=0, conv_impl='fft').output)
+        self.assertEqual(f(self.signals).shape, (2, 5, 4, 5, 3))
+
+        self.assertRaises(ValueError, ConvLayer3D, np.random.RandomState(0), self.s, self.filter_shape,
+                          self.image_shape, drop=0, conv_impl='direct')
+
+
+class TestConvAutotune(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        os.environ[cache.CACHE_DIR_ENV] = self.cache_dir
+        conv_autotune._chosen.clear()
+
+    def tearDown(self):
+        del os.environ[cache.CACHE_DIR_ENV]
+        conv_autotune._chosen.clear()
+        shutil.rmtree(self.cache_dir)
+
+    def test_winner_is_cached_on_disk(self):
+
+        image_shape = (1, 6, 1, 6, 6)
+        filter_shape = (2, 3, 1, 3, 3)
+        best = conv_autotune.choose_conv_impl(image_shape, filter_shape, num_repeats=1)
+        self.assertIn(best, conv_autotune.CONV_IMPLS)
+
+        tuned = cache.load_json(conv_autotune.CACHE_FILENAME)
+        key = conv_autotune.shape_key(image_shape, filter_shape)
+        self.assertEqual(tuned[key]['best'], best)
+
+        #a later build reads the winner back instead of timing again
+        tuned[key]['best'] = 'fft'
+        cache.save_json(conv_autotune.CACHE_FILENAME, tuned)
+        conv_autotune._chosen.clear()
+        self.assertEqual(conv_autotune.choose_conv_impl(image_shape, filter_shape), 'fft')
+
+
+if __name__ == '__main__':
+    unittest.main()
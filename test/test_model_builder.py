@@ -0,0 +1,232 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import theano
+import theano.tensor as T
+from theano.tensor.raw_random import RandomFunction
+from theano.scalar import Switch
+
+from layers.layer_utils import relu
+from models.model_builder import ModelBuilder
+from utils import cache
+
+
+def graph_ops(outputs):
+    apply_nodes = theano.gof.graph.io_toposort(theano.gof.graph.inputs(outputs), outputs)
+    return [node.op for node in apply_nodes]
+
+
+def is_switch(op):
+    return isinstance(op, T.Elemwise) and isinstance(op.scalar_op, Switch)
+
+
+@unittest.skipIf(theano.config.floatX != 'float32', "ModelBuilder conv models need floatX=float32")
+class TestModelBuilder(unittest.TestCase):
+
+    def setUp(self):
+        self.mb = self.model_builder()
+
+        rng = np.random.RandomState(0)
+        self.x = rng.rand(2, 6, 1, 6, 6).astype(np.float32)
+        self.y = (rng.rand(2, 5) > .5).astype(np.float32)
+
+        self.cache_dir = tempfile.mkdtemp()
+        os.environ[cache.CACHE_DIR_ENV] = self.cache_dir
+
+    def tearDown(self):
+        del os.environ[cache.CACHE_DIR_ENV]
+        shutil.rmtree(self.cache_dir)
+
+    def model_builder(self, n_out=5):
+        mb = ModelBuilder((2, 6, 1, 6, 6))
+        mb.add_conv_layer((3, 3, 1, 3, 3))
+        mb.add_max_pool_layer(2)
+        mb.add_flatten_layer()
+        mb.add_hidden_layer(10, relu)
+        mb.add_recon_layer(n_out, T.nnet.sigmoid)
+        return mb
+
+    def test_inference_graph_has_no_dropout(self):
+
+        last = self.mb.layers[-1]
+        inference_ops = graph_ops([last.output])
+        train_ops = graph_ops([last.train_output])
+
+        self.assertFalse(any(isinstance(op, RandomFunction) for op in inference_ops))
+        self.assertEqual(sum(isinstance(op, RandomFunction) for op in train_ops), 2)
+        self.assertFalse(any(is_switch(op) for op in inference_ops + train_ops))
+
+    def test_one_voxel_feature_maps(self):
+
+        #a 1^3 feature map is broadcastable on its spatial axes, the training
+        #graph (with dropout) has to keep that pattern for the next layer
+        mb = ModelBuilder((2, 3, 1, 3, 3))
+        mb.add_conv_layer((4, 3, 1, 3, 3))
+        mb.add_conv_layer((4, 1, 4, 1, 1))
+        mb.add_flatten_layer()
+        mb.add_hidden_layer(10, relu)
+        mb.add_logistic_regression_layer(5)
+        self.assertEqual(mb.layers[1].train_output.broadcastable, mb.layers[1].output.broadcastable)
+
+        model = mb.build_model(T.matrix('y'))
+        x = np.random.RandomState(4).rand(2, 3, 1, 3, 3).astype(np.float32)
+        self.assertTrue(np.isfinite(model.train(x, self.y)))
+
+    def test_compiled_functions(self):
+
+        model = self.mb.build_model(T.matrix('y'))
+
+        test_ops = [node.op for node in model.test.maker.fgraph.toposort()]
+        train_ops = [node.op for node in model.train.maker.fgraph.toposort()]
+        self.assertFalse(any(isinstance(op, RandomFunction) for op in test_ops))
+        self.assertTrue(any(isinstance(op, RandomFunction) for op in train_ops))
+
+        #inference is deterministic
+        self.assertEqual(model.test(self.x, self.y), model.test(self.x, self.y))
+        self.assertTrue(np.isfinite(model.train(self.x, self.y)))
+        self.assertIs(model.validate, model.test)
+
+    def test_function_cache(self):
+
+        model = self.mb.build_model(T.matrix('y'))
+        self.assertFalse(self.mb.cache_hit)
+        expected_error = model.test(self.x, self.y)
+
+        mb = self.model_builder()
+        for layer, built_layer in zip(mb.layers, self.mb.layers):
+            for p, built_p in zip(layer.params, built_layer.params):
+                p.set_value(built_p.get_value())
+        initial_W = mb.layers[0].W.get_value()
+        cached_model = mb.build_model(T.matrix('y'))
+        self.assertTrue(mb.cache_hit)
+
+        #the cached functions start from the new builder's parameters and update its layers
+        self.assertEqual(cached_model.test(self.x, self.y), expected_error)
+        cached_model.train(self.x, self.y)
+        self.assertFalse(np.allclose(mb.layers[0].W.get_value(), initial_W))
+        self.assertIn(mb.layers[0].W, mb.layers[0].params)
+
+        #and so do the layers' expressions, compiled after the cache hit
+        output = theano.function([mb.layers[0].input], mb.layers[-1].output)
+        predictions = output(self.x)
+        mb.layers[0].W.set_value(mb.layers[0].W.get_value() * 0)
+        self.assertFalse(np.allclose(output(self.x), predictions))
+        self.assertIs(mb.layers[1].input, mb.layers[0].output)
+        gradients = mb.build_gradient_functions(T.matrix('y'))['gradients'](self.x, self.y)
+        self.assertTrue(all(np.isfinite(g).all() for g in gradients))
+
+        #a different architecture misses
+        mb = self.model_builder(n_out=4)
+        mb.build_model(T.matrix('y'))
+        self.assertFalse(mb.cache_hit)
+
+    def test_gradient_accumulation(self):
+
+        mb = self.model_builder()
+        full = ModelBuilder((4, 6, 1, 6, 6))
+        full.add_conv_layer((3, 3, 1, 3, 3))
+        full.add_max_pool_layer(2)
+        full.add_flatten_layer()
+        full.add_hidden_layer(10, relu)
+        full.add_recon_layer(5, T.nnet.sigmoid)
+        #train on the inference graph, without dropout, so that runs are deterministic
+        for builder in (full, mb):
+            builder.layers[-1].train_output = builder.layers[-1].output
+        for layer, full_layer in zip(mb.layers, full.layers):
+            for p, full_p in zip(layer.params, full_layer.params):
+                p.set_value(full_p.get_value())
+
+        rng = np.random.RandomState(1)
+        batches = [(rng.rand(4, 6, 1, 6, 6).astype(np.float32), (rng.rand(4, 5) > .5).astype(np.float32))
+                   for i in xrange(2)]
+        model = full.build_model(T.matrix('y'))
+        accumulating_model = mb.build_model(T.matrix('y'), num_micro_batches=2)
+
+        #two micro-batches of 2 make the step of a minibatch of 4
+        for x, y in batches:
+            self.assertTrue(np.allclose(accumulating_model.train(x, y), model.train(x, y), rtol=1e-5))
+        for layer, full_layer in zip(mb.layers, full.layers):
+            for p, full_p in zip(layer.params, full_layer.params):
+                self.assertTrue(np.allclose(p.get_value(), full_p.get_value(), rtol=1e-4, atol=1e-6))
+        self.assertTrue(np.allclose(accumulating_model.test(*batches[0]), model.test(*batches[0])))
+
+        self.assertRaises(ValueError, accumulating_model.train, self.x, self.y)
+
+    def test_any_batch_size(self):
+
+        mb = ModelBuilder((None, 6, 1, 6, 6))
+        mb.add_conv_layer((3, 3, 1, 3, 3))
+        mb.add_max_pool_layer(2)
+        mb.add_flatten_layer()
+        mb.add_unflatten_layer((2, 3, 2, 2))
+        mb.add_deconv_layer(1, upsample=2)
+        mb.add_flatten_layer()
+        mb.add_recon_layer(5, T.nnet.sigmoid)
+        self.assertEqual(mb.layers[4].output_shape, (None, 4, 1, 4, 4))
+        model = mb.build_model(T.matrix('y'))
+
+        rng = np.random.RandomState(2)
+        for n in (1, 3, 7):
+            x = rng.rand(n, 6, 1, 6, 6).astype(np.float32)
+            y = (rng.rand(n, 5) > .5).astype(np.float32)
+            self.assertTrue(np.isfinite(model.train(x, y)))
+            self.assertTrue(0 <= model.test(x, y) <= 1)
+
+        self.assertRaises(ValueError, mb.build_model, T.matrix('y'), num_micro_batches=2)
+
+    def test_inference_model(self):
+
+        model = self.mb.build_model(T.matrix('y'))
+        inference = self.mb.build_inference_model(T.matrix('y'), batch_size=3)
+        self.assertEqual(inference.batch_size, 3)
+
+        rng = np.random.RandomState(3)
+        x = rng.rand(8, 6, 1, 6, 6).astype(np.float32)
+        y = (rng.rand(8, 5) > .5).astype(np.float32)
+        outputs = inference.predict(x)
+        self.assertEqual(outputs.shape, (8, 5))
+
+        #the same parameters as the training model, which takes batches of 2
+        expected_error = np.mean([model.test(x[i:i + 2], y[i:i + 2]) for i in xrange(0, 8, 2)])
+        self.assertAlmostEqual(inference.test(x, y), expected_error, places=6)
+
+        #and it follows their updates
+        W = self.mb.layers[0].W
+        W.set_value(W.get_value() * 0)
+        self.assertFalse(np.allclose(inference.predict(x), outputs))
+
+        #an inference batch size makes test and validate run through it
+        large = self.model_builder().build_model(T.matrix('y'), inference_batch_size=16)
+        self.assertIs(large.validate, large.test)
+        self.assertTrue(0 <= large.test(x[:5], y[:5]) <= 1)
+
+    def test_inference_function_cache(self):
+        x = np.random.RandomState(4).rand(5, 6, 1, 6, 6).astype(np.float32)
+
+        first = self.mb.build_inference_model(T.matrix('y'))
+        self.assertFalse(self.mb.inference_cache_hit)
+        self.assertGreaterEqual(self.mb.inference_build_time, 0)
+
+        other = self.model_builder()
+        second = other.build_inference_model(T.matrix('y'))
+        self.assertTrue(other.inference_cache_hit)
+
+        #the cached functions run on the parameters of the builder that loads them
+        for layer, other_layer in zip(self.mb.layers, other.layers):
+            for param, other_param in zip(layer.params, other_layer.params):
+                other_param.set_value(param.get_value())
+        np.testing.assert_allclose(second.predict(x), first.predict(x), rtol=1e-5)
+        W = other.layers[0].W
+        W.set_value(W.get_value() * 0)
+        self.assertFalse(np.allclose(second.predict(x), first.predict(x)))
+
+        #without y there is no test function, under a key of its own
+        predict_only = self.model_builder().build_inference_model()
+        self.assertIsNone(predict_only.test)
+        self.assertEqual(predict_only.predict(x).shape, (5, 5))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import theano
+import theano.tensor as T
+
+from layers.layer_utils import relu, pool_3d, pool_3d_numpy
+from models import numpy_model
+from models.export_model import export_model
+from models.model_builder import ModelBuilder
+
+
+class TestNumpyModel(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.rng = np.random.RandomState(0)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def randomize(self, mb):
+        #the default initialization is too close to zero to tell layers apart
+        for layer in mb.layers:
+            for p in layer.params:
+                p.set_value((self.rng.rand(*p.get_value().shape) - .5).astype(p.dtype))
+
+    def assert_matches_theano(self, mb, x):
+        self.randomize(mb)
+        expected = theano.function([mb.layers[0].input], mb.layers[-1].output)(x)
+
+        prefix = os.path.join(self.tmp_dir, "model")
+        export_model(mb.layers, prefix)
+        out = numpy_model.NumpyModel.load(prefix).predict(x)
+
+        self.assertEqual(out.shape, expected.shape)
+        self.assertTrue(np.allclose(out, expected, rtol=1e-4, atol=1e-4))
+
+    @unittest.skipIf(theano.config.floatX != 'float32', "ModelBuilder conv models need floatX=float32")
+    def test_conv_pool_dense(self):
+
+        mb = ModelBuilder((3, 9, 2, 8, 7))
+        mb.add_conv_layer((4, 3, 2, 3, 3))
+        mb.add_max_pool_layer(2)
+        mb.add_conv_layer((3, 2, 4, 2, 2))
+        mb.add_max_pool_layer(2, ignore_border=True, padding=1, mode='average')
+        mb.add_flatten_layer()
+        mb.add_hidden_layer(10, relu)
+        mb.add_recon_layer(6, T.nnet.sigmoid)
+
+        self.assert_matches_theano(mb, self.rng.rand(3, 9, 2, 8, 7).astype(np.float32))
+
+    @unittest.skipIf(theano.config.floatX != 'float32', "ModelBuilder conv models need floatX=float32")
+    def test_deconv_decoder(self):
+
+        mb = ModelBuilder((2, 6, 1, 6, 6))
+        mb.add_conv_layer((2, 3, 1, 3, 3))
+        mb.add_flatten_layer()
+        mb.add_hidden_layer(24, relu)
+        mb.add_unflatten_layer((2, 3, 2, 2))
+        mb.add_deconv_layer(2, filter_size=4)
+        mb.add_deconv_layer(1, filter_size=3, activation=T.nnet.sigmoid)
+
+        self.assert_matches_theano(mb, self.rng.rand(2, 6, 1, 6, 6).astype(np.float32))
+
+    def test_pool_3d(self):
+
+        x = self.rng.rand(2, 7, 3, 6, 5)
+        for ds, st, padding, ignore_border in [(2, 2, 0, False), (3, 2, 1, True), (2, 1, 0, True)]:
+            for mode in ('max', 'average'):
+                expected = pool_3d_numpy(x, ds, st, padding, ignore_border, mode)
+                out = numpy_model.pool_3d(x, expected.shape, ds, st, padding, mode)
+                self.assertTrue(np.allclose(out, expected))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import unittest
+import numpy as np
+import theano
+import theano.tensor as T
+
+from layers.layer_utils import pool_3d, pool_3d_numpy, pool_3d_output_shape, max_pool_3d, max_pool_3d_numpy
+from layers.max_pool_layer_3d import MaxPoolLayer3D
+
+
+class TestPool3d(unittest.TestCase):
+
+    def setUp(self):
+
+        self.input_shape = (2, 7, 3, 6, 5)
+        self.input = np.random.RandomState(0).rand(*self.input_shape).astype(np.float32)
+
+        dtensor5 = theano.tensor.TensorType('float32', (0,)*5)
+        self.x = dtensor5()
+
+    def pool(self, **kwargs):
+        f = theano.function([self.x], pool_3d(self.x, self.input_shape, **kwargs))
+        return f(self.input)
+
+    def test_matches_numpy_reference(self):
+
+        for ds, st, padding, ignore_border in [(2, None, 0, False),
+                                               (2, None, 0, True),
+                                               (3, 2, 0, False),
+                                               (3, 2, 1, True),
+                                               (2, 1, 0, True)]:
+            for mode in ('max', 'average'):
+                kwargs = dict(ds=ds, st=st, padding=padding, ignore_border=ignore_border, mode=mode)
+                out = self.pool(**kwargs)
+                expected = pool_3d_numpy(self.input, **kwargs)
+
+                self.assertEqual(out.shape, pool_3d_output_shape(self.input_shape, ds, st, padding, ignore_border))
+                self.assertTrue(np.allclose(out, expected), str(kwargs))
+
+    def test_padding_smaller_than_ds(self):
+
+        for padding in (2, 3):
+            self.assertRaises(ValueError, pool_3d_numpy, self.input, 2, 2, padding=padding, ignore_border=True)
+            self.assertRaises(ValueError, pool_3d, self.x, self.input_shape, 2, 2, padding=padding,
+                              ignore_border=True, mode='average')
+
+    def test_matches_max_pool_3d_numpy(self):
+
+        input = self.input[:, :6, :, :6, :4]
+        f = theano.function([self.x], pool_3d(self.x, input.shape, 2))
+
+        self.assertTrue(np.allclose(f(input), max_pool_3d_numpy(input, 2)))
+
+    def test_max_pool_3d(self):
+
+        f = theano.function([self.x], max_pool_3d(self.x, self.input_shape, 3, st=2, padding=1, ignore_border=True))
+
+        expected = pool_3d_numpy(self.input, ds=3, st=2, padding=1, ignore_border=True, mode='max')
+        self.assertTrue(np.allclose(f(self.input), expected))
+
+    def test_average_gradient(self):
+
+        rng = np.random.RandomState(1)
+        shape = (1, 5, 2, 4, 4)
+        T.verify_grad(lambda x: pool_3d(x, shape, 3, st=2, padding=1, ignore_border=True, mode='average'),
+                      [rng.rand(*shape)], rng=rng)
+
+    def test_layer_output_shape(self):
+
+        layer = MaxPoolLayer3D(self.x, self.input_shape, ds=2)
+
+        self.assertEqual(layer.get_output_shape(), (2, 4, 3, 3, 3))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import time
+import unittest
+import numpy as np
+import theano
+import theano.tensor as T
+
+from layers.layer_utils import relu
+from models.model_builder import ModelBuilder
+from models.conv_hidden_classifier import ConvHiddenClassifyModelConfig
+from models.progressive import TimeToTarget, parse_schedule, resample, transfer_params
+
+
+def model_layers(patch_size):
+    mb = ModelBuilder((2, patch_size, 1, patch_size, patch_size))
+    mb.add_conv_layer((3, 3, 1, 3, 3))
+    mb.add_flatten_layer()
+    mb.add_hidden_layer(5, relu)
+    mb.add_recon_layer(patch_size ** 3, T.nnet.sigmoid)
+    return mb.layers
+
+
+class TestProgressive(unittest.TestCase):
+
+    def test_parse_schedule(self):
+
+        self.assertEqual(parse_schedule([(4, 2), {'downsample_factor': 1, 'epochs': 3}]),
+                         [{'downsample_factor': 4, 'epochs': 2}, {'downsample_factor': 1, 'epochs': 3}])
+        self.assertRaises(ValueError, parse_schedule, [(1, 2), (4, 2)])
+        self.assertRaises(ValueError, parse_schedule, [(4, 0)])
+        self.assertRaises(ValueError, parse_schedule, [])
+
+        #the default classifier on 256^3 grids: two valid 3^3 convolutions need 5^3 inputs
+        min_input_size = ConvHiddenClassifyModelConfig().min_input_size()
+        self.assertEqual(min_input_size, 5)
+        self.assertEqual(len(parse_schedule([(32, 5), (16, 10)], input_size=256, min_input_size=min_input_size)), 2)
+        self.assertRaises(ValueError, parse_schedule, [(64, 5), (32, 5), (16, 10)], input_size=256,
+                          min_input_size=min_input_size)
+        self.assertRaises(ValueError, parse_schedule, [(3, 5)], input_size=256)
+
+    def test_resample(self):
+
+        ramp = np.arange(4, dtype=np.float32).reshape(1, 4)
+        resampled = resample(ramp, (1,), (7,))
+        self.assertEqual(resampled.shape, (1, 7))
+        self.assertEqual(resampled.dtype, np.float32)
+        self.assertAlmostEqual(resampled[0, 0], 0)
+        self.assertAlmostEqual(resampled[0, -1], 3)
+        self.assertTrue(np.all(np.diff(resampled[0]) > 0))
+
+    @unittest.skipIf(theano.config.floatX != 'float32', "ModelBuilder conv models need floatX=float32")
+    def test_transfer_params(self):
+
+        coarse = model_layers(6)
+        fine = model_layers(10)
+        hidden_W = coarse[2].W
+        hidden_W.set_value(np.ones_like(hidden_W.get_value()))
+        recon_b = coarse[3].b
+        recon_b.set_value(np.tile(np.arange(6, dtype=np.float32), 36))
+
+        report = transfer_params(coarse, fine)
+        self.assertEqual(report, [(0, 'copied'), (2, 'interpolated'), (3, 'interpolated')])
+
+        for p, q in zip(coarse[0].params, fine[0].params):
+            self.assertTrue(np.array_equal(p.get_value(), q.get_value()))
+        #4^3 feature maps spread over 8^3: each input carries 8 times less
+        self.assertTrue(np.allclose(fine[2].W.get_value(), 4 ** 3 / 8. ** 3))
+        self.assertTrue(np.array_equal(fine[2].b.get_value(), coarse[2].b.get_value()))
+        #the recon outputs follow the voxels they stand for
+        b = fine[3].b.get_value().reshape(10, 10, 10)
+        self.assertEqual(fine[3].W.get_value().shape, (5, 1000))
+        self.assertAlmostEqual(b[0, 0, 0], 0)
+        self.assertAlmostEqual(b[0, 0, -1], 5)
+        self.assertTrue(np.all(np.diff(b[3, 3]) >= 0))
+
+        initial = fine[2].W.get_value()
+        hidden_W.set_value(np.zeros_like(hidden_W.get_value()))
+        report = transfer_params(coarse, fine, dense='reinit')
+        self.assertEqual(report, [(0, 'copied'), (2, 'reinitialized'), (3, 'reinitialized')])
+        self.assertTrue(np.array_equal(fine[2].W.get_value(), initial))
+
+        self.assertRaises(ValueError, transfer_params, coarse, fine[:2])
+
+    def test_time_to_target(self):
+
+        time_to_target = TimeToTarget(.1, start_time=time.time() - 5)
+        self.assertFalse(time_to_target.update(10, .3))
+        self.assertIn("not reached", time_to_target.summary())
+        self.assertTrue(time_to_target.update(20, .1))
+        self.assertTrue(time_to_target.update(30, .05))
+        self.assertEqual(time_to_target.iteration, 20)
+        self.assertGreaterEqual(time_to_target.time, 5)
+        self.assertFalse(TimeToTarget(None).update(10, 0.))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import theano
+import theano.tensor as T
+
+from layers.layer_utils import relu
+from models import numpy_model, quantize_model
+from models.export_model import export_model
+from models.model_builder import ModelBuilder
+
+
+class RandomIterator(object):
+
+    def __init__(self, rng, shape, n_out):
+        self.rng = rng
+        self.shape = shape
+        self.n_out = n_out
+
+    def next(self):
+        batch_x = (self.rng.rand(*self.shape) > .7).astype(np.float32)
+        batch_y = (self.rng.rand(self.shape[0], self.n_out) > .5).astype(np.float32)
+        return batch_x, batch_y
+
+
+class TestQuantizeModel(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.rng = np.random.RandomState(0)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_int8_dot_is_exact(self):
+
+        a = self.rng.randint(-127, 128, (5, 3000)).astype(np.int8)
+        b = self.rng.randint(-127, 128, (3000, 4)).astype(np.int8)
+
+        out = numpy_model.int8_dot(a, b)
+        self.assertEqual(out.dtype, np.int32)
+        self.assertTrue(np.array_equal(out, np.dot(a.astype(np.int64), b.astype(np.int64))))
+
+    def test_quantize_per_channel(self):
+
+        W = self.rng.randn(4, 3, 2, 3, 3).astype(np.float32)
+        W[1] *= 100
+        q, scale = quantize_model.quantize_per_channel(W, 0)
+
+        self.assertEqual(q.dtype, np.int8)
+        self.assertEqual(scale.shape, (4,))
+        self.assertTrue(np.allclose(np.abs(q).reshape(4, -1).max(axis=1), 127))
+        error = np.abs(q * scale.reshape(-1, 1, 1, 1, 1) - W).reshape(4, -1).max(axis=1)
+        self.assertTrue(np.all(error <= scale / 2 + 1e-6))
+
+    @unittest.skipIf(theano.config.floatX != 'float32', "ModelBuilder conv models need floatX=float32")
+    def test_quantized_model(self):
+
+        mb = ModelBuilder((3, 8, 1, 8, 8))
+        mb.add_conv_layer((4, 3, 1, 3, 3))
+        mb.add_max_pool_layer(2)
+        mb.add_flatten_layer()
+        mb.add_hidden_layer(20, relu)
+        mb.add_recon_layer(30, T.nnet.sigmoid)
+        for layer in mb.layers:
+            for p in layer.params:
+                p.set_value((self.rng.rand(*p.get_value().shape) - .5).astype(p.dtype))
+
+        prefix = os.path.join(self.tmp_dir, "model")
+        export_model(mb.layers, prefix)
+        model = numpy_model.NumpyModel.load(prefix)
+
+        iterator = RandomIterator(self.rng, (3, 8, 1, 8, 8), 30)
+        ranges = quantize_model.calibrate(model, iterator, num_batches=3)
+        self.assertEqual(sorted(ranges.keys()), [0, 3, 4])
+        self.assertEqual(ranges[0], 1)
+        quantized = quantize_model.quantize_model(model, ranges)
+
+        #the float model is untouched
+        self.assertEqual(model.weights[0]['W'].dtype, np.float32)
+        for index in ranges:
+            self.assertEqual(quantized.weights[index]['W'].dtype, np.int8)
+        self.assertGreater(model.weight_bytes() / float(quantized.weight_bytes()), 3.9)
+
+        x, y = iterator.next()
+        expected = model.predict(x)
+        out = quantized.predict(x)
+        self.assertEqual(out.dtype, np.float32)
+        self.assertTrue(np.allclose(out, expected, atol=0.05))
+
+        #saved int8 models load back
+        quantized.save(prefix + "_int8")
+        loaded = numpy_model.NumpyModel.load(prefix + "_int8")
+        self.assertEqual(loaded.weights[0]['W'].dtype, np.int8)
+        self.assertTrue(np.array_equal(loaded.predict(x), out))
+
+        report = quantize_model.accuracy_report(model, quantized, iterator, num_batches=2)
+        self.assertGreater(report['agreement_jaccard'], .9)
+        self.assertEqual(report['float_weight_bytes'], model.weight_bytes())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import unittest
+import numpy as np
+import theano
+import theano.tensor as T
+
+from layers.sparse_conv_3d import ActiveSiteHash, build_rulebook, filter_offsets, sparse_conv3d, sparse_conv3d_numpy
+from models.model_builder import ModelBuilder
+
+
+def dense_submanifold_conv(grid, filters, filter_size):
+    """Reference: correlation of a (batch, z, x, y, channels) grid, evaluated at its active sites only."""
+    batch_size, zdim, xdim, ydim, nchannels = grid.shape
+    out = np.zeros(grid.shape[:4] + (filters.shape[2],))
+    for b, z, x, y in zip(*np.nonzero(np.any(grid != 0, axis=-1))):
+        for k, (dz, dx, dy) in enumerate(filter_offsets(filter_size)):
+            nz, nx, ny = z + dz, x + dx, y + dy
+            if 0 <= nz < zdim and 0 <= nx < xdim and 0 <= ny < ydim:
+                out[b, z, x, y] += grid[b, nz, nx, ny].dot(filters[k])
+    return out
+
+
+class TestSparseConv3d(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.spatial_shape = (2, 6, 5, 7)
+        occupied = rng.rand(*self.spatial_shape) < 0.2
+        self.grid = rng.rand(*(self.spatial_shape + (3,))) * occupied[..., None]
+        self.sites = np.flatnonzero(occupied)
+        self.features = self.grid.reshape(-1, 3)[self.sites]
+
+    def test_hash_lookup(self):
+
+        table = ActiveSiteHash(self.sites, self.spatial_shape)
+        rows = table.lookup(np.array([table.coords[3], [0, -1, 0, 0], [1, 5, 4, 7]]))
+        self.assertEqual(list(rows), [3, -1, -1])
+
+        all_coords = np.column_stack(np.unravel_index(np.arange(np.prod(self.spatial_shape)), self.spatial_shape))
+        self.assertEqual((table.lookup(all_coords) >= 0).sum(), len(self.sites))
+
+    def test_matches_dense_reference(self):
+
+        for filter_size in (1, 2, 3):
+            filters = np.random.RandomState(1).rand(filter_size ** 3, 3, 4)
+            out = sparse_conv3d_numpy(self.features, filters, *build_rulebook(self.sites, self.spatial_shape, filter_size))
+            expected = dense_submanifold_conv(self.grid, filters, filter_size).reshape(-1, 4)[self.sites]
+            self.assertTrue(np.allclose(out, expected))
+
+    def test_gradients(self):
+
+        rulebook = [theano.shared(r) for r in build_rulebook(self.sites, self.spatial_shape, 3)]
+        filters = np.random.RandomState(1).rand(27, 3, 4)
+        theano.gradient.verify_grad(lambda f, w: sparse_conv3d(f, w, rulebook),
+                                    [self.features, filters], rng=np.random.RandomState(2))
+
+    def test_model_builder_layers(self):
+
+        input_shape = (2, 6, 3, 5, 7)
+        mb = ModelBuilder(input_shape)
+        mb.add_sparse_conv_layer(4)
+        mb.add_sparse_conv_layer(5)
+        mb.add_sparse_to_dense_layer()
+        self.assertEqual(mb.layers[-1].output_shape, (2, 6, 5, 5, 7))
+
+        f = theano.function([mb.layers[0].input], mb.layers[-1].output)
+        out = f(self.grid.transpose(0, 1, 4, 2, 3).astype(np.float32))
+
+        self.assertEqual(out.shape, (2, 6, 5, 5, 7))
+        inactive = ~np.any(self.grid != 0, axis=-1)
+        self.assertTrue(np.all(out.transpose(0, 1, 3, 4, 2)[inactive] == 0))
+        self.assertTrue(np.all(out.transpose(0, 1, 3, 4, 2)[~inactive] > 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
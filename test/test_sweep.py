@@ -0,0 +1,135 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+from utils import sweep
+from utils.sweep import State, SuccessiveHalving, grid_search, random_search, run_sweep
+
+#an experiment whose validation loss falls to learning_rate at step 100
+EXPERIMENT = """
+import os
+
+def experiment(state, channel):
+    state.threads = os.environ['OMP_NUM_THREADS']
+    if state.learning_rate < 0:
+        raise ValueError("negative learning rate")
+    for step in range(10, 101, 10):
+        loss = state.learning_rate + 1. / step
+        if not channel.report(step, loss):
+            break
+    state.score = loss
+    state.last_step = step
+    return channel.COMPLETE
+"""
+
+
+class TestSweep(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.entry_point = os.path.join(self.tmp_dir, "experiment_script.py")
+        with open(self.entry_point, 'w') as f:
+            f.write(EXPERIMENT)
+        self.db_filepath = os.path.join(self.tmp_dir, "sweep.db")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_search_spaces(self):
+
+        trials = grid_search({'a': [1, 2], 'b': ['x', 'y', 'z']}, fixed={'c': 0})
+        self.assertEqual(len(trials), 6)
+        self.assertEqual(trials[0], {'a': 1, 'b': 'x', 'c': 0})
+
+        trials = random_search({'lr': {'log_uniform': [1e-5, 1e-1]}, 'size': [16, 32], 'n': {'randint': [1, 3]}},
+                               50, seed=1)
+        self.assertEqual(trials, random_search({'lr': {'log_uniform': [1e-5, 1e-1]}, 'size': [16, 32],
+                                                'n': {'randint': [1, 3]}}, 50, seed=1))
+        self.assertTrue(all(1e-5 <= t['lr'] <= 1e-1 and t['size'] in (16, 32) and 1 <= t['n'] <= 3
+                            for t in trials))
+
+    def test_successive_halving(self):
+
+        halving = SuccessiveHalving(min_resource=10, eta=3)
+        self.assertEqual([halving.rung(step) for step in (5, 10, 29, 30, 90)], [-1, 0, 0, 1, 2])
+        #the first eta trials at a rung go on
+        self.assertTrue(halving.keep([5., 1., 9.], 9.))
+        #then the best ceil(n / eta)
+        self.assertTrue(halving.keep([5., 1., 9., 3.], 3.))
+        self.assertFalse(halving.keep([5., 1., 9., 3.], 5.))
+        self.assertTrue(SuccessiveHalving(mode='max').keep([5., 1., 9., 3.], 5.))
+
+    def test_state(self):
+
+        state = State(learning_rate=.1)
+        state.score = 2.
+        self.assertEqual(state, {'learning_rate': .1, 'score': 2.})
+        self.assertRaises(AttributeError, getattr, state, 'missing')
+
+    def test_rungs_per_entry_point(self):
+
+        db = sweep.SweepDB(self.db_filepath)
+        db.add_trials("a.py", [{'learning_rate': .1}, {'learning_rate': .2}])
+        db.add_trials("b.py", [{'learning_rate': .1}])
+        a1, a2, b1 = [t['id'] for t in db.trials()]
+
+        db.enter_rung(a1, 0, 1.)
+        self.assertEqual(db.enter_rung(b1, 0, 5.), [5.])
+        self.assertEqual(sorted(db.enter_rung(a2, 0, 2.)), [1., 2.])
+        db.close()
+
+    def test_sweeps_of_other_entry_points_are_left_alone(self):
+
+        #another sweep sharing the database, with a trial running
+        db = sweep.SweepDB(self.db_filepath)
+        db.add_trials("other.py", [{'learning_rate': .1}])
+        other_id = db.trials()[0]['id']
+        db.set_status(other_id, sweep.RUNNING)
+        db.add_report(other_id, 10, .5)
+        db.enter_rung(other_id, 0, .5)
+        db.close()
+
+        results = run_sweep(self.entry_point, grid_search({'learning_rate': [.1]}), self.db_filepath,
+                            num_workers=1, poll_interval=.05)
+        self.assertEqual([t['entry_point'] for t in results], [os.path.abspath(self.entry_point)])
+
+        db = sweep.SweepDB(self.db_filepath)
+        self.assertEqual(db.trial(other_id)['status'], sweep.RUNNING)
+        self.assertEqual(db.reports(other_id), [(10, .5)])
+        self.assertEqual(db.enter_rung(other_id, 0, .5), [.5])
+        db.close()
+
+    def test_run_sweep(self):
+
+        trials = grid_search({'learning_rate': [.3, .1, .2, .4, .5, -1.]})
+        halving = {'min_resource': 10, 'eta': 3, 'mode': 'min'}
+        results = run_sweep(self.entry_point, trials, self.db_filepath, num_workers=1, threads_per_trial=2,
+                            halving=halving, poll_interval=.05)
+
+        by_rate = dict((t['params']['learning_rate'], t) for t in results)
+        self.assertEqual(results[0]['params']['learning_rate'], .1)
+        self.assertEqual(by_rate[-1.]['status'], sweep.FAILED)
+        self.assertIn("negative learning rate", by_rate[-1.]['error'])
+        self.assertEqual(by_rate[.1]['result']['threads'], "2")
+
+        #trials run in order, one at a time: the first 3 go all the way, the
+        #4th and 5th are behind the others at the first rung
+        for rate in (.1, .2, .3):
+            self.assertEqual(by_rate[rate]['status'], sweep.COMPLETE)
+            self.assertEqual(by_rate[rate]['result']['last_step'], 100)
+        for rate in (.4, .5):
+            self.assertEqual(by_rate[rate]['status'], sweep.STOPPED)
+            self.assertEqual(by_rate[rate]['result']['last_step'], 10)
+        self.assertAlmostEqual(by_rate[.2]['score'], .21)
+
+        #running the sweep again runs nothing new
+        db = sweep.SweepDB(self.db_filepath)
+        self.assertEqual(db.add_trials(os.path.abspath(self.entry_point), trials), 0)
+        self.assertEqual(len(db.reports(by_rate[.1]['id'])), 10)
+        db.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from utils import telemetry
+from utils.telemetry import TrainingTelemetry, timed
+
+
+class TestTelemetry(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.filepath = os.path.join(self.tmp_dir, "telemetry.jsonl")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_steps(self):
+
+        recorder = TrainingTelemetry(self.filepath, window=2)
+        for iteration in xrange(3):
+            recorder.start_step()
+            with timed('data_wait'):
+                time.sleep(.02)
+                #nested phases count for themselves only
+                with timed('assembly'):
+                    time.sleep(.03)
+            with timed('compute'):
+                time.sleep(.01 * (iteration + 1))
+            record = recorder.end_step(iteration, 4, 1000, cost=1.5)
+        recorder.close()
+
+        self.assertAlmostEqual(record['data_wait'], .02, delta=.01)
+        self.assertAlmostEqual(record['assembly'], .03, delta=.01)
+        self.assertEqual(record['host_copy'], 0)
+        self.assertAlmostEqual(record['avg_compute'], .025, delta=.01)
+        self.assertAlmostEqual(record['step_time'], sum(record[name] for name in telemetry.PHASES + ('other',)))
+        self.assertAlmostEqual(record['voxels_per_s'], record['examples_per_s'] * 1000)
+        self.assertGreater(record['max_rss_mb'], 0)
+
+        with open(self.filepath) as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual([r['iteration'] for r in records], [0, 1, 2])
+        self.assertEqual(records[-1]['cost'], 1.5)
+        self.assertIn("examples/s", recorder.summary(record))
+
+    def test_disabled_outside_steps(self):
+
+        self.assertIsNone(telemetry._active)
+        with timed('data_wait'):
+            pass
+        self.assertIs(timed('compute'), telemetry._NO_TIMING)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from utils import tracing
+from utils.tracing import counter, span, traced
+
+
+@traced("square", "test")
+def square(x):
+    return x * x
+
+
+def _child():
+    with span("child", "test"):
+        square(3)
+    tracing.flush()
+
+
+class TestTracing(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, "trace.json")
+
+    def tearDown(self):
+        tracing.disable()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_disabled(self):
+
+        self.assertFalse(tracing.enabled())
+        self.assertIs(span("nothing"), tracing._NO_SPAN)
+        with span("nothing"):
+            pass
+        counter("nothing", value=1)
+        self.assertEqual(square(4), 16)
+        self.assertEqual(os.listdir(self.tmp_dir), [])
+
+    def test_threads_and_processes(self):
+
+        tracing.enable(self.path)
+        with span("outer", "test", step=1):
+            self.assertEqual(square(2), 4)
+        counter("queue", batches=3)
+
+        thread = threading.Thread(target=square, args=(5,))
+        thread.start()
+        thread.join()
+
+        process = multiprocessing.Process(target=_child)
+        process.start()
+        process.join()
+
+        tracing.flush()
+        self.assertEqual(tracing.merge(self.path), 6)
+        self.assertEqual(os.listdir(self.tmp_dir), ["trace.json"])
+
+        with open(self.path) as f:
+            events = json.load(f)['traceEvents']
+        by_name = {}
+        for event in events:
+            by_name.setdefault(event['name'], []).append(event)
+
+        outer = by_name['outer'][0]
+        self.assertEqual(outer['ph'], 'X')
+        self.assertEqual(outer['args'], {'step': 1})
+        #spans nest in time on a thread
+        inner = [e for e in by_name['square'] if e['tid'] == outer['tid'] and e['pid'] == outer['pid']][0]
+        self.assertGreaterEqual(inner['ts'], outer['ts'])
+        self.assertLessEqual(inner['ts'] + inner['dur'], outer['ts'] + outer['dur'])
+
+        self.assertEqual(by_name['queue'][0]['ph'], 'C')
+        self.assertEqual(len(set((e['pid'], e['tid']) for e in by_name['square'])), 3)
+        self.assertEqual(set(e['pid'] for e in events), {os.getpid(), process.pid})
+        #the child does not write the events its parent had buffered before the fork
+        self.assertEqual(set(e['name'] for e in events if e['pid'] == process.pid), {'child', 'square'})
+
+    def test_traced_function_keeps_compiled(self):
+
+        compiled = lambda x: x + 1
+        train = tracing.traced_function(compiled, "train")
+        self.assertIs(train.compiled, compiled)
+        wrapper = lambda x: compiled(x)
+        wrapper.compiled = compiled
+        self.assertIs(tracing.traced_function(wrapper, "train").compiled, compiled)
+
+
+if __name__ == '__main__':
+    unittest.main()